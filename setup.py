@@ -43,7 +43,8 @@ setup(
 
     keywords=['filesystem', 'symlink', 'windows', 'readlink', 'islink'],
 
-    install_requires=['six', 'jaraco.windows', 'zerotk.reraiseit'],
+    install_requires=['six', 'jaraco.windows', 'zerotk.reraiseit', 'futures; python_version < "3"'],
+    extras_require={'xxhash': ['xxhash']},
     setup_requires=['setuptools_scm', 'pytest-runner'],
     tests_require=['pytest', 'coverage'],
 )
@@ -28,3 +28,33 @@ def travis_setpass():
     print("travis encrypt --add deploy.password")
 
 
+@task
+def benchmark_hash(size_mb=512, algorithm='md5'):
+    """
+    Measures the hashing throughput of a big file, with several chunk sizes, reading into a buffer
+    and through mmap.
+    """
+    import os
+    import tempfile
+    import time
+
+    from zerotk.easyfs._easyfs import _HashFile, _NewHasher
+
+    size = int(size_mb) * 1024 * 1024
+    handle, filename = tempfile.mkstemp()
+    try:
+        with os.fdopen(handle, 'wb') as stream:
+            block = os.urandom(1024 * 1024)
+            for _i in range(size // len(block)):
+                stream.write(block)
+
+        print("%-10s %12s %12s" % ("chunk", "readinto", "mmap"))
+        for i_chunk_size in (8 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024):
+            throughputs = []
+            for i_use_mmap in (False, True):
+                start = time.time()
+                _HashFile(filename, [_NewHasher(algorithm)], chunk_size=i_chunk_size, use_mmap=i_use_mmap)
+                throughputs.append(size / (1024.0 * 1024.0) / (time.time() - start))
+            print("%-10s %9.1f MB/s %9.1f MB/s" % (("%dK" % (i_chunk_size // 1024),) + tuple(throughputs)))
+    finally:
+        os.remove(filename)
@@ -10,6 +10,28 @@ from zerotk.easyfs import *
 from zerotk.easyfs._exceptions import *
 
 
+#===================================================================================================
+# hash_spy
+#===================================================================================================
+@pytest.fixture
+def hash_spy(monkeypatch):
+    '''
+    Records the files hashed (by _HashFile), in order.
+
+    :rtype: list(unicode)
+    '''
+    import zerotk.easyfs._easyfs
+
+    hashed = []
+    original_hash_file = zerotk.easyfs._easyfs._HashFile
+    def HashFile(filename, hashers, **kwargs):
+        hashed.append(filename)
+        return original_hash_file(filename, hashers, **kwargs)
+    monkeypatch.setattr(zerotk.easyfs._easyfs, '_HashFile', HashFile)
+    return hashed
+
+
+
 #===================================================================================================
 # Test
 #===================================================================================================
@@ -121,6 +143,474 @@ class Test:
         assert GetFileContents(filename + '.md5') == '098f6bcd4621d373cade4e832627b4f6'
 
 
+    def testDigestCache(self, embed_data, monkeypatch, hash_spy):
+        import hashlib
+        import zerotk.easyfs._easyfs
+
+        filename = embed_data['cache/file']
+        CreateFile(filename, contents='test')
+        database = embed_data['cache/digests.db']
+        hashed = hash_spy
+
+        with DigestCache(database) as cache:
+            assert Md5Hex(filename, cache=cache) == '098f6bcd4621d373cade4e832627b4f6'
+            assert Md5Hex(filename, cache=cache) == '098f6bcd4621d373cade4e832627b4f6'
+            assert cache.GetDigest(filename, 'sha1') == hashlib.sha1(b'test').hexdigest()
+            assert len(hashed) == 2
+
+        # Persistent: unchanged files are not hashed again
+        with DigestCache(database) as cache:
+            CreateMD5(filename, cache=cache)
+            assert GetFileContents(filename + '.md5') == '098f6bcd4621d373cade4e832627b4f6'
+            assert len(hashed) == 2
+
+            # Changed files are
+            CreateFile(filename, contents='changed')
+            assert Md5Hex(filename, cache=cache) == Md5Hex(contents=b'changed')
+            assert len(hashed) == 3
+            assert len(cache) == 2
+
+            # Explicit invalidation
+            cache.Invalidate(filename)
+            assert len(cache) == 0
+            Md5Hex(filename, cache=cache)
+            assert len(hashed) == 4
+
+            cache.Invalidate()
+            assert len(cache) == 0
+
+            # New digests are committed in batches
+            def CountCommitted():
+                with DigestCache(database) as other:
+                    return len(other)
+            Md5Hex(filename, cache=cache)
+            assert CountCommitted() == 0
+            cache.Flush()
+            assert CountCommitted() == 1
+            list(HashFiles([filename], 'sha1', cache=cache))
+            assert CountCommitted() == 2
+
+        # Least recently used entries are evicted
+        with DigestCache(max_entries=2) as cache:
+            for i in range(3):
+                CreateFile(embed_data['cache/%d' % i], contents='%d' % i)
+                Md5Hex(embed_data['cache/%d' % i], cache=cache)
+            assert len(cache) == 2
+            del hashed[:]
+            Md5Hex(embed_data['cache/1'], cache=cache)
+            Md5Hex(embed_data['cache/0'], cache=cache)
+            assert hashed == [embed_data['cache/0']]
+            Md5Hex(embed_data['cache/1'], cache=cache)  # Kept by its recent hit
+            assert hashed == [embed_data['cache/0']]
+
+            stream = six.StringIO()
+            DumpDirHashToStringIO(embed_data['cache'], stream, include='*/[0-9]', cache=cache)
+            assert sorted(stream.getvalue().splitlines()) == [
+                '%d=%s' % (i, Md5Hex(contents=six.b('%d' % i))) for i in range(3)
+            ]
+
+        # Reading a file may update its access time, that doesn't prevent caching its digest
+        os.utime(filename, (1000, 1000))
+        hash_file = zerotk.easyfs._easyfs._HashFile
+        def HashFileUpdatingAccessTime(filename, hashers, **kwargs):
+            hash_file(filename, hashers, **kwargs)
+            os.utime(filename, (2000, 1000))
+        monkeypatch.setattr(zerotk.easyfs._easyfs, '_HashFile', HashFileUpdatingAccessTime)
+
+        with DigestCache() as cache:
+            del hashed[:]
+            Md5Hex(filename, cache=cache)
+            Md5Hex(filename, cache=cache)
+            assert hashed == [filename]
+
+
+    @pytest.mark.parametrize('use_processes', [False, True])
+    def testHashFiles(self, embed_data, use_processes):
+        import hashlib
+
+        filenames = []
+        for i in range(20):
+            filenames.append(embed_data['hash_files/%02d' % i])
+            CreateFile(filenames[-1], contents='%d' % i * (i * 1000))
+        expected = [(i, hashlib.sha256(GetFileContents(i, binary=True)).hexdigest()) for i in filenames]
+
+        # Input order, consuming a generator
+        obtained = HashFiles(
+            (i for i in filenames),
+            algorithm='sha256',
+            workers=3,
+            use_processes=use_processes,
+        )
+        assert list(obtained) == expected
+
+        # Completion order
+        obtained = HashFiles(filenames, 'sha256', workers=3, ordered=False, use_processes=use_processes)
+        assert sorted(obtained) == expected
+
+        # Cached digests, only with threads
+        with DigestCache() as cache:
+            if use_processes:
+                with pytest.raises(ValueError):
+                    list(HashFiles(filenames, 'sha256', use_processes=True, cache=cache))
+            else:
+                assert list(HashFiles(filenames, 'sha256', cache=cache)) == expected
+                assert len(cache) == len(filenames)
+
+        with pytest.raises(ValueError):
+            list(HashFiles(filenames, 'unknown'))
+
+
+    def testHashAlgorithms(self, embed_data):
+        import hashlib
+
+        filename = embed_data['algorithms/file']
+        CreateFile(filename, contents='test')
+
+        assert HashHex(filename) == Md5Hex(filename) == '098f6bcd4621d373cade4e832627b4f6'
+        assert HashHex(filename, algorithm='sha256') == hashlib.sha256(b'test').hexdigest()
+        assert HashHex(contents=b'test', algorithm='blake2b') == hashlib.blake2b(b'test').hexdigest()
+        with pytest.raises(ValueError):
+            HashHex(filename, algorithm='unknown')
+
+        try:
+            import xxhash
+        except ImportError:
+            with pytest.raises(ValueError):
+                HashHex(filename, algorithm='xxh3')
+        else:
+            assert HashHex(filename, algorithm='xxh3') == xxhash.xxh3_64(b'test').hexdigest()
+
+        # Hash files record the algorithm, unless it's md5
+        CreateMD5(filename, algorithm='sha256')
+        assert GetFileContents(filename + '.md5') == 'sha256:' + hashlib.sha256(b'test').hexdigest()
+
+        # md5_check compares the algorithm too
+        target_filename = embed_data['algorithms/target']
+        CopyFile(filename, target_filename, md5_check=True)
+        assert CopyFile(filename, target_filename, md5_check=True) == MD5_SKIP
+
+        CreateMD5(target_filename)  # Same contents, hashed with md5
+        assert CopyFile(filename, target_filename, md5_check=True) is None
+        assert GetFileContents(target_filename + '.md5').startswith('sha256:')
+
+
+    def testHashLargeFiles(self, embed_data, monkeypatch):
+        import hashlib
+        import zerotk.easyfs._easyfs
+
+        filename = embed_data['large/file']
+        contents = os.urandom(3 * COPY_BUFFER_SIZE + 7)
+        CreateFile(filename, contents, binary=True)
+        expected = hashlib.md5(contents).hexdigest()
+
+        # Both ways, with several chunk sizes
+        for i_use_mmap in (True, False):
+            for i_chunk_size in (None, 1000, 4 * COPY_BUFFER_SIZE):
+                md5 = hashlib.md5()
+                zerotk.easyfs._easyfs._HashFile(filename, [md5], chunk_size=i_chunk_size, use_mmap=i_use_mmap)
+                assert md5.hexdigest() == expected
+
+        # Empty files can't be mapped: read instead
+        CreateFile(embed_data['large/empty'], contents='')
+        md5 = hashlib.md5()
+        zerotk.easyfs._easyfs._HashFile(embed_data['large/empty'], [md5], use_mmap=True)
+        assert md5.hexdigest() == hashlib.md5().hexdigest()
+
+        # Chosen by the file size, when enabled
+        mapped = []
+        original_hash_memory_map = zerotk.easyfs._easyfs._HashMemoryMap
+        def HashMemoryMap(stream, hashers, chunk_size=None):
+            mapped.append(stream.name)
+            return original_hash_memory_map(stream, hashers, chunk_size)
+        monkeypatch.setattr(zerotk.easyfs._easyfs, '_HashMemoryMap', HashMemoryMap)
+        assert Md5Hex(filename) == expected
+        assert mapped == []  # Opt-in
+
+        monkeypatch.setattr(zerotk.easyfs._easyfs, 'HASH_MMAP_THRESHOLD', 2 * COPY_BUFFER_SIZE)
+
+        assert Md5Hex(filename, chunk_size=64 * 1024) == expected
+        assert Md5Hex(embed_data['large/empty']) == hashlib.md5().hexdigest()
+        assert mapped == [filename]
+
+
+    def testHashDirectory(self, embed_data, hash_spy):
+        directory = embed_data['complex_tree']
+        CreateFile(directory + '/subdir_2/2.1', contents='twenty-one')
+        hashed = hash_spy
+
+        tree = HashDirectory(directory)
+        assert len(hashed) == 5
+        assert tree.kind == 'directory'
+        assert tree.Get('subdir_2/2.1').digest == Md5Hex(contents=b'twenty-one')
+        assert tree.Get('subdir_1/subsubdir_1').kind == 'directory'
+        assert tree.Get('missing') is None
+
+        # Same contents, same digest
+        CopyDirectory(directory, embed_data['copy'])
+        assert HashDirectory(embed_data['copy']).digest == tree.digest
+
+        # Unchanged: nothing is hashed again (even through JSON)
+        del hashed[:]
+        previous = DirectoryHash.FromJson(tree.ToJson())
+        assert HashDirectory(directory, previous=previous).digest == tree.digest
+        assert hashed == []
+
+        # Only the changed file is hashed, and the change reaches the root
+        CreateFile(directory + '/subdir_1/subsubdir_1/1.1.1', contents='changed')
+        new_tree = HashDirectory(directory, previous=tree)
+        assert hashed == [os.path.join(directory, 'subdir_1', 'subsubdir_1', '1.1.1')]
+        assert new_tree.digest != tree.digest
+        assert new_tree.Get('subdir_1').digest != tree.Get('subdir_1').digest
+        assert new_tree.Get('subdir_2').digest == tree.Get('subdir_2').digest
+
+        # Removing an entry changes the digest too
+        DeleteFile(directory + '/1')
+        assert HashDirectory(directory, previous=new_tree).digest != new_tree.digest
+
+        # FIFOs are not read (that would block)
+        if hasattr(os, 'mkfifo'):
+            os.mkfifo(directory + '/fifo')
+            assert HashDirectory(directory).Get('fifo').kind == 'special'
+
+        with pytest.raises(DirectoryNotFoundError):
+            HashDirectory(embed_data['missing'])
+
+
+    def testManifestDiff(self, embed_data, hash_spy):
+        import time
+
+        directory = embed_data['complex_tree']
+        subdirectory = directory + '/subdir_2'
+        CreateFile(subdirectory + '/2.1', contents='twenty-one')
+
+        def DumpManifest():
+            stream = six.StringIO()
+            DumpDirHashToStringIO(directory, stream)
+            DumpDirHashToStringIO(subdirectory, stream, base='subdir_2')
+            return stream.getvalue()
+
+        manifest = Manifest.Parse(DumpManifest())
+        assert manifest.names == ['1', '2', 'subdir_2/2.1']
+        assert manifest.Get('subdir_2/2.1') == Md5Hex(contents=b'twenty-one')
+        assert 'missing' not in manifest
+        assert not DiffManifestWithDirectory(manifest, directory)
+
+        # Change the tree
+        CreateFile(directory + '/1', contents='changed')
+        DeleteFile(directory + '/2')
+        CreateFile(subdirectory + '/2.2', contents='new')
+
+        expected = (['subdir_2/2.2'], ['2'], ['1'])
+        diff = DiffManifests(manifest, Manifest.Parse(DumpManifest()))
+        assert (diff.added, diff.removed, diff.changed) == expected
+
+        diff = DiffManifestWithDirectory(manifest, directory)
+        assert (diff.added, diff.removed, diff.changed) == expected
+
+        diff = DiffManifestWithDirectory(manifest, subdirectory, base='subdir_2')
+        assert (diff.added, diff.removed, diff.changed) == (['subdir_2/2.2'], [], [])
+
+        # Stat first: files older than the manifest are not hashed
+        del hash_spy[:]
+
+        old_time = time.time() - 60
+        os.utime(subdirectory + '/2.1', (old_time, old_time))
+        diff = DiffManifestWithDirectory(manifest, directory, trust_before=time.time() - 30)
+        assert (diff.added, diff.removed, diff.changed) == expected
+        assert [os.path.basename(i) for i in hash_spy] == ['1']
+
+        # Loaded from a file, stamped with its modification time
+        CreateFile(embed_data['manifest.txt'], DumpManifest())
+        assert Manifest.Load(embed_data['manifest.txt']).timestamp == GetMTime(embed_data['manifest.txt'])
+
+
+    def testCopyFilesMd5Manifest(self, embed_data):
+        source_dir = embed_data['complex_tree']
+        target_dir = embed_data['manifest_target']
+        CreateFile(source_dir + '/subdir_2/2.1', contents='twenty-one')
+
+        manifest_filename = CreateMD5Manifest(source_dir)
+        assert manifest_filename == os.path.join(source_dir, MD5_MANIFEST_FILENAME)
+        manifest = Manifest.Load(manifest_filename)
+        assert manifest.names == ['1', '2', 'subdir_1/subsubdir_1/1.1.1', 'subdir_1/subsubdir_1/1.1.2', 'subdir_2/2.1']
+        assert manifest.Get('subdir_2/2.1') == Md5Hex(contents=b'twenty-one')
+
+        # The first copy writes the target manifest, the manifests are not copied as files
+        stats = CopyStats()
+        CopyFiles(source_dir, target_dir, create_target_dir=True, md5_check='manifest', stats=stats)
+        assert stats.files_copied == 5
+        assert GetFileContents(target_dir + '/' + MD5_MANIFEST_FILENAME) == GetFileContents(manifest_filename)
+        assert not any(i.endswith('.md5') for i in FindFiles(target_dir))
+
+        # Nothing changed: everything is skipped, in parallel or mirroring too
+        for i_kwargs in ({}, {'workers': 2}, {'mirror': True}):
+            stats = CopyStats()
+            CopyFiles(source_dir, target_dir, md5_check='manifest', stats=stats, **i_kwargs)
+            assert (stats.files_copied, stats.files_skipped, stats.files_deleted) == (0, 5, 0)
+        assert IsFile(target_dir + '/' + MD5_MANIFEST_FILENAME)
+
+        # Only changed files (by their md5 in the source manifest) are copied
+        CreateFile(source_dir + '/1', contents='changed')
+        CreateMD5Manifest(source_dir)
+        stats = CopyStats()
+        CopyFiles(source_dir, target_dir, md5_check='manifest', stats=stats)
+        assert (stats.files_copied, stats.files_skipped) == (1, 4)
+        assert GetFileContents(target_dir + '/1') == 'changed'
+        assert Manifest.Load(target_dir + '/' + MD5_MANIFEST_FILENAME).Get('1') == Md5Hex(contents=b'changed')
+
+        # Missing targets are copied again
+        DeleteFile(target_dir + '/2')
+        check = Md5ManifestCheck(source_dir, target_dir)
+        assert CopyFile(source_dir + '/1', target_dir + '/1', md5_check=check) == MD5_SKIP
+        assert CopyFile(source_dir + '/2', target_dir + '/2', md5_check=check) is None
+        check.Save()
+        assert IsFile(target_dir + '/2')
+
+
+    @pytest.mark.skipif("not hasattr(os, 'link')")
+    def testDeduplicateTree(self, embed_data):
+        directory = embed_data['dedup']
+        big = os.urandom(DEDUPLICATE_PARTIAL_SIZE + 10)
+        CreateFile(directory + '/a', contents='same')
+        CreateFile(directory + '/b', contents='same')
+        CreateFile(directory + '/sub/c', contents='same')
+        CreateFile(directory + '/d', contents='diff')
+        CreateFile(directory + '/big1', big, binary=True)
+        CreateFile(directory + '/big2', big, binary=True)
+        CreateFile(directory + '/big3', big[:-1] + b'!', binary=True)  # Only the end differs
+        os.link(directory + '/a', directory + '/a_link')  # Already linked
+        os.link(directory + '/b', directory + '/b_link')  # Replaced along with b
+        os.link(directory + '/big2', embed_data['big2_outside'])  # Keeps big2 data alive
+        CreateFile(directory + '/empty1', contents='')
+        CreateFile(directory + '/empty2', contents='')
+
+        # Dry run
+        report = DeduplicateTree(directory, dry_run=True)
+        assert report.groups == [
+            [directory + '/a', directory + '/b', directory + '/sub/c'],
+            [directory + '/big1', directory + '/big2'],
+        ]
+        assert (report.files_linked, report.bytes_reclaimed) == (4, 8)
+        assert not os.path.samefile(directory + '/a', directory + '/b')
+
+        report = DeduplicateTree(directory, mode='hard')
+        assert (report.files_linked, report.bytes_reclaimed) == (4, 8)
+        assert os.path.samefile(directory + '/a', directory + '/sub/c')
+        assert os.path.samefile(directory + '/a', directory + '/b_link')
+        assert not os.path.samefile(directory + '/big2', embed_data['big2_outside'])
+        assert os.path.samefile(directory + '/big1', directory + '/big2')
+        assert not os.path.samefile(directory + '/big1', directory + '/big3')
+        assert GetFileContents(directory + '/b') == 'same'
+        assert set(ListFiles(directory)) == set(
+            ['a', 'a_link', 'b', 'b_link', 'sub', 'd', 'big1', 'big2', 'big3', 'empty1', 'empty2']
+        )
+
+        # Nothing left to do
+        report = DeduplicateTree(directory)
+        assert (report.groups, report.bytes_reclaimed) == ([], 0)
+
+        # Reflinks keep the files independent
+        CreateFile(embed_data['reflink/1'], big, binary=True)
+        CreateFile(embed_data['reflink/2'], big, binary=True)
+        try:
+            report = DeduplicateTree(embed_data['reflink'], mode='reflink')
+        except CloneNotSupportedError:
+            pass  # Not supported by this filesystem: no temporary files left behind
+        else:
+            assert report.bytes_reclaimed == len(big)
+            assert not os.path.samefile(embed_data['reflink/1'], embed_data['reflink/2'])
+        assert sorted(ListFiles(embed_data['reflink'])) == ['1', '2']
+
+
+    def testQuickFingerprint(self, embed_data, hash_spy):
+
+        source_filename = embed_data['quick/source']
+        target_filename = embed_data['quick/target']
+        contents = bytearray(os.urandom(4 * QUICK_FINGERPRINT_SAMPLE_SIZE))
+        CreateFile(source_filename, bytes(contents), binary=True)
+
+        fingerprint = QuickFingerprint(source_filename)
+        assert fingerprint.startswith('%d:' % len(contents))
+        assert QuickFingerprint(source_filename, sample_size=len(contents)) == \
+            '%d:%s' % (len(contents), Md5Hex(source_filename))
+        assert not IsQuickFingerprintComplete(source_filename)
+
+        # A change in a sample changes the fingerprint, a change outside of them doesn't
+        samples = [
+            (0, True),
+            (2 * QUICK_FINGERPRINT_SAMPLE_SIZE, True),
+            (QUICK_FINGERPRINT_SAMPLE_SIZE + 10, False),  # Between the first and middle samples
+        ]
+        for i_offset, i_changes_fingerprint in samples:
+            changed = bytearray(contents)
+            changed[i_offset] ^= 0xff
+            CreateFile(target_filename, bytes(changed), binary=True)
+            assert (QuickFingerprint(target_filename) != fingerprint) == i_changes_fingerprint
+
+        # md5_check modes comparing the files themselves
+        hashed = hash_spy
+        del hashed[:]
+
+        assert CopyFile(source_filename, target_filename, md5_check='quick') == MD5_SKIP  # Fooled
+        assert hashed == []
+        assert CopyFile(source_filename, target_filename, md5_check='full') is None
+        assert hashed == [source_filename, target_filename]
+        assert CopyFile(source_filename, target_filename, md5_check='full') == MD5_SKIP
+        assert CopyFile(source_filename, embed_data['quick/missing'], md5_check='quick') is None
+
+        # In the tree operations too
+        stats = CopyStats()
+        CopyFiles(embed_data['quick'], embed_data['quick_copy'], create_target_dir=True, md5_check='quick')
+        CopyFiles(embed_data['quick'], embed_data['quick_copy'], md5_check='quick', stats=stats)
+        assert (stats.files_copied, stats.files_skipped) == (0, 3)
+
+        stats = CopyDirectory(embed_data['quick'], embed_data['quick_copy'], incremental=True, compare='quick')
+        assert (stats.files_copied, stats.files_skipped) == (0, 3)
+
+
+    def testHashStream(self, embed_data):
+        import hashlib
+        import io
+
+        filename = embed_data['hash_stream/data.txt']
+        contents = b'line 1\nline 2\n' * 1000
+        CreateFile(filename, contents, binary=True)
+        expected_md5 = hashlib.md5(contents).hexdigest()
+        expected_sha1 = hashlib.sha1(contents).hexdigest()
+
+        # Open binary files, streams without readinto and chunk iterables
+        with io.open(filename, 'rb') as stream:
+            assert Md5Hex(stream=stream, chunk_size=100) == expected_md5
+
+        class Stream(object):
+            def __init__(self, data):
+                self._stream = io.BytesIO(data)
+            def read(self, size):
+                return self._stream.read(size)
+        assert Md5Hex(stream=Stream(contents), chunk_size=100) == expected_md5
+        assert HashHex(stream=iter([contents[:7], b'', contents[7:]]), algorithm='sha1') == expected_sha1
+        assert Md5Hex(stream=[]) == hashlib.md5(b'').hexdigest()
+
+        # Hashing while reading
+        with OpenFile(filename, binary=True, hash_algorithm='sha1') as stream:
+            assert isinstance(stream, HashingReader)
+            assert stream.readline() == b'line 1\n'
+            assert stream.HexDigest() == hashlib.sha1(b'line 1\n').hexdigest()
+            assert b''.join(stream) == contents[7:]
+            assert stream.HexDigest() == expected_sha1
+
+        with OpenFile(filename, hash_algorithm='md5') as stream:
+            assert stream.read() == contents.decode('ascii')
+            assert stream.buffer.HexDigest() == expected_md5
+
+        with HashingReader(io.open(filename, 'rb')) as stream:
+            buffer_ = bytearray(10)
+            assert stream.readinto(buffer_) == 10
+            assert stream.HexDigest() == hashlib.md5(contents[:10]).hexdigest()
+            assert stream.read() == contents[10:]
+            assert stream.HexDigest() == expected_md5
+        assert stream.closed
+
     def testCopyFileWithMd5(self, embed_data):
         source_filename = embed_data['md5/file']
         source_filename_md5 = embed_data['md5/file.md5']
@@ -302,6 +792,109 @@ class Test:
         )
         CheckFiles(copied_files)
 
+        # Target inside the source: the copies are not copied again --------------------------------
+        for i_workers in (None, 2):
+            backup_dir = base_dir + 'subdir_2/backup_%s' % (i_workers,)
+            source_count = sum(len(i_filenames) for _, _, i_filenames in os.walk(base_dir))
+            copied_files = CopyFilesX([(backup_dir, '+' + base_dir + '*')], workers=i_workers)
+            assert len(copied_files) == source_count
+            CheckFiles(copied_files)
+            assert not os.path.exists(backup_dir + '/subdir_2/backup_%s' % (i_workers,))
+
+
+    def testPlanCopyFilesX(self, embed_data):
+        base_dir = embed_data['complex_tree'] + '/'
+        CreateFile(base_dir + 'subdir_2/2.1', contents='twenty-one')
+
+        plan = PlanCopyFilesX([(embed_data['all'], '+' + base_dir + '*')])
+        assert plan.file_count == 5
+        assert plan.total_bytes == sum(os.path.getsize(i) for i, _ in plan.operations)
+        assert plan.directories == [
+            embed_data['all'],
+            embed_data['all/subdir_1/subsubdir_1'],
+            embed_data['all/subdir_2'],
+        ]
+        assert not Exists(embed_data['all'])
+
+        # Plans survive serialization
+        loaded_plan = CopyPlan.FromJson(plan.ToJson())
+        assert loaded_plan.operations == plan.operations
+        assert loaded_plan.total_bytes == plan.total_bytes
+
+        # Split in balanced parts
+        parts = plan.Split(2)
+        assert len(parts) == 2
+        assert sorted(sum([i.operations for i in parts], [])) == sorted(plan.operations)
+        assert parts[0].total_bytes + parts[1].total_bytes == plan.total_bytes
+
+        # Execute, serial or in parallel
+        stats = CopyStats()
+        loaded_plan.Execute(stats=stats)
+        parts[0].Execute(workers=2)
+        assert stats.files_copied == 5
+        for i_source, i_target in plan.operations:
+            embed_data.assert_equal_files(i_source, i_target)
+
+        # Links are copied as links, even dangling ones
+        CreateFile(embed_data['links/file'], contents='file')
+        CreateLink('missing', embed_data['links/dangling'])
+        plan = PlanCopyFilesX([(embed_data['links_copy'], '+' + embed_data['links'] + '/*')])
+        assert plan.total_bytes == len('file') + len('missing')
+        plan.Execute()
+        assert ReadLink(embed_data['links_copy/dangling']) == 'missing'
+
+
+    def testProgressReporter(self, embed_data):
+        source_dir = embed_data['complex_tree']
+        CreateFile(source_dir + '/subdir_2/2.1', contents='twenty-one')
+        tree_files, tree_bytes = 5, sum(
+            os.path.getsize(os.path.join(i_dirpath, i_filename))
+            for i_dirpath, _, i_filenames in os.walk(source_dir)
+            for i_filename in i_filenames
+        )
+
+        reports = []
+        def OnProgress(reporter):
+            reports.append(
+                (reporter.files_done, reporter.files_total, reporter.bytes_done,
+                reporter.bytes_total, reporter.finished)
+            )
+
+        def CheckReports(files_total, bytes_total):
+            assert reports[-1] == (files_total, files_total, bytes_total, bytes_total, True)
+            assert [i[-1] for i in reports].count(True) == 1
+            del reports[:]
+
+        progress = ProgressReporter(OnProgress, interval=0)
+
+        CopyFile(source_dir + '/subdir_2/2.1', embed_data['file_copy'], progress=progress)
+        CheckReports(1, 10)
+
+        CopyFiles(source_dir + '/*', embed_data['files'], create_target_dir=True, progress=progress)
+        CheckReports(tree_files, tree_bytes)
+
+        CopyFilesX([(embed_data['x'], '+' + source_dir + '/*')], workers=2, progress=progress)
+        CheckReports(tree_files, tree_bytes)
+
+        CopyDirectory(source_dir, embed_data['tree'], progress=progress)
+        CheckReports(tree_files, tree_bytes)
+
+        # Nothing changed: all files are skipped, but still reported
+        CopyDirectory(source_dir, embed_data['tree'], incremental=True, progress=progress)
+        CheckReports(tree_files, tree_bytes)
+
+        # A plain callback is accepted as well
+        DeleteDirectory(embed_data['tree'], progress=OnProgress)
+        CheckReports(tree_files, tree_bytes)
+        assert not Exists(embed_data['tree'])
+
+        # Links are copied (and reported) as links, even dangling ones
+        CreateLink('missing', source_dir + '/dangling')
+        CopyFiles(source_dir, embed_data['with_link'], create_target_dir=True, progress=progress)
+        CheckReports(tree_files + 1, tree_bytes + len('missing'))
+        CopyFilesX([(embed_data['with_link_x'], '+' + source_dir + '/*')], progress=progress)
+        CheckReports(tree_files + 1, tree_bytes + len('missing'))
+
 
     def testCopyFiles(self, embed_data):
         source_dir = embed_data['files/source']
@@ -330,6 +923,131 @@ class Test:
             CopyFiles(embed_data['source'], 'ERROR://target')
 
 
+    def testCopyFilesParallel(self, embed_data):
+        source_dir = embed_data['complex_tree']
+        target_dir = embed_data['parallel']
+
+        CopyFiles(source_dir, target_dir, create_target_dir=True, workers=4)
+
+        for i in ('', '/subdir_1', '/subdir_1/subsubdir_1', '/subdir_2'):
+            assert set(ListFiles(target_dir + i)) == set(ListFiles(source_dir + i))
+        embed_data.assert_equal_files(source_dir + '/subdir_2/2.1', target_dir + '/subdir_2/2.1')
+
+        # CopyFilesX returns the same list, in the same order, when copying in parallel
+        base_dir = embed_data['complex_tree'] + '/'
+        serial_files = CopyFilesX([(embed_data['serial_x'], '+' + base_dir + '*')])
+        parallel_files = CopyFilesX([(embed_data['serial_x'], '+' + base_dir + '*')], workers=4)
+        assert parallel_files == serial_files
+        for i_source, i_target in parallel_files:
+            embed_data.assert_equal_files(i_source, i_target)
+
+        # Errors are raised just like in the serial copy
+        CreateDirectory(embed_data['blocked/1'])  # A directory where the file "1" should go
+        with pytest.raises(EnvironmentError):
+            CopyFilesX([(embed_data['blocked'], base_dir + '*')], workers=2)
+
+
+    def testCopyFilesStreaming(self, embed_data, monkeypatch):
+        import zerotk.easyfs._easyfs
+
+        source_dir = embed_data['streaming/source']
+        for i in range(20):
+            CreateFile('%s/%02d' % (source_dir, i), contents='%d' % i)
+        CreateFile(source_dir + '/subdir/sub', contents='sub')
+
+        # Count the entries scanned when each copy starts
+        scanned = []
+        original_is_dir = zerotk.easyfs._easyfs.IsDir
+        def IsDir(path):
+            if path.startswith(source_dir + '/'):
+                scanned.append(path)
+            return original_is_dir(path)
+
+        copies = []
+        original_copy_file = zerotk.easyfs._easyfs.CopyFile
+        def CopyFile(source_filename, target_filename, **kwargs):
+            copies.append(len(scanned))
+            return original_copy_file(source_filename, target_filename, **kwargs)
+
+        monkeypatch.setattr(zerotk.easyfs._easyfs, 'IsDir', IsDir)
+        monkeypatch.setattr(zerotk.easyfs._easyfs, 'CopyFile', CopyFile)
+        monkeypatch.setattr(zerotk.easyfs._easyfs, 'COPY_QUEUE_SIZE', 1)
+
+        # The copies start while scanning, never getting far behind it
+        CopyFiles(source_dir, embed_data['streaming/target'], create_target_dir=True, workers=1)
+        assert len(copies) == 21
+        assert copies[0] < len(scanned)
+        assert all(i_scanned - i_copied <= 3 for i_copied, i_scanned in enumerate(copies))
+        for i in ('', '/subdir'):
+            assert set(ListFiles(embed_data['streaming/target' + i])) == set(ListFiles(source_dir + i))
+
+        # FindFiles as a generator
+        found_files = IterFindFiles(source_dir, ['0*'])
+        first_file = next(found_files)
+        assert sorted([first_file] + list(found_files)) == sorted(FindFiles(source_dir, ['0*']))
+
+
+    @pytest.mark.parametrize('workers', [None, 2])
+    def testCopyFilesMirror(self, embed_data, workers):
+        source_dir = embed_data['complex_tree']
+        target_dir = embed_data['mirror']
+        CopyFiles(source_dir, target_dir, create_target_dir=True)
+
+        # Stale entries, and entries that changed type
+        CreateFile(target_dir + '/stale', contents='')
+        CreateFile(target_dir + '/subdir_1/stale_dir/stale', contents='')
+        DeleteFile(target_dir + '/2')
+        CreateFile(target_dir + '/2/directory_in_place_of_a_file', contents='')
+        DeleteDirectory(target_dir + '/subdir_2')
+        CreateFile(target_dir + '/subdir_2', contents='file in place of a directory')
+
+        stats = CopyStats()
+        CopyFiles(source_dir, target_dir, mirror=True, workers=workers, stats=stats)
+        for i in ('', '/subdir_1', '/subdir_1/subsubdir_1', '/subdir_2'):
+            assert set(ListFiles(target_dir + i)) == set(ListFiles(source_dir + i))
+        assert (stats.files_deleted, stats.directories_deleted) == (2, 2)
+
+        # Only the entries matching the mask are mirrored
+        CreateFile(target_dir + '/stale.txt', contents='')
+        CreateFile(target_dir + '/kept', contents='')
+        CopyFiles(source_dir + '/*.txt', target_dir, mirror=True, workers=workers)
+        assert not Exists(target_dir + '/stale.txt')
+        assert Exists(target_dir + '/kept')
+
+
+    @pytest.mark.skipif("not hasattr(os, 'link')")
+    def testCopyFilesHardLink(self, embed_data, monkeypatch):
+        source_dir = embed_data['complex_tree']
+        base_dir = source_dir + '/'
+
+        stats = CopyStats()
+        CopyFiles(source_dir, embed_data['hard'], create_target_dir=True, link_mode='hard', stats=stats)
+        assert (stats.files_linked, stats.files_copied, stats.bytes_copied) == (5, 0, 0)
+        assert os.path.samefile(source_dir + '/subdir_2/2.1', embed_data['hard/subdir_2/2.1'])
+
+        # Linking again replaces existing targets
+        CreateFile(embed_data['auto/1'], contents='old')
+        stats = CopyStats()
+        copied_files = CopyFilesX([(embed_data['auto'], '+' + base_dir + '*')], link_mode='auto', stats=stats)
+        assert stats.files_linked == len(copied_files) == 5
+        for i_source, i_target in copied_files:
+            assert os.path.samefile(i_source, i_target)
+
+        # Across devices 'auto' copies, while 'hard' fails
+        def CrossDeviceLink(source, target):
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+        monkeypatch.setattr(os, 'link', CrossDeviceLink)
+
+        stats = CopyStats()
+        CopyFiles(source_dir, embed_data['copied'], create_target_dir=True, link_mode='auto', stats=stats)
+        assert (stats.files_linked, stats.files_copied) == (0, 5)
+        assert not os.path.samefile(source_dir + '/1', embed_data['copied/1'])
+        embed_data.assert_equal_files(source_dir + '/1', embed_data['copied/1'])
+
+        with pytest.raises(OSError):
+            CopyFile(source_dir + '/1', embed_data['failed/1'], link_mode='hard')
+
+
     @pytest.mark.symlink
     def testCopyFileSymlink(self, embed_data):
         # Create a file
@@ -589,6 +1307,49 @@ class Test:
             assert set(ListFiles(target_dir + i)) == set(ListFiles(source_dir + i))
 
 
+    def testCopyDirectoryIncremental(self, embed_data):
+        source_dir = embed_data['complex_tree']
+        target_dir = embed_data['complex_tree_copy']
+
+        # First synchronization copies everything
+        stats = CopyDirectory(source_dir, target_dir, incremental=True)
+        assert stats.files_copied == 5
+        assert stats.files_skipped == 0
+        assert stats.directories_created == 4
+        for i in ('', '/subdir_1', '/subdir_1/subsubdir_1', '/subdir_2'):
+            assert set(ListFiles(target_dir + i)) == set(ListFiles(source_dir + i))
+
+        # Nothing changed: nothing copied
+        stats = CopyDirectory(source_dir, target_dir, incremental=True)
+        assert (stats.files_copied, stats.files_skipped) == (0, 5)
+
+        # Changed and new files are copied, extra target files are kept unless pruning
+        CreateFile(source_dir + '/1', contents='changed contents')
+        CreateFile(source_dir + '/subdir_2/new', contents='new')
+        CreateFile(target_dir + '/extra', contents='extra')
+        CreateDirectory(target_dir + '/extra_dir/sub')
+        stats = CopyDirectory(source_dir, target_dir, incremental=True)
+        assert (stats.files_copied, stats.files_skipped, stats.files_deleted) == (2, 4, 0)
+        embed_data.assert_equal_files(source_dir + '/1', target_dir + '/1')
+        embed_data.assert_equal_files(source_dir + '/subdir_2/new', target_dir + '/subdir_2/new')
+        assert IsFile(target_dir + '/extra')
+
+        stats = CopyDirectory(source_dir, target_dir, incremental=True, prune=True)
+        assert (stats.files_copied, stats.files_deleted, stats.directories_deleted) == (0, 1, 1)
+        assert not Exists(target_dir + '/extra')
+        assert not Exists(target_dir + '/extra_dir')
+
+        # Hash comparison ignores timestamps, but catches same-size changes
+        os.utime(source_dir + '/2', (0, 0))
+        stats = CopyDirectory(source_dir, target_dir, incremental=True, compare='hash')
+        assert stats.files_copied == 0
+
+        CreateFile(target_dir + '/subdir_2/new', contents='NEW')
+        stats = CopyDirectory(source_dir, target_dir, incremental=True, compare='hash')
+        assert stats.files_copied == 1
+        embed_data.assert_equal_files(source_dir + '/subdir_2/new', target_dir + '/subdir_2/new')
+
+
     @pytest.mark.skipif("sys.platform != 'win32'")
     def testCopyDirectoryFailureToOverrideTarget(self, embed_data):
         '''
@@ -650,6 +1411,17 @@ class Test:
             DeleteDirectory('ftp://user@server:dir')
 
 
+    @pytest.mark.symlink
+    def testDeleteDirectoryLink(self, embed_data):
+        CreateFile(embed_data['real/file'], contents='keep')
+        CreateLink(os.path.abspath(embed_data['real']), embed_data['link'])
+
+        # Never deletes the contents of the link target, reporting progress or not
+        for i_progress in (None, lambda reporter: None):
+            DeleteDirectory(embed_data['link'], progress=i_progress)
+            assert GetFileContents(embed_data['real/file']) == 'keep'
+
+
     def testCreateDirectory(self, embed_data):
         # Dir not created yet
         assert os.path.isdir(embed_data['dir1']) == False
@@ -777,6 +1549,353 @@ class Test:
             CopyFile('ERROR://source', 'ERROR://target')
 
 
+    def testCopyFileEngines(self, embed_data, monkeypatch):
+        source_file = embed_data['engines/source.bin']
+        contents = os.urandom(3 * 1024 * 1024 + 7)  # Not a multiple of the copy buffer size
+        CreateFile(source_file, contents, binary=True)
+        os.chmod(source_file, 0o640)
+
+        def CopyAndCheck(target_file):
+            stats = CopyStats()
+            CopyFile(source_file, target_file, stats=stats)
+            assert GetFileContents(target_file, binary=True) == contents
+            assert os.stat(target_file).st_mode == os.stat(source_file).st_mode
+            assert stats.files_copied == 1
+            assert stats.bytes_copied == len(contents)
+            assert len(stats.engines) == 1
+            return list(stats.engines)[0]
+
+        assert CopyAndCheck(embed_data['engines/default.bin']) in (
+            COPY_ENGINE_COPY_FILE_RANGE,
+            COPY_ENGINE_SENDFILE,
+            COPY_ENGINE_READINTO,
+        )
+
+        # Engines refusing the copy fall back to the next one
+        def RaiseNoSys(*args):
+            raise OSError(errno.ENOSYS, 'Function not implemented')
+
+        monkeypatch.setattr(os, 'copy_file_range', RaiseNoSys, raising=False)
+        if hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+            assert CopyAndCheck(embed_data['engines/sendfile.bin']) == COPY_ENGINE_SENDFILE
+
+        monkeypatch.setattr(os, 'sendfile', RaiseNoSys, raising=False)
+        assert CopyAndCheck(embed_data['engines/readinto.bin']) == COPY_ENGINE_READINTO
+
+        # Copying a file over itself must not truncate it
+        with pytest.raises(Exception):
+            CopyFile(source_file, source_file)
+        assert GetFileContents(source_file, binary=True) == contents
+
+
+    def testCopyFileClone(self, embed_data):
+        source_file = embed_data['files/source/bravo.txt']
+        CreateFile(source_file, contents='bravo')
+
+        # 'auto' clones when the filesystem supports reflinks, and copies otherwise
+        stats = CopyStats()
+        CopyFile(source_file, embed_data['clone/auto.txt'], clone='auto', stats=stats)
+        embed_data.assert_equal_files(source_file, embed_data['clone/auto.txt'])
+        cloned = stats.engines.get(COPY_ENGINE_CLONE) == 1
+
+        # 'always' fails when it's not possible to clone, keeping the existing target
+        CreateFile(embed_data['clone/always.txt'], contents='previous')
+        if cloned:
+            CopyFile(source_file, embed_data['clone/always.txt'], clone='always')
+            embed_data.assert_equal_files(source_file, embed_data['clone/always.txt'])
+        else:
+            with pytest.raises(CloneNotSupportedError):
+                CopyFile(source_file, embed_data['clone/always.txt'], clone='always')
+            assert GetFileContents(embed_data['clone/always.txt']) == 'previous'
+        assert sorted(os.listdir(embed_data['clone'])) == ['always.txt', 'auto.txt']  # No temporary files
+
+        with pytest.raises(ValueError):
+            CopyFile(source_file, embed_data['clone/invalid.txt'], clone='sometimes')
+
+        # Trees
+        CopyFiles(embed_data['files/source'], embed_data['clone/files'], create_target_dir=True, clone='auto')
+        embed_data.assert_equal_files(source_file, embed_data['clone/files/bravo.txt'])
+
+        CopyDirectory(embed_data['complex_tree'], embed_data['clone/tree'], clone='auto')
+        embed_data.assert_equal_files(
+            embed_data['complex_tree/subdir_2/2.1'],
+            embed_data['clone/tree/subdir_2/2.1'],
+        )
+
+
+    def testCopyFileDelta(self, embed_data):
+        source_file = embed_data['delta/source.bin']
+        target_file = embed_data['delta/target.bin']
+        block_size = DELTA_BLOCK_SIZE
+
+        contents = bytearray(os.urandom(10 * block_size + 100))
+        CreateFile(source_file, bytes(contents), binary=True)
+
+        # Target missing: a regular copy
+        stats = CopyStats()
+        CopyFile(source_file, target_file, delta=True, stats=stats)
+        assert GetFileContents(target_file, binary=True) == bytes(contents)
+        assert COPY_ENGINE_DELTA not in stats.engines
+
+        # Only the changed blocks are written
+        contents[3 * block_size + 10] ^= 0xff
+        contents[-1] ^= 0xff
+        CreateFile(source_file, bytes(contents), binary=True)
+        stats = CopyStats()
+        CopyFile(source_file, target_file, delta=True, stats=stats)
+        assert GetFileContents(target_file, binary=True) == bytes(contents)
+        assert stats.engines == {COPY_ENGINE_DELTA: 1}
+        assert stats.bytes_copied == block_size + 100
+
+        # Target truncated or extended to the source size
+        CreateFile(source_file, bytes(contents[:2 * block_size]), binary=True)
+        CopyFile(source_file, target_file, delta=True)
+        assert GetFileContents(target_file, binary=True) == bytes(contents[:2 * block_size])
+
+        CreateFile(source_file, bytes(contents), binary=True)
+        stats = CopyStats()
+        CopyFile(source_file, target_file, delta=True, stats=stats)
+        assert GetFileContents(target_file, binary=True) == bytes(contents)
+        assert stats.bytes_copied == len(contents) - 2 * block_size
+
+
+    def testCopyFileResumable(self, embed_data, monkeypatch):
+        import zerotk.easyfs._easyfs
+
+        source_file = embed_data['resumable/source.bin']
+        target_file = embed_data['resumable/target.bin']
+        contents = os.urandom(5 * COPY_BUFFER_SIZE + 100)
+        CreateFile(source_file, contents, binary=True)
+
+        # Interrupt the copy while syncing the fourth megabyte (after three checkpoints)
+        monkeypatch.setattr(zerotk.easyfs._easyfs, 'RESUME_CHECKPOINT_SIZE', COPY_BUFFER_SIZE)
+        original_fsync = os.fsync
+
+        def InterruptedCopy():
+            fsync_calls = []
+            def FailingFsync(fd):
+                fsync_calls.append(fd)
+                if len(fsync_calls) == 4:
+                    raise RuntimeError('Interrupted')
+                original_fsync(fd)
+
+            monkeypatch.setattr(os, 'fsync', FailingFsync)
+            with pytest.raises(RuntimeError):
+                CopyFile(source_file, target_file, resumable=True)
+            monkeypatch.setattr(os, 'fsync', original_fsync)
+
+            assert IsFile(target_file + '.partial')
+            assert IsFile(target_file + '.partial.checkpoint')
+
+        InterruptedCopy()
+        assert not IsFile(target_file)
+
+        # The next copy continues from the last checkpoint
+        stats = CopyStats()
+        CopyFile(source_file, target_file, resumable=True, stats=stats)
+        assert GetFileContents(target_file, binary=True) == contents
+        assert stats.engines == {COPY_ENGINE_RESUMABLE: 1}
+        assert stats.bytes_copied == len(contents) - 3 * COPY_BUFFER_SIZE
+        assert not IsFile(target_file + '.partial')
+        assert not IsFile(target_file + '.partial.checkpoint')
+
+        # A corrupted partial file is not trusted: the copy starts again
+        InterruptedCopy()
+        with open(target_file + '.partial', 'r+b') as partial_file:
+            partial_file.write(b'corrupted')
+
+        stats = CopyStats()
+        CopyFile(source_file, target_file, resumable=True, stats=stats)
+        assert GetFileContents(target_file, binary=True) == contents
+        assert stats.bytes_copied == len(contents)
+
+
+    def testThrottle(self, embed_data):
+        import threading
+
+        class FakeClock(object):
+            def __init__(self):
+                self.now = 0.0
+                self.sleeps = []
+            def Time(self):
+                return self.now
+            def Sleep(self, seconds):
+                self.sleeps.append(seconds)
+                self.now += seconds
+
+        source_file = embed_data['throttle/source.bin']
+        CreateFile(source_file, os.urandom(3 * COPY_BUFFER_SIZE), binary=True)
+
+        # The bucket holds 1MB: the other 2MB must wait for it to refill
+        clock = FakeClock()
+        throttle = Throttle(
+            bytes_per_second=8 * COPY_BUFFER_SIZE,
+            burst=0.125,
+            clock=clock.Time,
+            sleep=clock.Sleep,
+        )
+        CopyFile(source_file, embed_data['throttle/target.bin'], throttle=throttle)
+        assert sum(clock.sleeps) == 0.25
+        assert Md5Hex(source_file) == Md5Hex(embed_data['throttle/target.bin'])
+
+        # Files per second, through the process-wide scheduler
+        clock = FakeClock()
+        SetIoScheduler(Throttle(files_per_second=16, burst=0.0625, clock=clock.Time, sleep=clock.Sleep))
+        try:
+            CopyFiles(embed_data['complex_tree'], embed_data['throttle/tree'], create_target_dir=True)
+            assert clock.sleeps == [0.0625] * 4  # 5 files, the first one in the bucket
+
+            # Files skipped by md5 checks are not throttled
+            del clock.sleeps[:]
+            CopyFiles(embed_data['complex_tree'], embed_data['throttle/tree'], md5_check='quick')
+            assert clock.sleeps == []
+        finally:
+            SetIoScheduler(None)
+        assert GetIoScheduler() is None
+
+        # When competing for the budget, higher priorities are served first: the low priority
+        # operation is still waiting for tokens when the high priority one arrives.
+        clock = FakeClock()
+        low_waiting = threading.Event()
+        low_may_wake = threading.Event()
+        def Sleep(seconds):
+            clock.Sleep(seconds)
+            if not low_waiting.is_set():
+                low_waiting.set()
+                low_may_wake.wait()
+
+        throttle = Throttle(files_per_second=4, burst=0.25, clock=clock.Time, sleep=Sleep)
+        throttle.Consume(files=1)  # Empty the bucket
+        served = []
+        def Consume(priority):
+            throttle.WithPriority(priority).Consume(files=1)
+            served.append(priority)
+
+        low = threading.Thread(target=Consume, args=(1,))
+        low.start()
+        low_waiting.wait()
+        high = threading.Thread(target=Consume, args=(2,))
+        high.start()
+        high.join()
+        low_may_wake.set()
+        low.join()
+        assert served == [2, 1]
+        assert clock.sleeps == [0.25, 0.25]  # The high priority took the tokens refilled meanwhile
+
+
+    def testCopyFileSparse(self, embed_data):
+        import hashlib
+
+        source_file = embed_data['sparse/source.img']
+        target_file = embed_data['sparse/target.img']
+        CreateDirectory(embed_data['sparse'])
+
+        # 2 data extents surrounded by holes
+        size = 16 * COPY_BUFFER_SIZE
+        with open(source_file, 'wb') as f:
+            f.seek(4 * COPY_BUFFER_SIZE)
+            f.write(b'a' * COPY_BUFFER_SIZE)
+            f.seek(10 * COPY_BUFFER_SIZE)
+            f.write(b'b' * 1000)
+            f.truncate(size)
+        source_blocks = os.stat(source_file).st_blocks
+        if not hasattr(os, 'SEEK_DATA') or source_blocks * 512 >= size:
+            pytest.skip('Filesystem does not support sparse files')
+
+        stats = CopyStats()
+        obtained = CopyFile(source_file, target_file, stats=stats, digests=['md5'])
+        assert stats.engines == {COPY_ENGINE_SPARSE: 1}
+        assert stats.bytes_copied == size
+        assert os.stat(target_file).st_blocks == source_blocks
+        contents = GetFileContents(source_file, binary=True)
+        assert GetFileContents(target_file, binary=True) == contents
+        assert obtained == {'md5': hashlib.md5(contents).hexdigest()}
+
+        # Only the data is throttled, not the holes
+        sleeps = []
+        throttle = Throttle(bytes_per_second=2 * COPY_BUFFER_SIZE, clock=lambda: sum(sleeps), sleep=sleeps.append)
+        CopyFile(source_file, embed_data['sparse/throttled.img'], throttle=throttle)
+        assert sleeps == []
+
+        # Regular files keep using the other engines
+        CopyFile(embed_data['md5/file'], target_file, stats=stats)
+        assert stats.engines[COPY_ENGINE_SPARSE] == 1
+        assert stats.files_copied == 2
+
+
+    def testCopyFileDigests(self, embed_data):
+        import hashlib
+
+        source_file = embed_data['digests/source.bin']
+        target_file = embed_data['digests/target.bin']
+        contents = os.urandom(2 * COPY_BUFFER_SIZE + 3)
+        CreateFile(source_file, contents, binary=True)
+        expected = {
+            'md5': hashlib.md5(contents).hexdigest(),
+            'sha256': hashlib.sha256(contents).hexdigest(),
+        }
+
+        stats = CopyStats()
+        obtained = CopyFile(source_file, target_file, digests=['md5', 'sha256'], stats=stats)
+        assert obtained == expected
+        assert stats.digests == {target_file: expected}
+        assert GetFileContents(target_file, binary=True) == contents
+        assert not IsFile(target_file + '.md5')
+
+        # Digests computed by the other copy modes, optionally written as sidecars
+        obtained = CopyFile(source_file, target_file, digests=['md5', 'sha256'], delta=True)
+        assert obtained == expected
+
+        obtained = CopyFile(
+            source_file, embed_data['digests/sidecars.bin'], digests=['sha256'], digest_sidecars=True)
+        assert obtained == {'sha256': expected['sha256']}
+        assert GetFileContents(embed_data['digests/sidecars.bin.sha256']) == expected['sha256']
+
+        # Trees
+        stats = CopyStats()
+        CopyFiles(embed_data['complex_tree'], embed_data['digests/tree'], create_target_dir=True, digests=['md5'], stats=stats)
+        target_file = embed_data['digests/tree'] + '/subdir_2/2.1'
+        assert stats.digests[target_file] == {'md5': Md5Hex(target_file)}
+        assert len(stats.digests) == 5
+
+        with pytest.raises(ValueError):
+            CopyFile(source_file, target_file, digests=['unknown'])
+
+
+    def testCopyFileVerify(self, embed_data, monkeypatch):
+        import zerotk.easyfs._easyfs
+
+        source_file = embed_data['verify/source.bin']
+        target_file = embed_data['verify/target.bin']
+        CreateFile(source_file, os.urandom(COPY_BUFFER_SIZE + 10), binary=True)
+
+        CopyFile(source_file, target_file, verify=True)
+        CopyFile(source_file, target_file, verify='digest')
+        assert CopyFile(source_file, target_file, verify='digest', digests=['sha256']) == {
+            'sha256': CopyFile(source_file, target_file, digests=['sha256'])['sha256'],
+        }
+        CopyFiles(embed_data['complex_tree'], embed_data['verify/tree'], create_target_dir=True, verify=True)
+
+        with pytest.raises(ValueError):
+            CopyFile(source_file, target_file, verify='sometimes')
+
+        # Corrupt the data being copied
+        original_copy_file_data = zerotk.easyfs._easyfs._CopyFileData
+        def CorruptedCopyFileData(source_filename, target_filename, **kwargs):
+            result = original_copy_file_data(source_filename, target_filename, **kwargs)
+            with open(target_filename, 'r+b') as target:
+                target.seek(COPY_BUFFER_SIZE + 5)
+                target.write(b'!')
+            return result
+        monkeypatch.setattr(zerotk.easyfs._easyfs, '_CopyFileData', CorruptedCopyFileData)
+
+        with pytest.raises(FileVerificationError):
+            CopyFile(source_file, target_file, verify=True)
+
+        with pytest.raises(FileVerificationError):
+            CopyFile(source_file, target_file, verify='digest')
+
+
     def testCopyFileNonAscii(self, embed_data):
         '''
         Creates files with non-ascii filenames and copies them.
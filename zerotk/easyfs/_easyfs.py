@@ -8,6 +8,7 @@ These functions abstract file location, most of them work for either local, ftp
 '''
 from zerotk.reraiseit import reraise
 import contextlib
+import errno
 import io
 import os
 import re
@@ -189,7 +190,7 @@ def NormStandardPath(path):
 #===================================================================================================
 # CreateMD5
 #===================================================================================================
-def CreateMD5(source_filename, target_filename=None):
+def CreateMD5(source_filename, target_filename=None, cache=None, algorithm='md5'):
     '''
     Creates a md5 file from a source file (contents are the md5 hash of source file)
 
@@ -201,6 +202,15 @@ def CreateMD5(source_filename, target_filename=None):
         Name of the target file with the md5 contents
 
         If None, defaults to source_filename + '.md5'
+
+    :param DigestCache cache:
+        .. seealso:: Md5Hex
+
+    :param unicode algorithm:
+        The hash algorithm (@see HashHex). Other algorithms than md5 record their name in the file,
+        as "algorithm:hexdigest" (e.g.: "sha256:9f86...").
+
+        The file keeps the .md5 extension by default, so md5_check finds it whatever the algorithm.
     '''
     if target_filename is None:
         target_filename = source_filename + '.md5'
@@ -211,21 +221,556 @@ def CreateMD5(source_filename, target_filename=None):
     # Obtain MD5 hex
     if _UrlIsLocal(source_url):
         # If using a local file, we can give Md5Hex the filename
-        md5_contents = Md5Hex(filename=source_filename)
+        md5_contents = HashHex(filename=source_filename, algorithm=algorithm, cache=cache)
     else:
-        # Md5Hex can't handle remote files, we open it and pray we won't run out of memory.
-        md5_contents = Md5Hex(contents=GetFileContents(source_filename, binary=True))
+        # Hashed from the stream OpenFile returns, a chunk at a time (OpenFile raises
+        # NotImplementedProtocol for the protocols it can't open).
+        source_file = OpenFile(source_filename, binary=True)
+        try:
+            md5_contents = HashHex(stream=source_file, algorithm=algorithm)
+        finally:
+            source_file.close()
+
+    if algorithm != 'md5':
+        md5_contents = '%s:%s' % (algorithm, md5_contents)
 
     # Write MD5 hash to a file
     CreateFile(target_filename, md5_contents)
 
 
+def _ParseHashFile(contents):
+    '''
+    :param unicode contents:
+        The contents of a file created by CreateMD5.
+
+    :rtype: tuple(unicode,unicode)
+    :returns:
+        The algorithm and the hex digest. Files without the algorithm are md5.
+    '''
+    contents = contents.strip()
+    algorithm, separator, digest = contents.rpartition(':')
+    if not separator:
+        algorithm = 'md5'
+    return algorithm.lower(), digest.lower()
+
+
 
 MD5_SKIP = 'md5_skip'  # Returned to show that a file copy was skipped because it hasn't changed.
+MD5_MANIFEST_FILENAME = '.md5_manifest'  # Per-tree manifest used by md5_check='manifest'
+
+# Engines used to copy the contents of local files (@see CopyStats.engines)
+COPY_ENGINE_CLONE = 'clone'  # Copy-on-write clone (reflink), no data is duplicated
+COPY_ENGINE_COPY_FILE_RANGE = 'copy_file_range'  # Kernel side copy (Linux)
+COPY_ENGINE_SENDFILE = 'sendfile'  # Kernel side copy, from source to target descriptor
+COPY_ENGINE_READINTO = 'readinto'  # User-space copy using a large reused buffer
+COPY_ENGINE_SPARSE = 'sparse'  # Only the data extents are copied, holes are recreated in the target
+COPY_ENGINE_DELTA = 'delta'  # Only the blocks that differ are rewritten in the existing target
+COPY_ENGINE_RESUMABLE = 'resumable'  # Copied through a checkpointed partial file
+COPY_ENGINE_SYMLINK = 'symlink'  # No contents copied: target created as a symlink
+COPY_ENGINE_HARDLINK = 'hardlink'  # No contents copied: target created as a hard link to the source
+
+COPY_BUFFER_SIZE = 1024 * 1024  # Chunk size used by the copy engines
+DELTA_BLOCK_SIZE = 64 * 1024  # Block size compared by delta copies
+RESUME_CHECKPOINT_SIZE = 64 * 1024 * 1024  # Bytes copied between checkpoints of resumable copies
+COPY_QUEUE_SIZE = 4  # Copies queued per worker by parallel copies
+HASH_MMAP_THRESHOLD = None  # If set, files at least this big are hashed through mmap
+DEDUPLICATE_PARTIAL_SIZE = 64 * 1024  # Bytes hashed to tell apart files of the same size
+QUICK_FINGERPRINT_SAMPLE_SIZE = 64 * 1024  # Size of each sample hashed by QuickFingerprint
+
+#===================================================================================================
+# CopyStats
+#===================================================================================================
+class CopyStats(object):
+    '''
+    Collects statistics about copy operations.
+
+    Pass an instance as the `stats` parameter of CopyFile, CopyFiles and CopyFilesX. It's safe to
+    use the same instance from many threads.
+
+    :ivar int files_copied:
+        Number of files copied.
+
+    :ivar int files_linked:
+        Number of files hard linked instead of copied (@see CopyFile link_mode parameter).
+
+    :ivar int files_skipped:
+        Number of files not copied because they haven't changed (@see MD5_SKIP).
+
+    :ivar int files_deleted:
+        Number of target files removed (because they were removed from the source).
+
+    :ivar int directories_created:
+        Number of target directories created.
+
+    :ivar int directories_deleted:
+        Number of target directories removed (because they were removed from the source).
+
+    :ivar int bytes_copied:
+        Number of bytes written (delta copies only count the blocks rewritten).
+
+    :ivar dict(unicode,int) engines:
+        Number of files copied by each engine (COPY_ENGINE_XXX constants).
+
+    :ivar dict(unicode,dict(unicode,unicode)) digests:
+        Maps each target filename to its digests (algorithm: hex digest), when copying with the
+        `digests` parameter.
+    '''
+
+    def __init__(self):
+        import threading
+        self._lock = threading.Lock()
+
+        self.files_copied = 0
+        self.files_linked = 0
+        self.files_skipped = 0
+        self.files_deleted = 0
+        self.directories_created = 0
+        self.directories_deleted = 0
+        self.bytes_copied = 0
+        self.engines = {}
+        self.digests = {}
+
+
+    def AddCopy(self, engine, size):
+        '''
+        Registers a file copy.
+
+        :param unicode engine:
+            One of the COPY_ENGINE_XXX constants.
+
+        :param int size:
+            Number of bytes copied.
+        '''
+        with self._lock:
+            if engine == COPY_ENGINE_HARDLINK:
+                self.files_linked += 1
+            else:
+                self.files_copied += 1
+            self.bytes_copied += size
+            self.engines[engine] = self.engines.get(engine, 0) + 1
+
+
+    def AddDigests(self, target_filename, digests):
+        '''
+        Registers the digests computed while copying a file.
+
+        :param unicode target_filename:
+
+        :param dict(unicode,unicode) digests:
+            Maps algorithm to hex digest.
+        '''
+        with self._lock:
+            self.digests[target_filename] = digests
+
+
+    def AddSkip(self):
+        '''
+        Registers a file that was not copied.
+        '''
+        with self._lock:
+            self.files_skipped += 1
+
+
+    def AddDeletedFile(self):
+        '''
+        Registers a target file removal.
+        '''
+        with self._lock:
+            self.files_deleted += 1
+
+
+    def AddCreatedDirectory(self):
+        '''
+        Registers a target directory creation.
+        '''
+        with self._lock:
+            self.directories_created += 1
+
+
+    def AddDeletedDirectory(self):
+        '''
+        Registers a target directory removal.
+        '''
+        with self._lock:
+            self.directories_deleted += 1
+
+
+
+#===================================================================================================
+# ProgressReporter
+#===================================================================================================
+class ProgressReporter(object):
+    '''
+    Reports the progress of long running operations to a callback.
+
+    Pass an instance (or just the callback) as the `progress` parameter of CopyFile, CopyFiles,
+    CopyFilesX, CopyDirectory and DeleteDirectory. The callback receives this object and can read
+    its attributes.
+
+    Updates are cheap: the callback is called at most once every `interval` seconds, plus once when
+    the operation finishes, so reporting doesn't slow down the operation itself. It's safe to update
+    from many threads.
+
+    :ivar int files_done:
+        Number of files processed.
+
+    :ivar int|None files_total:
+        Number of files to process, if known.
+
+    :ivar int bytes_done:
+        Number of bytes processed.
+
+    :ivar int|None bytes_total:
+        Number of bytes to process, if known.
+
+    :ivar float elapsed:
+        Seconds since the operation started (at the last report).
+
+    :ivar float throughput:
+        Bytes per second processed since the previous report.
+
+    :ivar bool finished:
+        True in the last report.
+    '''
+
+    def __init__(self, callback, interval=1.0):
+        '''
+        :param callable(ProgressReporter) callback:
+            Called with this object to report progress.
+
+        :param float interval:
+            Minimum number of seconds between reports.
+        '''
+        import threading
+        self.callback = callback
+        self.interval = interval
+        self._lock = threading.Lock()
+
+        self.files_done = 0
+        self.files_total = None
+        self.bytes_done = 0
+        self.bytes_total = None
+        self.elapsed = 0.0
+        self.throughput = 0.0
+        self.finished = False
+
+        self._start_time = None
+        self._last_time = None
+        self._last_bytes = 0
+
+
+    def Start(self, files_total=None, bytes_total=None):
+        '''
+        Starts (or restarts) an operation.
+
+        :param int|None files_total:
+
+        :param int|None bytes_total:
+        '''
+        import time
+        with self._lock:
+            self.files_done = 0
+            self.files_total = files_total
+            self.bytes_done = 0
+            self.bytes_total = bytes_total
+            self.elapsed = 0.0
+            self.throughput = 0.0
+            self.finished = False
+
+            self._start_time = self._last_time = time.time()
+            self._last_bytes = 0
+
+
+    def IsStarted(self):
+        '''
+        :rtype: bool
+        :returns:
+            True if an operation was started and not finished yet.
+        '''
+        return self._start_time is not None and not self.finished
+
+
+    def Update(self, files=0, bytes_=0):
+        '''
+        Adds to the work done, reporting it if `interval` seconds have passed since the last report.
+
+        :param int files:
+            Number of files processed since the last update.
+
+        :param int bytes_:
+            Number of bytes processed since the last update.
+        '''
+        import time
+        now = time.time()
+        with self._lock:
+            self.files_done += files
+            self.bytes_done += bytes_
+            if now - self._last_time < self.interval:
+                return
+            self._UpdateRates(now)
+        self.callback(self)
+
+
+    def Finish(self):
+        '''
+        Finishes the operation, always reporting it.
+        '''
+        import time
+        with self._lock:
+            self._UpdateRates(time.time())
+            self.finished = True
+        self.callback(self)
+
+
+    def _UpdateRates(self, now):
+        if now > self._last_time:
+            self.throughput = (self.bytes_done - self._last_bytes) / (now - self._last_time)
+        self.elapsed = now - self._start_time
+        self._last_time = now
+        self._last_bytes = self.bytes_done
+
+
+def _GetProgressReporter(progress):
+    '''
+    :param None|callable|ProgressReporter progress:
+        The `progress` parameter given to a function.
+
+    :rtype: ProgressReporter|None
+    '''
+    if progress is None or isinstance(progress, ProgressReporter):
+        return progress
+    return ProgressReporter(progress)
+
+
+def _CountTree(directory, followlinks=False):
+    '''
+    :param unicode directory:
+
+    :param bool followlinks:
+        If True, counts the contents of linked files and directories.
+
+    :rtype: tuple(int,int)
+    :returns:
+        The number of files under directory, and the sum of their sizes.
+    '''
+    get_stat = os.stat if followlinks else os.lstat
+    files = 0
+    size = 0
+    for dir_root, _directories, filenames in os.walk(directory, followlinks=followlinks):
+        for i_filename in filenames:
+            files += 1
+            try:
+                size += get_stat(os.path.join(dir_root, i_filename)).st_size
+            except OSError:
+                pass  # Broken links
+    return files, size
+
+
+
+#===================================================================================================
+# Throttle
+#===================================================================================================
+class Throttle(object):
+    '''
+    Limits the I/O of copy operations, using token buckets for bytes per second and files per
+    second.
+
+    Pass an instance as the `throttle` parameter of CopyFile, CopyFiles, CopyFilesX and
+    CopyDirectory. The same instance can be shared by many concurrent operations (and threads),
+    which then share its budget: when tokens are scarce, the waiting operation with the highest
+    priority is served first.
+
+    .. seealso:: SetIoScheduler to limit all operations in the process.
+    '''
+
+    def __init__(self, bytes_per_second=None, files_per_second=None, burst=1.0, clock=None, sleep=None):
+        '''
+        :param float|None bytes_per_second:
+            Maximum bytes copied per second. None for no limit.
+
+        :param float|None files_per_second:
+            Maximum files copied per second. None for no limit.
+
+        :param float burst:
+            Seconds of budget that can accumulate while idle (the bucket size).
+
+        :param callable() clock:
+            Returns the current time in seconds. Defaults to time.monotonic (time.time on Python 2).
+
+        :param callable(float) sleep:
+            Waits for the given seconds. Defaults to time.sleep.
+        '''
+        import itertools
+        import threading
+        import time
+
+        self.bytes_per_second = bytes_per_second
+        self.files_per_second = files_per_second
+        self.burst = burst
+
+        self._clock = clock or getattr(time, 'monotonic', time.time)
+        self._sleep = sleep or time.sleep
+        self._condition = threading.Condition()
+        self._waiting = []
+        self._tickets = itertools.count()
+        self._last_time = self._clock()
+        self._bytes_tokens = self._Capacity(bytes_per_second)
+        self._files_tokens = self._Capacity(files_per_second)
+
+
+    def WithPriority(self, priority):
+        '''
+        :param int priority:
+            Higher priorities are served first when operations compete for the budget.
+
+        :rtype: Throttle-like
+        :returns:
+            An object that can be passed as `throttle`, sharing this throttle's budget with the given
+            priority.
+        '''
+        return _PriorityThrottle(self, priority)
+
+
+    def Consume(self, bytes_=0, files=0, priority=0):
+        '''
+        Takes tokens from the buckets, blocking until they are available.
+
+        Requests bigger than a bucket are accepted when the bucket is full, leaving it in debt, so a
+        large chunk is never blocked forever.
+
+        :param int bytes_:
+
+        :param int files:
+
+        :param int priority:
+            .. seealso:: WithPriority
+        '''
+        import heapq
+
+        with self._condition:
+            ticket = (-priority, next(self._tickets))
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    if self._waiting[0] != ticket:
+                        self._condition.wait()  # For the operations ahead of this one
+                        continue
+
+                    self._Refill(self._clock())
+                    timeout = max(
+                        self._GetWaitTime(self._bytes_tokens, bytes_, self.bytes_per_second),
+                        self._GetWaitTime(self._files_tokens, files, self.files_per_second),
+                    )
+                    if timeout <= 0:
+                        if self.bytes_per_second:
+                            self._bytes_tokens -= bytes_
+                        if self.files_per_second:
+                            self._files_tokens -= files
+                        return
+
+                    # Sleep without the lock: operations with higher priorities may queue ahead
+                    self._condition.release()
+                    try:
+                        self._sleep(timeout)
+                    finally:
+                        self._condition.acquire()
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
+
+
+    def _Capacity(self, rate):
+        return rate * self.burst if rate else 0
+
+
+    def _Refill(self, now):
+        elapsed = max(0.0, now - self._last_time)
+        self._last_time = now
+        if self.bytes_per_second:
+            self._bytes_tokens = min(
+                self._Capacity(self.bytes_per_second),
+                self._bytes_tokens + elapsed * self.bytes_per_second,
+            )
+        if self.files_per_second:
+            self._files_tokens = min(
+                self._Capacity(self.files_per_second),
+                self._files_tokens + elapsed * self.files_per_second,
+            )
+
+
+    def _GetWaitTime(self, tokens, amount, rate):
+        '''
+        :rtype: float
+        :returns:
+            Seconds until `amount` tokens (or a full bucket, if more than it holds) are available.
+        '''
+        if not rate or not amount:
+            return 0.0
+        needed = min(amount, self._Capacity(rate))
+        return (needed - tokens) / float(rate)
+
+
+class _PriorityThrottle(object):
+    '''
+    A Throttle consumed with a fixed priority (@see Throttle.WithPriority).
+    '''
+
+    def __init__(self, throttle, priority):
+        self.throttle = throttle
+        self.priority = priority
+
+
+    def Consume(self, bytes_=0, files=0):
+        self.throttle.Consume(bytes_=bytes_, files=files, priority=self.priority)
+
+
+_io_scheduler = None
+
+
+def SetIoScheduler(throttle):
+    '''
+    Sets a process-wide throttle, used by all copy operations that don't receive a `throttle`.
+
+    Concurrent operations share its budget; give them different priorities with
+    `throttle=scheduler.WithPriority(priority)`.
+
+    :param Throttle|None throttle:
+        None to remove the limit.
+    '''
+    global _io_scheduler
+    _io_scheduler = throttle
+
+
+def GetIoScheduler():
+    '''
+    :rtype: Throttle|None
+    :returns:
+        The process-wide throttle (@see SetIoScheduler).
+    '''
+    return _io_scheduler
+
+
+
 #===================================================================================================
 # CopyFile
 #===================================================================================================
-def CopyFile(source_filename, target_filename, override=True, md5_check=False, copy_symlink=True):
+def CopyFile(
+    source_filename,
+    target_filename,
+    override=True,
+    md5_check=False,
+    copy_symlink=True,
+    stats=None,
+    clone='never',
+    delta=False,
+    resumable=False,
+    link_mode=None,
+    digests=None,
+    digest_sidecars=False,
+    verify=False,
+    progress=None,
+    throttle=None):
     '''
     Copy a file from source to target.
 
@@ -235,20 +780,78 @@ def CopyFile(source_filename, target_filename, override=True, md5_check=False, c
     :param  target_filename:
         @see _DoCopyFile
 
-    :param bool md5_check:
+    :param bool|Md5ManifestCheck md5_check:
         If True, checks md5 files (of both source and target files), if they match, skip this copy
         and return MD5_SKIP
 
         Md5 files are assumed to be {source, target} + '.md5'
 
-        If any file is missing (source, target or md5), the copy will always be made.
+        If any file is missing (source, target or md5), the copy will always be made. Files made
+        with different algorithms (@see CreateMD5) never match.
+
+        If a Md5ManifestCheck, the md5s are looked up in the manifests of the source and target
+        trees instead of in .md5 files.
+
+        If 'quick', no .md5 files are used: the copy is skipped if source and target (local files)
+        have the same QuickFingerprint. Near-instant, even for huge files, but only samples the
+        contents.
+
+        If 'full', same as 'quick', but when the fingerprints match (and don't cover the whole
+        file) the md5 of both files are compared too.
 
     :param  copy_symlink:
         @see _DoCopyFile
 
+    :param CopyStats stats:
+        If given, the copy (or skip) is registered in this object.
+
+    :param  clone:
+        @see _CopyFileData
+
+    :param  delta:
+        @see _CopyFileData
+
+    :param  resumable:
+        @see _CopyFileData
+
+    :param  link_mode:
+        @see _CopyFileLocal
+
+    :param list(unicode) digests:
+        If given, computes these digests (e.g.: ['md5', 'sha256', 'blake2b']) of the contents
+        while copying them, in the same read pass. Forces the copy through user-space (no kernel
+        side copy), but saves reading the file again to hash it.
+
+    :param bool digest_sidecars:
+        If True, the digests are also written to sidecar files, named as the target filename plus
+        the algorithm extension (e.g.: target.sha256). The contents are the same CreateMD5 produces.
+
+    :param bool|'digest' verify:
+        If True, after the copy, source and target contents are compared chunk by chunk, stopping
+        at the first difference.
+
+        If 'digest', the digest of the source is computed while copying (the first of `digests`,
+        or md5) and compared with the digest of the target. Cheaper, since the source is read only
+        once.
+
+        Files copied as links are not verified.
+
+    :param callable|ProgressReporter progress:
+        .. seealso:: ProgressReporter
+
+    :param Throttle throttle:
+        Limits the bytes and files copied per second. If None, uses the process-wide throttle, if
+        any (@see SetIoScheduler).
+
     :raises FileAlreadyExistsError:
         If target_filename already exists, and override is False
 
+    :raises FileVerificationError:
+        If `verify` is set and the target contents differ from the source
+
+    :raises CloneNotSupportedError:
+        If clone is 'always' and the file can't be cloned
+
     :raises NotImplementedProtocol:
         If file protocol is not accepted
 
@@ -256,10 +859,12 @@ def CopyFile(source_filename, target_filename, override=True, md5_check=False, c
             source_filename: local, ftp, http
             target_filename: local, ftp
 
-    :rtype: None | MD5_SKIP
+    :rtype: None | MD5_SKIP | dict(unicode,unicode)
     :returns:
         MD5_SKIP if the file was not copied because there was a matching .md5 file
 
+        The digests (algorithm: hex digest) if `digests` was given.
+
     .. seealso:: FTP LIMITATIONS at this module's doc for performance issues information
     '''
     from ._exceptions import FileNotFoundError
@@ -269,6 +874,31 @@ def CopyFile(source_filename, target_filename, override=True, md5_check=False, c
         from ._exceptions import FileAlreadyExistsError
         raise FileAlreadyExistsError(target_filename)
 
+    file_progress = _FileProgress(
+        _GetProgressReporter(progress),
+        source_filename,
+        throttle=throttle if throttle is not None else GetIoScheduler(),
+        follow_links=not copy_symlink,
+    )
+
+    if md5_check in ('quick', 'full'):
+        contents_check = md5_check
+        md5_check = False
+        if _HaveSameContents(source_filename, target_filename, full=contents_check == 'full'):
+            if stats is not None:
+                stats.AddSkip()
+            file_progress.Done()
+            return MD5_SKIP
+
+    manifest_check = md5_check if isinstance(md5_check, Md5ManifestCheck) else None
+    if manifest_check is not None:
+        md5_check = False
+        if manifest_check.IsUpToDate(source_filename, target_filename):
+            if stats is not None:
+                stats.AddSkip()
+            file_progress.Done()
+            return MD5_SKIP
+
     # Don't do md5 check for md5 files themselves.
     md5_check = md5_check and not target_filename.endswith('.md5')
 
@@ -287,19 +917,189 @@ def CopyFile(source_filename, target_filename, override=True, md5_check=False, c
             target_md5_contents = None
 
         if source_md5_contents is not None and \
-           source_md5_contents == target_md5_contents and \
+           target_md5_contents is not None and \
+           _ParseHashFile(source_md5_contents) == _ParseHashFile(target_md5_contents) and \
            Exists(target_filename):
+            if stats is not None:
+                stats.AddSkip()
+            file_progress.Done()
             return MD5_SKIP
 
+    if verify not in (False, True, 'digest'):
+        raise ValueError('Unexpected verify mode: %r' % (verify,))
+
+    hashers = None
+    if digests:
+        hashers = dict((i, _NewHasher(i)) for i in digests)
+
+    if verify == 'digest':
+        verify_algorithm = digests[0] if digests else 'md5'
+        if hashers is None:
+            hashers = {}
+        hashers.setdefault(verify_algorithm, _NewHasher(verify_algorithm))
+
     # Copy source file
-    _DoCopyFile(source_filename, target_filename, copy_symlink=copy_symlink)
+    file_progress.Begin()
+    engine, size = _DoCopyFile(
+        source_filename,
+        target_filename,
+        copy_symlink=copy_symlink,
+        clone=clone,
+        delta=delta,
+        resumable=resumable,
+        link_mode=link_mode,
+        hashers=hashers,
+        on_copied=file_progress.OnCopied,
+    )
+    if stats is not None:
+        stats.AddCopy(engine, size)
+
+    if verify and engine not in (COPY_ENGINE_SYMLINK, COPY_ENGINE_HARDLINK):
+        if verify == 'digest':
+            target_hasher = _NewHasher(verify_algorithm)
+            _HashFile(target_filename, [target_hasher])
+            verified = target_hasher.hexdigest() == hashers[verify_algorithm].hexdigest()
+        else:
+            verified = _CompareFiles(source_filename, target_filename)
+        if not verified:
+            from ._exceptions import FileVerificationError
+            raise FileVerificationError(target_filename)
 
     # If we have a source_md5, but no target_md5, create the target_md5 file
     if md5_check and source_md5_contents is not None and source_md5_contents != target_md5_contents:
         CreateFile(target_md5_filename, source_md5_contents)
 
+    if manifest_check is not None:
+        manifest_check.Update(source_filename, target_filename)
+
+    result = None
+    if digests:
+        result = dict((i, six.text_type(hashers[i].hexdigest())) for i in digests)
+        if digest_sidecars:
+            for i_algorithm, i_digest in result.items():
+                CreateFile(target_filename + '.' + i_algorithm, i_digest)
+        if stats is not None:
+            stats.AddDigests(target_filename, result)
+
+    file_progress.Done()
+    return result
+
+
+class _FileProgress(object):
+    '''
+    Reports the progress of a single file copy to a ProgressReporter, and throttles it.
+
+    If the reporter wasn't started (by a function copying many files) the copy is reported as a
+    whole operation, with a single file.
+    '''
+
+    def __init__(self, reporter, source_filename, throttle=None, follow_links=True):
+        '''
+        :param ProgressReporter|None reporter:
+
+        :param unicode source_filename:
+
+        :param bool follow_links:
+            If False, a link is reported with its own size (for links copied as links).
+
+        :param Throttle|None throttle:
+            Consumed as the file is copied (one file on Begin, the bytes as they are copied). Files
+            skipped before Begin cost nothing.
+        '''
+        self.reporter = reporter
+        self.throttle = throttle
+        self.copied = 0
+        if reporter is None:
+            return
+
+        try:
+            if follow_links:
+                self.size = os.stat(source_filename).st_size
+            else:
+                self.size = os.lstat(source_filename).st_size
+        except (IOError, OSError):
+            self.size = 0
+
+        self.own_reporter = not reporter.IsStarted()
+        if self.own_reporter:
+            reporter.Start(files_total=1, bytes_total=self.size)
+
+
+    def Begin(self):
+        '''
+        Called when the file is actually going to be copied (e.g.: not skipped by a md5 check).
+        '''
+        if self.throttle is not None:
+            self.throttle.Consume(files=1)
+
+
+    def OnCopied(self, count, transferred=True):
+        '''
+        :param int count:
+            Number of bytes just copied.
+
+        :param bool transferred:
+            False if the bytes were not actually read or written (e.g.: cloned): they are reported,
+            but not throttled.
+        '''
+        if self.throttle is not None and transferred:
+            self.throttle.Consume(bytes_=count)
+        if self.reporter is not None:
+            self.copied += count
+            self.reporter.Update(bytes_=count)
+
+
+    def Done(self):
+        '''
+        Reports the file as done (the bytes not reported yet, e.g. a skipped file, are reported now).
+        '''
+        if self.reporter is None:
+            return
+        self.reporter.Update(files=1, bytes_=max(0, self.size - self.copied))
+        if self.own_reporter:
+            self.reporter.Finish()
+
+
+def _CompareFiles(filename1, filename2):
+    '''
+    Compares the contents of two local files, using large aligned reads and stopping at the first
+    difference.
+
+    :param unicode filename1:
 
-def _DoCopyFile(source_filename, target_filename, copy_symlink=True):
+    :param unicode filename2:
+
+    :rtype: bool
+    :returns:
+        True if both files have the same contents.
+    '''
+    if os.path.getsize(filename1) != os.path.getsize(filename2):
+        return False
+
+    with io.open(filename1, 'rb') as file1, io.open(filename2, 'rb') as file2:
+        buffer1 = bytearray(COPY_BUFFER_SIZE)
+        view1 = memoryview(buffer1)
+        buffer2 = bytearray(COPY_BUFFER_SIZE)
+        view2 = memoryview(buffer2)
+        while True:
+            read1 = file1.readinto(buffer1)
+            read2 = file2.readinto(buffer2)
+            if read1 != read2 or view1[:read1] != view2[:read2]:
+                return False
+            if not read1:
+                return True
+
+
+def _DoCopyFile(
+    source_filename,
+    target_filename,
+    copy_symlink=True,
+    clone='never',
+    delta=False,
+    resumable=False,
+    link_mode=None,
+    hashers=None,
+    on_copied=None):
     '''
     :param unicode source_filename:
         The source filename.
@@ -312,22 +1112,54 @@ def _DoCopyFile(source_filename, target_filename, copy_symlink=True):
     :param  copy_symlink:
         @see _CopyFileLocal
 
-    :raises FileNotFoundError:
-        If source_filename does not exist
-    '''
-    from six.moves.urllib.parse import urlparse
+    :param  clone:
+        @see _CopyFileData
 
-    source_url = urlparse(source_filename)
-    target_url = urlparse(target_filename)
+    :param  delta:
+        @see _CopyFileData
 
-    if _UrlIsLocal(source_url):
-        if not Exists(source_filename):
+    :param  resumable:
+        @see _CopyFileData
+
+    :param  link_mode:
+        @see _CopyFileLocal
+
+    :param  hashers:
+        @see _CopyFileLocal
+
+    :param  on_copied:
+        @see _CopyFileData
+
+    :rtype: tuple(unicode,int)
+    :returns:
+        @see _CopyFileLocal
+
+    :raises FileNotFoundError:
+        If source_filename does not exist
+    '''
+    from six.moves.urllib.parse import urlparse
+
+    source_url = urlparse(source_filename)
+    target_url = urlparse(target_filename)
+
+    if _UrlIsLocal(source_url):
+        if not Exists(source_filename):
             from ._exceptions import FileNotFoundError
             raise FileNotFoundError(source_filename)
 
         if _UrlIsLocal(target_url):
             # local to local
-            _CopyFileLocal(source_filename, target_filename, copy_symlink=copy_symlink)
+            return _CopyFileLocal(
+                source_filename,
+                target_filename,
+                copy_symlink=copy_symlink,
+                clone=clone,
+                delta=delta,
+                resumable=resumable,
+                link_mode=link_mode,
+                hashers=hashers,
+                on_copied=on_copied,
+            )
         elif target_url.scheme in ['ftp']:
             from ._exceptions import NotImplementedProtocol
             raise NotImplementedProtocol(target_url.scheme)
@@ -349,7 +1181,16 @@ def _DoCopyFile(source_filename, target_filename, copy_symlink=True):
         raise NotImplementedProtocol(source_url.scheme)
 
 
-def _CopyFileLocal(source_filename, target_filename, copy_symlink=True):
+def _CopyFileLocal(
+    source_filename,
+    target_filename,
+    copy_symlink=True,
+    clone='never',
+    delta=False,
+    resumable=False,
+    link_mode=None,
+    hashers=None,
+    on_copied=None):
     '''
     Copy a file locally to a directory.
 
@@ -364,6 +1205,32 @@ def _CopyFileLocal(source_filename, target_filename, copy_symlink=True):
         a symlink.
 
         If False, the file being linked will be copied instead.
+
+    :param  clone:
+        @see _CopyFileData
+
+    :param  delta:
+        @see _CopyFileData
+
+    :param  resumable:
+        @see _CopyFileData
+
+    :param None|'hard'|'auto' link_mode:
+        If given, target_filename is created as a hard link to source_filename instead of a copy.
+        This is instant and uses no extra space, but both names share the same contents: use it
+        only for files that won't be modified.
+            'hard': Always link. Fails if the files are in different devices.
+            'auto': Link if the files are in the same device, copy otherwise.
+
+    :param dict(unicode,hashlib.hash) hashers:
+        If given, these hash objects are updated with the file contents.
+
+    :param  on_copied:
+        @see _CopyFileData
+
+    :rtype: tuple(unicode,int)
+    :returns:
+        The engine used to copy the file (COPY_ENGINE_XXX) and the number of bytes copied.
     '''
     import shutil
     try:
@@ -380,6 +1247,9 @@ def _CopyFileLocal(source_filename, target_filename, copy_symlink=True):
             # >>> Obtain the relative path from link to source_filename (linkto)
             source_filename = ReadLink(source_filename)
             CreateLink(source_filename, target_filename)
+            if hashers and os.path.isfile(target_filename):
+                _HashFile(target_filename, hashers.values())
+            return COPY_ENGINE_SYMLINK, 0
         else:
             # shutil can't copy links in Windows, so we must find the real file manually
             if sys.platform == 'win32':
@@ -390,1495 +1260,4536 @@ def _CopyFileLocal(source_filename, target_filename, copy_symlink=True):
                     else:
                         source_filename = os.path.join(os.path.dirname(source_filename), link)
 
-            shutil.copyfile(source_filename, target_filename)
+            if link_mode is not None and _HardLinkFile(source_filename, target_filename, link_mode):
+                if hashers:
+                    _HashFile(source_filename, hashers.values())
+                return COPY_ENGINE_HARDLINK, 0
+
+            if os.path.exists(target_filename) and os.path.samefile(source_filename, target_filename):
+                raise getattr(shutil, 'SameFileError', shutil.Error)(
+                    '%r and %r are the same file' % (source_filename, target_filename))
+
+            result = _CopyFileData(
+                source_filename,
+                target_filename,
+                clone=clone,
+                delta=delta,
+                resumable=resumable,
+                hashers=hashers,
+                on_copied=on_copied,
+            )
             shutil.copymode(source_filename, target_filename)
+            return result
     except Exception as e:
         reraise(e, 'While executiong _filesystem._CopyFileLocal(%s, %s)' % (source_filename, target_filename))
 
 
-
-#===================================================================================================
-# CopyFiles
-#===================================================================================================
-def CopyFiles(source_dir, target_dir, create_target_dir=False, md5_check=False):
+def _HardLinkFile(source_filename, target_filename, link_mode):
     '''
-    Copy files from the given source to the target.
+    Creates target_filename as a hard link to source_filename, replacing it if it exists.
 
-    :param unicode source_dir:
-        A filename, URL or a file mask.
-        Ex.
-            x:\coilib50
-            x:\coilib50\*
-            http://server/directory/file
-            ftp://server/directory/file
+    :param unicode source_filename:
 
+    :param unicode target_filename:
 
-    :param unicode target_dir:
-        A directory or an URL
-        Ex.
-            d:\Temp
-            ftp://server/directory
+    :param 'hard'|'auto' link_mode:
+        @see _CopyFileLocal
 
-    :param bool create_target_dir:
-        If True, creates the target path if it doesn't exists.
+    :rtype: bool
+    :returns:
+        True if the link was created, False if the file must be copied instead ('auto' only).
+    '''
+    if link_mode not in ('hard', 'auto'):
+        raise ValueError('Unexpected link mode: %r' % (link_mode,))
 
-    :param bool md5_check:
-        .. seealso:: CopyFile
+    link = getattr(os, 'link', None)
+    if link is None:
+        if link_mode == 'hard':
+            raise NotImplementedError('Hard links are not supported in this platform.')
+        return False
 
-    :raises DirectoryNotFoundError:
-        If target_dir does not exist, and create_target_dir is False
+    target_dir = os.path.dirname(target_filename) or os.curdir
+    if link_mode == 'auto' and os.stat(source_filename).st_dev != os.stat(target_dir).st_dev:
+        return False
 
-    .. seealso:: CopyFile for documentation on accepted protocols
+    if os.path.exists(target_filename) and os.path.samefile(source_filename, target_filename):
+        return True  # Already linked
 
-    .. seealso:: FTP LIMITATIONS at this module's doc for performance issues information
+    # Link to a temporary name and rename it, so target_filename is replaced atomically
+    temp_filename = '%s.%s.link' % (target_filename, GetRandomHash())
+    try:
+        link(source_filename, temp_filename)
+    except OSError as e:
+        if link_mode == 'auto' and e.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EACCES):
+            return False
+        raise
+    try:
+        _ReplaceFile(temp_filename, target_filename)
+    except:
+        os.remove(temp_filename)
+        raise
+    return True
+
+
+def _CopyFileData(
+    source_filename,
+    target_filename,
+    clone='never',
+    delta=False,
+    resumable=False,
+    hashers=None,
+    on_copied=None):
     '''
-    import fnmatch
-
-    # Check if we were given a directory or a directory with mask
-    if IsDir(source_dir):
-        # Yes, it's a directory, copy everything from it
-        source_mask = '*'
-    else:
-        # Split directory and mask
-        source_dir, source_mask = os.path.split(source_dir)
-
-    # Create directory if necessary
-    if not IsDir(target_dir):
-        if create_target_dir:
-            CreateDirectory(target_dir)
-        else:
-            from ._exceptions import DirectoryNotFoundError
-            raise DirectoryNotFoundError(target_dir)
+    Copies the contents of a local file, choosing the fastest engine available for this pair of files.
 
-    # List and match files
-    filenames = ListFiles(source_dir)
+    Engines are tried in order: copy_file_range, sendfile and a readinto loop. An engine that isn't
+    supported (by the platform or the filesystems involved) hands over to the next one, which
+    continues from where the previous one stopped.
 
-    # Check if we have a source directory
-    if filenames is None:
-        return
+    :param unicode source_filename:
 
-    # Copy files
-    for i_filename in filenames:
-        if md5_check and i_filename.endswith('.md5'):
-            continue  # md5 files will be copied by CopyFile when copying their associated files
+    :param unicode target_filename:
 
-        if fnmatch.fnmatch(i_filename, source_mask):
-            source_path = source_dir + '/' + i_filename
-            target_path = target_dir + '/' + i_filename
+    :param 'auto'|'always'|'never' clone:
+        Whether to clone the file (copy-on-write reflink) instead of copying its contents. Cloning
+        is instant and shares the data blocks until one of the files changes (btrfs, XFS).
+            'auto': Clone if the filesystem supports it, copy otherwise.
+            'always': Clone, raising CloneNotSupportedError if the filesystem refuses it (an
+                existing target is left untouched then).
+            'never': Always copy.
+
+    :param bool delta:
+        If True and the target file already exists, compares source and target blocks and rewrites
+        only the ones that differ, in place. The target is then truncated (or extended) to the
+        source size. Useful for big files that change little between copies, since it saves writes.
+
+        Takes precedence over `clone` when the target exists.
+
+    :param bool resumable:
+        If True, the contents are copied to `target_filename + '.partial'`, saving a checkpoint
+        (`target_filename + '.partial.checkpoint'`) every RESUME_CHECKPOINT_SIZE bytes with the
+        offset already copied and the md5 of the data up to there. When interrupted, the next copy
+        of the same (unchanged) source to the same target verifies the partial file and continues
+        from the checkpoint. The partial file is renamed to target_filename when complete.
+
+        Takes precedence over `clone`.
+
+    Sparse source files (with fewer blocks allocated than their size) are copied extent by extent,
+    using SEEK_DATA/SEEK_HOLE, so the holes are preserved in the target instead of being filled
+    with zeros.
+
+    :param dict(unicode,hashlib.hash) hashers:
+        If given, these hash objects are updated with the contents while copying them. Kernel side
+        engines are not used, since the data must pass through user-space to be hashed.
+
+    :param callable(int,bool) on_copied:
+        If given, called with the number of bytes processed after each chunk (for progress
+        reports and throttling). The second argument is False for bytes that were not actually
+        read or written (cloned, holes of sparse files or kept from an interrupted copy): they
+        aren't throttled.
+
+    :rtype: tuple(unicode,int)
+    :returns:
+        The engine that finished the copy (COPY_ENGINE_XXX) and the number of bytes copied.
 
-            if IsDir(source_path):
-                # If we found a directory, copy it recursively
-                CopyFiles(source_path, target_path, create_target_dir=True, md5_check=md5_check)
+    :raises CloneNotSupportedError:
+        If clone is 'always' and the file can't be cloned.
+    '''
+    if clone not in ('auto', 'always', 'never'):
+        raise ValueError('Unexpected clone mode: %r' % (clone,))
+
+    if delta and os.path.isfile(target_filename):
+        written = _CopyFileDelta(source_filename, target_filename, hashers=hashers, on_copied=on_copied)
+        return COPY_ENGINE_DELTA, written
+
+    if resumable:
+        written = _CopyFileResumable(source_filename, target_filename, hashers=hashers, on_copied=on_copied)
+        return COPY_ENGINE_RESUMABLE, written
+
+    if clone == 'always':
+        # Cloned aside, so an existing target survives a filesystem without reflinks
+        _ReflinkFile(source_filename, target_filename, keep_metadata=False)
+        size = os.path.getsize(target_filename)
+        if hashers:
+            _HashFile(source_filename, hashers.values())
+        if on_copied is not None:
+            on_copied(size, bool(hashers))  # Only read to be hashed
+        return COPY_ENGINE_CLONE, size
+
+    with io.open(source_filename, 'rb') as source_file, io.open(target_filename, 'wb') as target_file:
+        source_fd = source_file.fileno()
+        target_fd = target_file.fileno()
+        size = os.fstat(source_fd).st_size
+
+        if clone == 'auto' and _CloneFile(source_fd, target_fd):
+            if hashers:
+                _HashStream(source_file, hashers.values())
+            if on_copied is not None:
+                on_copied(size, bool(hashers))  # Only read to be hashed
+            return COPY_ENGINE_CLONE, size
+
+        if _IsSparse(source_fd):
+            try:
+                offset = _CopyEngineSparse(
+                    source_file,
+                    target_file,
+                    size,
+                    on_copied=on_copied,
+                    hashers=hashers.values() if hashers else (),
+                )
+            except _CopyEngineUnavailable:
+                # Nothing was written yet: copy the whole file with the other engines
+                pass
             else:
-                CopyFile(source_path, target_path, md5_check=md5_check)
+                return COPY_ENGINE_SPARSE, offset
+
+        if hashers:
+            offset = _CopyEngineReadInto(
+                source_file,
+                target_file,
+                0,
+                size,
+                on_copied=on_copied,
+                hashers=hashers.values(),
+            )
+            return COPY_ENGINE_READINTO, offset
+
+        offset = 0
+        for i_engine, i_function in _COPY_ENGINES:
+            try:
+                offset = i_function(source_file, target_file, offset, size, on_copied=on_copied)
+            except _CopyEngineUnavailable as e:
+                offset = e.offset
+                continue
+            return i_engine, offset
 
+    raise AssertionError('The readinto engine is always available.')
 
 
-#===================================================================================================
-# CopyFilesX
-#===================================================================================================
-def CopyFilesX(file_mapping):
+def _CopyFileDelta(source_filename, target_filename, block_size=DELTA_BLOCK_SIZE, hashers=None, on_copied=None):
     '''
-    Copies files into directories, according to a file mapping
+    Updates an existing target file, rewriting only the blocks that differ from the source.
 
-    :param list(tuple(unicode,unicode)) file_mapping:
-        A list of mappings between the directory in the target and the source.
-        For syntax, @see: ExtendedPathMask
+    Blocks are compared directly: both files are local, so comparing the bytes is cheaper than
+    computing checksums for them.
 
-    :rtype: list(tuple(unicode,unicode))
-    :returns:
-        List of files copied. (source_filename, target_filename)
+    :param unicode source_filename:
 
-    .. seealso:: FTP LIMITATIONS at this module's doc for performance issues information
-    '''
-    # List files that match the mapping
-    files = []
-    for i_target_path, i_source_path_mask in file_mapping:
-        tree_recurse, flat_recurse, dirname, in_filters, out_filters = ExtendedPathMask.Split(i_source_path_mask)
+    :param unicode target_filename:
 
-        _AssertIsLocal(dirname)
+    :param int block_size:
+        Size of the blocks compared.
 
-        filenames = FindFiles(dirname, in_filters, out_filters, tree_recurse)
-        for i_source_filename in filenames:
-            if os.path.isdir(i_source_filename):
-                continue  # Do not copy dirs
+    :param dict(unicode,hashlib.hash) hashers:
+        @see _CopyFileData
 
-            i_target_filename = i_source_filename[len(dirname) + 1:]
-            if flat_recurse:
-                i_target_filename = os.path.basename(i_target_filename)
-            i_target_filename = os.path.join(i_target_path, i_target_filename)
+    :param callable(int,bool) on_copied:
+        @see _CopyFileData
 
-            files.append((
-                StandardizePath(i_source_filename),
-                StandardizePath(i_target_filename)
-            ))
+    :rtype: int
+    :returns:
+        Number of bytes written in the target.
+    '''
+    written = 0
+    with io.open(source_filename, 'rb') as source_file, io.open(target_filename, 'r+b') as target_file:
+        source_buffer = bytearray(block_size)
+        source_view = memoryview(source_buffer)
+        target_buffer = bytearray(block_size)
+        target_view = memoryview(target_buffer)
 
-    # Copy files
-    for i_source_filename, i_target_filename in files:
-        # Create target dir if necessary
-        target_dir = os.path.dirname(i_target_filename)
-        CreateDirectory(target_dir)
+        offset = 0
+        while True:
+            read = source_file.readinto(source_buffer)
+            if not read:
+                break
 
-        CopyFile(i_source_filename, i_target_filename)
+            target_read = target_file.readinto(target_buffer)
+            if target_read != read or source_view[:read] != target_view[:read]:
+                target_file.seek(offset)
+                target_file.write(source_view[:read])
+                written += read
 
-    return files
+            if hashers:
+                for i_hasher in hashers.values():
+                    i_hasher.update(source_view[:read])
 
+            if on_copied is not None:
+                on_copied(read)
 
+            offset += read
 
-#===================================================================================================
-# IsFile
-#===================================================================================================
-def IsFile(path):
-    '''
-    :param unicode path:
-        Path to a file (local or ftp)
+        target_file.truncate(offset)
 
-    :raises NotImplementedProtocol:
-        If checking for a non-local, non-ftp file
+    return written
 
-    :rtype: bool
-    :returns:
-        True if the file exists
 
-    .. seealso:: FTP LIMITATIONS at this module's doc for performance issues information
+def _CopyFileResumable(source_filename, target_filename, hashers=None, on_copied=None):
     '''
-    from six.moves.urllib.parse import urlparse
-    url = urlparse(path)
+    Copies a file through a checkpointed partial file.
 
-    if _UrlIsLocal(url):
-        if IsLink(path):
-            return IsFile(ReadLink(path))
-        return os.path.isfile(path)
+    .. seealso:: _CopyFileData, resumable parameter.
 
-    elif url.scheme == 'ftp':
-        from ._exceptions import NotImplementedProtocol
-        raise NotImplementedProtocol(url.scheme)
-    else:
-        from ._exceptions import NotImplementedProtocol
-        raise NotImplementedProtocol(url.scheme)
+    :param unicode source_filename:
 
+    :param unicode target_filename:
 
-def GetDriveType(path):
+    :param dict(unicode,hashlib.hash) hashers:
+        @see _CopyFileData
+
+    :param callable(int,bool) on_copied:
+        @see _CopyFileData
+
+    :rtype: int
+    :returns:
+        Number of bytes written (not counting the ones copied by an interrupted copy).
     '''
-    Determine the type of drive, which can be one of the following values:
-        DRIVE_UNKNOWN = 0
-            The drive type cannot be determined.
+    import hashlib
+    import json
 
-        DRIVE_NO_ROOT_DIR = 1
-            The root path is invalid; for example, there is no volume mounted at the specified path.
+    partial_filename = target_filename + '.partial'
+    checkpoint_filename = partial_filename + '.checkpoint'
 
-        DRIVE_REMOVABLE = 2
-            The drive has removable media; for example, a floppy drive, thumb drive, or flash card reader.
+    source_stat = os.stat(source_filename)
+    source_id = {
+        'source': os.path.abspath(source_filename),
+        'size': source_stat.st_size,
+        'mtime_ns': _GetMTimeNs(source_stat),
+    }
 
-        DRIVE_FIXED = 3
-            The drive has fixed media; for example, a hard disk drive or flash drive.
+    # Find out where to start from
+    if hashers is None:
+        hashers = {}
+    md5 = hashlib.md5()
+    offset = 0
+    try:
+        with io.open(checkpoint_filename, 'r') as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    except (IOError, OSError, ValueError):
+        checkpoint = None
+
+    if checkpoint is not None and \
+       dict((i, checkpoint.get(i)) for i in source_id) == source_id and \
+       os.path.isfile(partial_filename) and \
+       os.path.getsize(partial_filename) >= checkpoint['offset']:
+        # Trust the partial file only up to the checkpoint, and only if it still matches
+        verify_hashers = dict((i, _NewHasher(i)) for i in hashers)
+        with io.open(partial_filename, 'rb') as partial_file:
+            _HashStream(partial_file, [md5] + list(verify_hashers.values()), checkpoint['offset'])
+        if md5.hexdigest() == checkpoint['md5']:
+            offset = checkpoint['offset']
+            hashers.update(verify_hashers)
+            if on_copied is not None:
+                on_copied(offset, False)
+        else:
+            md5 = hashlib.md5()
+
+    def WriteCheckpoint():
+        checkpoint = dict(source_id, offset=offset, md5=md5.hexdigest())
+        with io.open(checkpoint_filename + '.tmp', 'w') as checkpoint_file:
+            checkpoint_file.write(six.text_type(json.dumps(checkpoint)))
+        _ReplaceFile(checkpoint_filename + '.tmp', checkpoint_filename)
+
+    written = 0
+    mode = 'r+b' if offset else 'wb'
+    with io.open(source_filename, 'rb') as source_file, io.open(partial_filename, mode) as partial_file:
+        source_file.seek(offset)
+        partial_file.seek(offset)
+        partial_file.truncate()
+
+        buffer_ = bytearray(COPY_BUFFER_SIZE)
+        view = memoryview(buffer_)
+        since_checkpoint = 0
+        while True:
+            read = source_file.readinto(buffer_)
+            if not read:
+                break
+            partial_file.write(view[:read])
+            md5.update(view[:read])
+            for i_hasher in hashers.values():
+                i_hasher.update(view[:read])
+            if on_copied is not None:
+                on_copied(read)
+            offset += read
+            written += read
+
+            since_checkpoint += read
+            if since_checkpoint >= RESUME_CHECKPOINT_SIZE:
+                partial_file.flush()
+                os.fsync(partial_file.fileno())
+                WriteCheckpoint()
+                since_checkpoint = 0
+
+        partial_file.flush()
+        os.fsync(partial_file.fileno())
+
+    _ReplaceFile(partial_filename, target_filename)
+    if os.path.isfile(checkpoint_filename):
+        os.remove(checkpoint_filename)
+
+    return written
+
+
+def _HashFile(filename, hashers, chunk_size=None, use_mmap=None):
+    '''
+    Updates hash objects with the contents of a file.
 
-        DRIVE_REMOTE = 4
-            The drive is a remote (network) drive.
+    :param unicode filename:
 
-        DRIVE_CDROM = 5
-            The drive is a CD-ROM drive.
+    :param iterable(hashlib.hash) hashers:
 
-        DRIVE_RAMDISK = 6
-            The drive is a RAM disk
+    :param int|None chunk_size:
+        Bytes hashed per update. Defaults to COPY_BUFFER_SIZE.
 
-    :note:
-        The implementation is valid only for Windows OS
-        Linux will always return DRIVE_UNKNOWN
+    :param bool|None use_mmap:
+        If True, hashes a memory map of the file (no copies to a buffer, no read calls). If False,
+        reads into a reused buffer. If None, uses mmap only for files of at least HASH_MMAP_THRESHOLD
+        bytes, when it's set. Falls back to reading when the file can't be mapped.
+    '''
+    hashers = list(hashers)
+    with io.open(filename, 'rb') as stream:
+        if use_mmap is None:
+            use_mmap = HASH_MMAP_THRESHOLD is not None and \
+                os.fstat(stream.fileno()).st_size >= HASH_MMAP_THRESHOLD
+        if use_mmap and _HashMemoryMap(stream, hashers, chunk_size):
+            return
+        _HashStream(stream, hashers, chunk_size=chunk_size)
 
-    :param path:
-        Path to a file or directory
+
+def _HashMemoryMap(stream, hashers, chunk_size=None):
     '''
-    if sys.platform == 'win32':
-        import ctypes
-        kdll = ctypes.windll.LoadLibrary("kernel32.dll")
+    Updates hash objects with the contents of a memory mapped file.
 
-        return kdll.GetDriveType(path + '\\')
+    Faster than reading big files, but only safe for files nobody else is writing: if the file is
+    truncated while mapped, accessing the missing pages kills the process (SIGBUS), where reading
+    would just get less data. That's why mmap is opt-in (HASH_MMAP_THRESHOLD).
 
-        import win32file
-        if IsFile(path):
-            path = os.path.dirname(path)
+    :param file stream:
 
-        # A trailing backslash is required.
-        return win32file.GetDriveType(path + '\\')
+    :param list(hashlib.hash) hashers:
 
-    else:
-        return DRIVE_UNKNOWN
+    :param int|None chunk_size:
+        @see _HashFile
 
+    :rtype: bool
+    :returns:
+        False if the file can't be mapped (empty or special files, platforms without mmap or
+        memoryviews of maps), and nothing was hashed.
+    '''
+    import mmap
 
+    chunk_size = chunk_size or COPY_BUFFER_SIZE
+    try:
+        mapped = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError):
+        return False
 
+    try:
+        try:
+            view = memoryview(mapped)
+        except TypeError:
+            return False  # Python 2
 
-#===================================================================================================
-# IsDir
-#===================================================================================================
-def IsDir(directory):
-    '''
-    :param unicode directory:
-        A path
+        madvise = getattr(mapped, 'madvise', None)
+        if madvise is not None and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            madvise(mmap.MADV_SEQUENTIAL)
 
-    :rtype: bool
-    :returns:
-        Returns whether the given path points to an existent directory.
+        try:
+            for i_offset in range(0, len(view), chunk_size):
+                chunk = view[i_offset:i_offset + chunk_size]
+                for i_hasher in hashers:
+                    i_hasher.update(chunk)
+                chunk.release()
+        finally:
+            view.release()  # Otherwise the map can't be closed
+    finally:
+        mapped.close()
+    return True
 
-    :raises NotImplementedProtocol:
-        If the path protocol is not local or ftp
 
-    .. seealso:: FTP LIMITATIONS at this module's doc for performance issues information
+def _HashStream(stream, hashers, size=None, chunk_size=None):
     '''
-    from six.moves.urllib.parse import urlparse
-    directory_url = urlparse(directory)
+    Updates hash objects with the contents of a binary stream.
 
-    if _UrlIsLocal(directory_url):
-        return os.path.isdir(directory)
-    elif directory_url.scheme == 'ftp':
-        from ._exceptions import NotImplementedProtocol
-        raise NotImplementedProtocol(target_url.scheme)
-    else:
-        from ._exceptions import NotImplementedProtocol
-        raise NotImplementedProtocol(directory_url.scheme)
+    :param file stream:
+        Read from its current position.
 
+    :param iterable(hashlib.hash) hashers:
 
+    :param int|None size:
+        Maximum number of bytes to read. If None reads until the end of the stream.
 
-#===================================================================================================
-# Exists
-#===================================================================================================
-def Exists(path):
+    :param int|None chunk_size:
+        Bytes read (into a reused buffer) per update. Defaults to COPY_BUFFER_SIZE.
     '''
-    :rtype: bool
-    :returns:
-        True if the path already exists (either a file or a directory)
+    buffer_ = bytearray(chunk_size or COPY_BUFFER_SIZE)
+    view = memoryview(buffer_)
+    while size is None or size > 0:
+        if size is not None and size < len(buffer_):
+            read = stream.readinto(view[:size])
+        else:
+            read = stream.readinto(buffer_)
+        if not read:
+            break
+        for i_hasher in hashers:
+            i_hasher.update(view[:read])
+        if size is not None:
+            size -= read
 
-    .. seealso:: FTP LIMITATIONS at this module's doc for performance issues information
+
+def _ReplaceFile(source_filename, target_filename):
     '''
-    from six.moves.urllib.parse import urlparse
-    path_url = urlparse(path)
+    Renames source_filename to target_filename, atomically replacing target_filename if it exists.
 
-    # Handle local
-    if _UrlIsLocal(path_url):
-        return IsFile(path) or IsDir(path) or IsLink(path)
-    return IsFile(path) or IsDir(path)
+    :param unicode source_filename:
 
+    :param unicode target_filename:
+    '''
+    replace = getattr(os, 'replace', None)
+    if replace is not None:
+        replace(source_filename, target_filename)
+    elif sys.platform == 'win32':
+        # Python 2 on Windows can't rename over an existing file
+        if os.path.isfile(target_filename):
+            os.remove(target_filename)
+        os.rename(source_filename, target_filename)
+    else:
+        os.rename(source_filename, target_filename)
 
 
-#===================================================================================================
-# CopyDirectory
-#===================================================================================================
-def CopyDirectory(source_dir, target_dir, override=False):
+def _ReflinkFile(source_filename, target_filename, keep_metadata=True):
     '''
-    Recursively copy a directory tree.
+    Replaces target_filename by a copy-on-write clone of source_filename, atomically: the clone is
+    made in a temporary file, so target_filename is untouched when the filesystem can't clone.
 
-    :param unicode source_dir:
-        Where files will come from
+    :param unicode source_filename:
 
-    :param unicode target_dir:
-        Where files will go to
+    :param unicode target_filename:
+        The file to replace or create.
 
-    :param bool override:
-        If True and target_dir already exists, it will be deleted before copying.
+    :param bool keep_metadata:
+        If True keeps the target metadata (permissions and times, @see shutil.copystat), otherwise
+        only its permissions (like rewriting the file would).
 
-    :raises NotImplementedForRemotePathError:
-        If trying to copy to/from remote directories
+    :raises CloneNotSupportedError:
+        If the filesystem can't clone files.
     '''
-    _AssertIsLocal(source_dir)
-    _AssertIsLocal(target_dir)
-
-    if override and IsDir(target_dir):
-        DeleteDirectory(target_dir, skip_on_error=False)
-
     import shutil
-    shutil.copytree(source_dir, target_dir)
+
+    temp_filename = '%s.%s.clone' % (target_filename, GetRandomHash())
+    try:
+        with io.open(source_filename, 'rb') as source_file, io.open(temp_filename, 'wb') as temp_file:
+            if not _CloneFile(source_file.fileno(), temp_file.fileno()):
+                from ._exceptions import CloneNotSupportedError
+                raise CloneNotSupportedError(target_filename)
+        if keep_metadata:
+            shutil.copystat(target_filename, temp_filename)
+        elif os.path.exists(target_filename):
+            shutil.copymode(target_filename, temp_filename)
+        _ReplaceFile(temp_filename, target_filename)
+    except:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
 
 
+FICLONE = 0x40049409  # From linux/fs.h: _IOW(0x94, 9, int)
 
-#===================================================================================================
-# DeleteFile
-#===================================================================================================
-def DeleteFile(target_filename):
+def _CloneFile(source_fd, target_fd):
     '''
-    Deletes the given local filename.
-
-    .. note:: If file doesn't exist this method has no effect.
+    Makes target_fd a copy-on-write clone of source_fd (Linux FICLONE ioctl).
 
-    :param unicode target_filename:
-        A local filename
+    :param int source_fd:
 
-    :raises NotImplementedForRemotePathError:
-        If trying to delete a non-local path
+    :param int target_fd:
 
-    :raises FileOnlyActionError:
-        Raised when filename refers to a directory.
+    :rtype: bool
+    :returns:
+        True if the file was cloned, False if the platform or filesystem doesn't support it.
     '''
-    _AssertIsLocal(target_filename)
+    try:
+        import fcntl
+    except ImportError:
+        return False  # Windows
+
+    if not sys.platform.startswith('linux'):
+        return False
 
     try:
-        if IsLink(target_filename):
-            DeleteLink(target_filename)
-        elif IsFile(target_filename):
-            os.remove(target_filename)
-        elif IsDir(target_filename):
-            from ._exceptions import FileOnlyActionError
-            raise FileOnlyActionError(target_filename)
-    except Exception as e:
-        reraise(e, 'While executing filesystem.DeleteFile(%s)' % (target_filename))
+        fcntl.ioctl(target_fd, FICLONE, source_fd)
+    except (IOError, OSError) as e:
+        if e.errno in _COPY_ENGINE_FALLBACK_ERRNOS or e.errno == errno.ENOTTY:
+            return False
+        raise
+    return True
 
 
+class _CopyEngineUnavailable(Exception):
+    '''
+    Raised by a copy engine that can't be used (or can't continue) for a pair of files.
 
-#===================================================================================================
-# AppendToFile
-#===================================================================================================
-def AppendToFile(filename, contents, eol_style=EOL_STYLE_NATIVE, encoding=None, binary=False):
+    :ivar int offset:
+        Number of bytes already copied, the next engine continues from here.
     '''
-    Appends content to a local file.
+    def __init__(self, offset):
+        Exception.__init__(self)
+        self.offset = offset
 
-    :param unicode filename:
 
-    :param unicode contents:
+# Errors meaning that a kernel side copy is not supported for a pair of file descriptors.
+_COPY_ENGINE_FALLBACK_ERRNOS = set(
+    getattr(errno, i) for i in ('EXDEV', 'ENOSYS', 'EINVAL', 'EOPNOTSUPP', 'ENOTSUP', 'EBADF', 'ETXTBSY')
+    if hasattr(errno, i)
+)
 
-    :type eol_style: EOL_STYLE_XXX constant
-    :param eol_style:
-        Replaces the EOL by the appropriate EOL depending on the eol_style value.
-        Considers that all content is using only "\n" as EOL.
 
-    :param unicode encoding:
-        Target file's content encoding.
-        Defaults to sys.getfilesystemencoding()
+def _CopyEngineCopyFileRange(source_file, target_file, offset, size, on_copied=None):
+    '''
+    Copy engine using os.copy_file_range (Python 3.8+, Linux).
+
+    :param file source_file:
+    :param file target_file:
+    :param int offset:
+        Position to start copying from.
+    :param int size:
+        Expected size of the source file.
+    :param callable(int,bool) on_copied:
+        @see _CopyFileData
+
+    :rtype: int
+    :returns:
+        The final offset (the number of bytes in the target file).
 
-    :param bool binary:
-        If True, content is appended in binary mode. In this case, `contents` must be `bytes` and not
-        `unicode`
+    :raises _CopyEngineUnavailable:
+        If this engine can't be used.
+    '''
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    if copy_file_range is None:
+        raise _CopyEngineUnavailable(offset)
 
-    :raises NotImplementedForRemotePathError:
-        If trying to modify a non-local path
+    source_fd = source_file.fileno()
+    target_fd = target_file.fileno()
+    while True:
+        try:
+            copied = copy_file_range(source_fd, target_fd, COPY_BUFFER_SIZE, offset, offset)
+        except OSError as e:
+            if e.errno in _COPY_ENGINE_FALLBACK_ERRNOS:
+                raise _CopyEngineUnavailable(offset)
+            raise
+        if copied == 0:
+            # Some pseudo filesystems report no data at all: let the next engine try it.
+            if offset < size:
+                raise _CopyEngineUnavailable(offset)
+            return offset
+        offset += copied
+        if on_copied is not None:
+            on_copied(copied)
 
-    :raises ValueError:
-        If trying to mix unicode `contents` without `encoding`, or `encoding` without
-        unicode `contents`
-    '''
-    _AssertIsLocal(filename)
 
-    assert isinstance(contents, six.text_type) ^ binary, 'Must always receive unicode contents, unless binary=True'
+def _CopyEngineSendFile(source_file, target_file, offset, size, on_copied=None):
+    '''
+    Copy engine using os.sendfile (Python 3.3+, POSIX).
 
-    if not binary:
-        # Replaces eol on each line by the given eol_style.
-        contents = _HandleContentsEol(contents, eol_style)
+    .. seealso:: _CopyEngineCopyFileRange for parameters.
+    '''
+    sendfile = getattr(os, 'sendfile', None)
+    if sendfile is None or not sys.platform.startswith('linux'):
+        # Only Linux accepts regular files as the output descriptor.
+        raise _CopyEngineUnavailable(offset)
+
+    source_fd = source_file.fileno()
+    target_fd = target_file.fileno()
+    os.lseek(target_fd, offset, os.SEEK_SET)
+    while True:
+        try:
+            sent = sendfile(target_fd, source_fd, offset, COPY_BUFFER_SIZE)
+        except OSError as e:
+            if e.errno in _COPY_ENGINE_FALLBACK_ERRNOS:
+                raise _CopyEngineUnavailable(offset)
+            raise
+        if sent == 0:
+            if offset < size:
+                raise _CopyEngineUnavailable(offset)
+            return offset
+        offset += sent
+        if on_copied is not None:
+            on_copied(sent)
 
-        # Handle encoding here, and always write in binary mode. We can't use io.open because it
-        # tries to do its own line ending handling.
-        contents = contents.encode(encoding or sys.getfilesystemencoding())
 
-    oss = open(filename, 'ab')
-    try:
-        oss.write(contents)
-    finally:
-        oss.close()
+def _CopyEngineReadInto(source_file, target_file, offset, size, on_copied=None, hashers=()):
+    '''
+    Copy engine reading the source into a reused buffer and writing it to the target.
 
+    Always available.
 
+    .. seealso:: _CopyEngineCopyFileRange for parameters.
 
-#===================================================================================================
-# MoveFile
-#===================================================================================================
-def MoveFile(source_filename, target_filename):
+    :param iterable(hashlib.hash) hashers:
+        Hash objects updated with the data copied.
     '''
-    Moves a file.
+    source_file.seek(offset)
+    target_file.seek(offset)
+
+    buffer_ = bytearray(COPY_BUFFER_SIZE)
+    view = memoryview(buffer_)
+    while True:
+        read = source_file.readinto(buffer_)
+        if not read:
+            return offset
+        target_file.write(view[:read])
+        for i_hasher in hashers:
+            i_hasher.update(view[:read])
+        if on_copied is not None:
+            on_copied(read)
+        offset += read
+
+
+_COPY_ENGINES = [
+    (COPY_ENGINE_COPY_FILE_RANGE, _CopyEngineCopyFileRange),
+    (COPY_ENGINE_SENDFILE, _CopyEngineSendFile),
+    (COPY_ENGINE_READINTO, _CopyEngineReadInto),
+]
+
+
+def _IsSparse(fd):
+    '''
+    :param int fd:
 
-    :param unicode source_filename:
+    :rtype: bool
+    :returns:
+        True if the file has holes (fewer blocks allocated than its size) and the platform can find
+        them (SEEK_DATA/SEEK_HOLE).
+    '''
+    if not hasattr(os, 'SEEK_DATA'):
+        return False
+    stat_result = os.fstat(fd)
+    blocks = getattr(stat_result, 'st_blocks', None)
+    return blocks is not None and blocks * 512 < stat_result.st_size
 
-    :param unicode target_filename:
 
-    :raises NotImplementedForRemotePathError:
-        If trying to operate with non-local files.
+def _CopyEngineSparse(source_file, target_file, size, on_copied=None, hashers=()):
     '''
-    _AssertIsLocal(source_filename)
-    _AssertIsLocal(target_filename)
+    Copy engine for sparse files: copies only the data extents of the source, leaving holes in the
+    target where the source has them.
 
-    import shutil
-    shutil.move(source_filename, target_filename)
+    Unlike the other engines, always starts from the beginning of the file. Holes are reported to
+    `on_copied` and hashed as the zeros they read as.
+
+    .. seealso:: _CopyEngineCopyFileRange for parameters.
+
+    :param iterable(hashlib.hash) hashers:
+        Hash objects updated with the data copied.
+
+    :raises _CopyEngineUnavailable:
+        If the filesystem doesn't support seeking for data and holes.
+    '''
+    hashers = list(hashers)
+    source_fd = source_file.fileno()
+    target_fd = target_file.fileno()
+
+    def SkipHole(start, end):
+        length = end - start
+        if hashers and length:
+            zeros = bytes(bytearray(min(length, COPY_BUFFER_SIZE)))
+            remaining = length
+            while remaining:
+                chunk = zeros[:min(remaining, len(zeros))]
+                for i_hasher in hashers:
+                    i_hasher.update(chunk)
+                remaining -= len(chunk)
+        if on_copied is not None and length:
+            on_copied(length, False)
+
+    buffer_ = bytearray(COPY_BUFFER_SIZE)
+    view = memoryview(buffer_)
+    offset = 0
+    while offset < size:
+        try:
+            data_start = os.lseek(source_fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # Only a hole until the end of the file
+                break
+            if e.errno in _COPY_ENGINE_FALLBACK_ERRNOS:
+                raise _CopyEngineUnavailable(0)
+            raise
+        data_end = os.lseek(source_fd, data_start, os.SEEK_HOLE)
+        SkipHole(offset, data_start)
+
+        source_file.seek(data_start)
+        target_file.seek(data_start)
+        offset = data_start
+        while offset < data_end:
+            read = source_file.readinto(view[:min(COPY_BUFFER_SIZE, data_end - offset)])
+            if not read:
+                break
+            target_file.write(view[:read])
+            for i_hasher in hashers:
+                i_hasher.update(view[:read])
+            if on_copied is not None:
+                on_copied(read)
+            offset += read
+
+    # Recreates the trailing hole (if any) by extending the file without writing
+    SkipHole(offset, size)
+    target_file.flush()
+    os.ftruncate(target_fd, size)
+    return size
 
 
 
 #===================================================================================================
-# MoveDirectory
+# CopyFiles
 #===================================================================================================
-def MoveDirectory(source_dir, target_dir):
+def CopyFiles(
+    source_dir,
+    target_dir,
+    create_target_dir=False,
+    md5_check=False,
+    workers=None,
+    stats=None,
+    clone='never',
+    link_mode=None,
+    digests=None,
+    digest_sidecars=False,
+    verify=False,
+    progress=None,
+    mirror=False,
+    throttle=None):
     '''
-    Moves a directory.
+    Copy files from the given source to the target.
 
     :param unicode source_dir:
+        A filename, URL or a file mask.
+        Ex.
+            x:\coilib50
+            x:\coilib50\*
+            http://server/directory/file
+            ftp://server/directory/file
+
 
     :param unicode target_dir:
+        A directory or an URL
+        Ex.
+            d:\Temp
+            ftp://server/directory
 
-    :raises NotImplementedError:
-        If trying to move anything other than:
-            Local dir -> local dir
-            FTP dir -> FTP dir (same host)
-    '''
-    if not IsDir(source_dir):
-        from ._exceptions import DirectoryNotFoundError
-        raise DirectoryNotFoundError(source_dir)
+    :param bool create_target_dir:
+        If True, creates the target path if it doesn't exists.
 
-    if Exists(target_dir):
-        from ._exceptions import DirectoryAlreadyExistsError
-        raise DirectoryAlreadyExistsError(target_dir)
+    :param bool|'manifest'|'quick'|'full' md5_check:
+        .. seealso:: CopyFile
 
-    from six.moves.urllib.parse import urlparse
-    source_url = urlparse(source_dir)
-    target_url = urlparse(target_dir)
+        If 'manifest', uses a single manifest per tree (MD5_MANIFEST_FILENAME, at the root of
+        source_dir and target_dir) instead of a .md5 file per file. Both manifests are loaded once,
+        and the target manifest is saved (atomically) at the end, with the md5 of the files copied.
+        @see Md5ManifestCheck, CreateMD5Manifest
 
-    # Local to local
-    if _UrlIsLocal(source_url) and _UrlIsLocal(target_url):
-        import shutil
-        shutil.move(source_dir, target_dir)
+    :param int workers:
+        If given, the files are copied by a pool with this number of threads.
 
-    # FTP to FTP
-    elif source_url.scheme == 'ftp' and target_url.scheme == 'ftp':
-        from ._exceptions import NotImplementedProtocol
-        raise NotImplementedProtocol(target_url.scheme)
-    else:
-        raise NotImplementedError('Can only move directories local->local or ftp->ftp')
+        The copies start while the tree is still being scanned: each directory is created as it is
+        found, and its files are queued for the pool. The queue is bounded, so memory doesn't grow
+        with the size of the tree. If any copy fails, the scan stops, the pending copies are
+        cancelled and the error is raised.
 
+        If None (default) the files are copied one at a time, as they are found.
 
-#===================================================================================================
-# GetFileContents
-#===================================================================================================
-def GetFileContents(filename, binary=False, encoding=None, newline=None):
-    '''
-    Reads a file and returns its contents. Works for both local and remote files.
+    :param CopyStats stats:
+        .. seealso:: CopyFile
 
-    :param unicode filename:
+    :param 'auto'|'always'|'never' clone:
+        .. seealso:: CopyFile
 
-    :param bool binary:
-        If True returns the file as is, ignore any EOL conversion.
+    :param None|'hard'|'auto' link_mode:
+        .. seealso:: CopyFile
 
-    :param unicode encoding:
-        File's encoding. If not None, contents obtained from file will be decoded using this
-        `encoding`.
+        Use `stats` to find out how many files were linked and how many were copied.
 
-    :param None|''|'\n'|'\r'|'\r\n' newline:
-        Controls universal newlines.
-        See 'io.open' newline parameter documentation for more details.
+    :param list(unicode) digests:
+        .. seealso:: CopyFile
 
-    :returns str|unicode:
-        The file's contents.
-        Returns unicode string when `encoding` is not None.
+        Use `stats` to obtain the digests of each file.
 
-    .. seealso:: FTP LIMITATIONS at this module's doc for performance issues information
-    '''
-    source_file = OpenFile(filename, binary=binary, encoding=encoding, newline=newline)
-    try:
-        contents = source_file.read()
-    finally:
-        source_file.close()
+    :param bool digest_sidecars:
+        .. seealso:: CopyFile
 
-    return contents
+    :param bool|'digest' verify:
+        .. seealso:: CopyFile
 
+    :param callable|ProgressReporter progress:
+        .. seealso:: ProgressReporter
 
-#===================================================================================================
-# GetFileLines
-#===================================================================================================
-def GetFileLines(filename, newline=None, encoding=None):
-    '''
-    Reads a file and returns its contents as a list of lines. Works for both local and remote files.
+        The whole tree is listed before copying, to know the totals (memory grows with the tree).
 
-    :param unicode filename:
+    :param bool mirror:
+        If True, target entries that don't exist in the source (matching the mask) are removed, so
+        the target ends up mirroring the source. Stale entries are found while scanning the
+        source, and removed in a single delete phase before any file is copied (using `workers`
+        threads, if given). Stale directories are removed with all their contents.
 
-    :param None|''|'\n'|'\r'|'\r\n' newline:
-        Controls universal newlines.
-        See 'io.open' newline parameter documentation for more details.
+        Entries whose type changed (a file that became a directory or vice versa) are removed as
+        well. When md5_check is True, the .md5 files of the copied files are kept.
 
-    :param unicode encoding:
-        File's encoding. If not None, contents obtained from file will be decoded using this
-        `encoding`.
+        Use `stats` to find out how many files and directories were removed. Only local targets
+        are supported.
 
-    :returns list(unicode):
-        The file's lines
+        The whole tree is listed before copying (memory grows with the tree).
 
-    .. seealso:: FTP LIMITATIONS at this module's doc for performance issues information
-    '''
-    return GetFileContents(
-        filename,
-        binary=False,
-        encoding=encoding,
-        newline=newline,
-    ).split('\n')
+    :param Throttle throttle:
+        .. seealso:: CopyFile
 
+        Shared by all the workers.
 
-def OpenFile(filename, binary=False, newline=None, encoding=None):
-    '''
-    Open a file and returns it.
-    Consider the possibility of a remote file (HTTP, HTTPS, FTP)
+    :raises DirectoryNotFoundError:
+        If target_dir does not exist, and create_target_dir is False
 
-    :param unicode filename:
-        Local or remote filename.
+    .. seealso:: CopyFile for documentation on accepted protocols
 
-    :param bool binary:
-        If True returns the file as is, ignore any EOL conversion.
-        If set ignores univeral_newlines parameter.
+    .. seealso:: FTP LIMITATIONS at this module's doc for performance issues information
+    '''
+    # Check if we were given a directory or a directory with mask
+    if IsDir(source_dir):
+        # Yes, it's a directory, copy everything from it
+        source_mask = '*'
+    else:
+        # Split directory and mask
+        source_dir, source_mask = os.path.split(source_dir)
 
-    :param None|''|'\n'|'\r'|'\r\n' newline:
-        Controls universal newlines.
-        See 'io.open' newline parameter documentation for more details.
+    # Create directory if necessary
+    if not IsDir(target_dir):
+        if create_target_dir:
+            CreateDirectory(target_dir)
+        else:
+            from ._exceptions import DirectoryNotFoundError
+            raise DirectoryNotFoundError(target_dir)
 
-    :param unicode encoding:
-        File's encoding. If not None, contents obtained from file will be decoded using this
-        `encoding`.
+    manifest_check = None
+    if md5_check == 'manifest':
+        manifest_check = Md5ManifestCheck(source_dir, target_dir)
+
+    extraneous = [] if mirror else None
+    copies = _IterCopyFiles(source_dir, source_mask, target_dir, md5_check, extraneous)
+    copy_kwargs = dict(
+        md5_check=manifest_check if manifest_check is not None else md5_check,
+        stats=stats,
+        clone=clone,
+        link_mode=link_mode,
+        digests=digests,
+        digest_sidecars=digest_sidecars,
+        verify=verify,
+        throttle=throttle,
+    )
+    reporter = _GetProgressReporter(progress)
 
-    :returns file:
-        The open file, it must be closed by the caller
+    try:
+        _CopyFilesFrom(copies, workers, reporter, extraneous, stats, copy_kwargs)
+    finally:
+        if manifest_check is not None:
+            manifest_check.Save()
 
-    @raise: FileNotFoundError
-        When the given filename cannot be found
 
-    .. seealso:: FTP LIMITATIONS at this module's doc for performance issues information
+def _CopyFilesFrom(copies, workers, reporter, extraneous, stats, copy_kwargs):
     '''
-    from six.moves.urllib.parse import urlparse
-    filename_url = urlparse(filename)
+    Copies the files listed by _IterCopyFiles.
 
-    # Check if file is local
-    if _UrlIsLocal(filename_url):
-        if not os.path.isfile(filename):
-            from ._exceptions import FileNotFoundError
-            raise FileNotFoundError(filename)
+    .. seealso:: CopyFiles for parameters.
 
-        mode = 'rb' if binary else 'r'
-        return io.open(filename, mode, encoding=encoding, newline=newline)
+    :param ProgressReporter|None reporter:
 
-    # Not local
-    from ._exceptions import NotImplementedProtocol
-    raise NotImplementedProtocol(target_url.scheme)
+    :param list(unicode)|None extraneous:
+        The list filled by _IterCopyFiles when mirroring.
+
+    :param dict copy_kwargs:
+        Passed to CopyFile.
+    '''
+    if reporter is None and extraneous is None:
+        # Copy files as we find them
+        files = _IterCreatingDirectories(copies)
+        if workers:
+            _CopyFilesInParallel(files, workers, **copy_kwargs)
+        else:
+            for i_source_path, i_target_path in files:
+                CopyFile(i_source_path, i_target_path, **copy_kwargs)
+        return
+
+    # List everything first, so we know the totals for the progress reports (and all stale entries,
+    # when mirroring) before copying.
+    directories = []
+    files = []
+    for i_source_path, i_target_path in copies:
+        if i_source_path is None:
+            directories.append(i_target_path)
+        else:
+            files.append((i_source_path, i_target_path))
+
+    if extraneous:
+        _DeleteEntries(extraneous, workers, stats)
+
+    for i_directory in directories:
+        CreateDirectory(i_directory)
+
+    if reporter is not None:
+        # Links are copied as links (even dangling ones), that's what they take
+        reporter.Start(
+            files_total=len(files),
+            bytes_total=sum(os.lstat(i_source_path).st_size for i_source_path, _ in files),
+        )
+
+    if workers:
+        _CopyFilesInParallel(files, workers, progress=reporter, **copy_kwargs)
+    else:
+        for i_source_path, i_target_path in files:
+            CopyFile(i_source_path, i_target_path, progress=reporter, **copy_kwargs)
+
+    if reporter is not None:
+        reporter.Finish()
+
+
+def _IterCopyFiles(source_dir, source_mask, target_dir, md5_check, extraneous=None):
+    '''
+    Lists the copies needed to copy the contents of source_dir into target_dir, recursively.
+
+    The tree is walked iteratively, depth first: only the listings of the directories being walked
+    are kept in memory.
+
+    :param unicode source_dir:
+        The source directory.
+
+    :param unicode source_mask:
+        Mask for the entries in source_dir. Sub-directories contents are never filtered.
+
+    :param unicode target_dir:
+        The target directory.
+
+    :param bool|'manifest'|'quick'|'full' md5_check:
+        If True, md5 files are not listed (they are copied by CopyFile along with their files)
+
+        If 'manifest', the md5 manifests are not listed.
+
+        Other modes don't use md5 files: everything is listed.
+
+    :param list(unicode) extraneous:
+        If given, target entries that must be removed to mirror the source are appended to this
+        list while iterating (@see CopyFiles mirror parameter).
+
+    :rtype: iterator(tuple(unicode|None,unicode))
+    :returns:
+        Pairs of (source_path, target_path).
+
+        Directories are listed as (None, target_path) before any of their contents.
+    '''
+    import fnmatch
+
+    manifest_check = md5_check == 'manifest'
+    md5_check = bool(md5_check) and md5_check not in ('manifest', 'quick', 'full')
+
+    def IsIgnored(filename):
+        if md5_check:
+            return filename.endswith('.md5')  # md5 files will be copied by CopyFile
+        if manifest_check:
+            return filename == MD5_MANIFEST_FILENAME
+        return False
+
+    def ListDirectory(source_dir, source_mask, target_dir):
+        '''
+        :returns: iterator over the (source_path, target_path) entries of the directory to copy.
+        '''
+        # List and match files
+        filenames = ListFiles(source_dir)
+
+        # Check if we have a source directory
+        if filenames is None:
+            return iter(())
+
+        if extraneous is not None and IsDir(target_dir):
+            source_names = set(filenames)
+            for i_filename in ListFiles(target_dir):
+                if i_filename in source_names or not fnmatch.fnmatch(i_filename, source_mask):
+                    continue
+                if md5_check and i_filename.endswith('.md5') and i_filename[:-4] in source_names:
+                    continue  # md5 file of a copied file
+                if manifest_check and i_filename == MD5_MANIFEST_FILENAME:
+                    continue
+                extraneous.append(target_dir + '/' + i_filename)
+
+        return (
+            (source_dir + '/' + i_filename, target_dir + '/' + i_filename)
+            for i_filename in filenames
+            if not IsIgnored(i_filename)
+            if fnmatch.fnmatch(i_filename, source_mask)
+        )
+
+    pending = [ListDirectory(source_dir, source_mask, target_dir)]
+    while pending:
+        entry = next(pending[-1], None)
+        if entry is None:
+            pending.pop()  # Done with this directory
+            continue
+
+        source_path, target_path = entry
+        if IsDir(source_path):
+            if extraneous is not None and os.path.lexists(target_path) and \
+                (IsLink(target_path) or not os.path.isdir(target_path)):
+                extraneous.append(target_path)
+
+            # If we found a directory, copy it recursively
+            yield None, target_path
+            pending.append(ListDirectory(source_path, '*', target_path))
+        else:
+            if extraneous is not None and os.path.isdir(target_path) and not IsLink(target_path):
+                extraneous.append(target_path)
+
+            yield source_path, target_path
+
+
+def _IterCreatingDirectories(copies):
+    '''
+    Creates the target directories listed by _IterCopyFiles as they come.
+
+    :param iterator(tuple(unicode|None,unicode)) copies:
+        .. seealso:: _IterCopyFiles
+
+    :rtype: iterator(tuple(unicode,unicode))
+    :returns:
+        Only the file copies.
+    '''
+    for i_source_path, i_target_path in copies:
+        if i_source_path is None:
+            CreateDirectory(i_target_path)
+        else:
+            yield i_source_path, i_target_path
+
+
+def _DeleteEntries(paths, workers=None, stats=None):
+    '''
+    Removes files and directories (with all their contents), as a batch.
+
+    :param list(unicode) paths:
+        Local paths to remove. No path may be inside another one.
+
+    :param int workers:
+        If given, the entries are removed by a pool with this number of threads.
+
+    :param CopyStats stats:
+        If given, registers the files and directories removed.
+    '''
+    def Delete(path):
+        if os.path.isdir(path) and not IsLink(path):
+            DeleteDirectory(path)
+            if stats is not None:
+                stats.AddDeletedDirectory()
+        else:
+            DeleteFile(path)
+            if stats is not None:
+                stats.AddDeletedFile()
+
+    if not workers:
+        for i_path in paths:
+            Delete(i_path)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Consume the results to raise the first error found
+        for _ in executor.map(Delete, paths):
+            pass
+
+
+def _CopyFilesInParallel(files, workers, **kwargs):
+    '''
+    Copies files using a thread pool.
+
+    `files` is consumed as the copies are done: at most COPY_QUEUE_SIZE copies per worker are queued
+    at any time, so it can be a generator still scanning the source.
+
+    :param iterable(tuple(unicode,unicode)) files:
+        (source_filename, target_filename) to copy. Target directories must already exist when each
+        item is produced.
+
+    :param int workers:
+        Number of threads used to copy.
+
+    :param kwargs:
+        Passed to CopyFile.
+
+    :raises Exception:
+        The first error found. Files not consumed yet are ignored and queued copies are cancelled.
+    '''
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    queue_size = workers * COPY_QUEUE_SIZE
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        try:
+            for i_source_filename, i_target_filename in files:
+                if len(pending) >= queue_size:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for i_future in done:
+                        i_future.result()
+                pending.add(executor.submit(CopyFile, i_source_filename, i_target_filename, **kwargs))
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for i_future in done:
+                    i_future.result()
+        except:
+            for i_future in pending:
+                i_future.cancel()
+            raise
 
 
 
 #===================================================================================================
-# ListFiles
+# CopyFilesX
 #===================================================================================================
-def ListFiles(directory):
+def CopyFilesX(
+    file_mapping,
+    workers=None,
+    stats=None,
+    clone='never',
+    link_mode=None,
+    digests=None,
+    digest_sidecars=False,
+    verify=False,
+    progress=None,
+    throttle=None):
     '''
-    Lists the files in the given directory
+    Copies files into directories, according to a file mapping
 
-    :type directory: unicode | unicode
-    :param directory:
-        A directory or URL
+    :param list(tuple(unicode,unicode)) file_mapping:
+        A list of mappings between the directory in the target and the source.
+        For syntax, @see: ExtendedPathMask
 
-    :rtype: list(unicode) | list(unicode)
+    :param int workers:
+        .. seealso:: CopyFiles
+
+        The copies start while the mapping is still being expanded (unless a target is inside a
+        source, where the copies would be found as sources).
+
+    :param CopyStats stats:
+        .. seealso:: CopyFile
+
+    :param 'auto'|'always'|'never' clone:
+        .. seealso:: CopyFile
+
+    :param None|'hard'|'auto' link_mode:
+        .. seealso:: CopyFiles
+
+    :param list(unicode) digests:
+        .. seealso:: CopyFiles
+
+    :param bool digest_sidecars:
+        .. seealso:: CopyFile
+
+    :param bool|'digest' verify:
+        .. seealso:: CopyFile
+
+    :param callable|ProgressReporter progress:
+        .. seealso:: ProgressReporter
+
+        The whole mapping is expanded before copying, to know the totals.
+
+    :param Throttle throttle:
+        .. seealso:: CopyFiles
+
+    :rtype: list(tuple(unicode,unicode))
     :returns:
-        List of filenames/directories found in the given directory.
-        Returns None if the given directory does not exists.
+        List of files copied. (source_filename, target_filename)
 
-        If `directory` is a unicode string, all files returned will also be unicode
+    .. seealso:: FTP LIMITATIONS at this module's doc for performance issues information
+    '''
+    copy_kwargs = dict(
+        stats=stats,
+        clone=clone,
+        link_mode=link_mode,
+        digests=digests,
+        digest_sidecars=digest_sidecars,
+        verify=verify,
+        throttle=throttle,
+    )
+    if progress is not None:
+        plan = PlanCopyFilesX(file_mapping)
+        plan.Execute(workers=workers, progress=progress, **copy_kwargs)
+        return plan.operations
+
+    # Copy files as the mapping is expanded
+    copies = _IterCopyFilesX(file_mapping)
+    if _HasTargetInSource(file_mapping):
+        copies = list(copies)
+
+    operations = []
+    def IterFiles():
+        created_dir = None
+        for i_source_filename, i_target_filename in copies:
+            operations.append((i_source_filename, i_target_filename))
+
+            # Create target dir if necessary
+            target_dir = os.path.dirname(i_target_filename)
+            if target_dir != created_dir:
+                CreateDirectory(target_dir)
+                created_dir = target_dir
+
+            yield i_source_filename, i_target_filename
+
+    if workers:
+        _CopyFilesInParallel(IterFiles(), workers, **copy_kwargs)
+    else:
+        for i_source_filename, i_target_filename in IterFiles():
+            CopyFile(i_source_filename, i_target_filename, **copy_kwargs)
+    return operations
+
+
+
+#===================================================================================================
+# PlanCopyFilesX
+#===================================================================================================
+def PlanCopyFilesX(file_mapping):
+    '''
+    Plans the copy CopyFilesX would make, without copying anything (the target is not touched).
+
+    :param list(tuple(unicode,unicode)) file_mapping:
+        .. seealso:: CopyFilesX
+
+    :rtype: CopyPlan
+    '''
+    files = list(_IterCopyFilesX(file_mapping))
+    # Links are copied as links (even dangling ones), that's what they take
+    sizes = [os.lstat(i_source_filename).st_size for i_source_filename, _ in files]
+    return CopyPlan(files, sizes)
+
+
+def _HasTargetInSource(file_mapping):
+    '''
+    :param list(tuple(unicode,unicode)) file_mapping:
+        .. seealso:: CopyFilesX
+
+    :rtype: bool
+    :returns:
+        True if a target directory is inside a source directory of the mapping.
+    '''
+    def RealDir(path):
+        return os.path.join(os.path.normcase(os.path.realpath(path)), '')
+
+    source_dirs = [RealDir(ExtendedPathMask.Split(i_mask)[2]) for _, i_mask in file_mapping]
+    for i_target_path, _ in file_mapping:
+        target_dir = RealDir(i_target_path)
+        if any(target_dir.startswith(i_source_dir) for i_source_dir in source_dirs):
+            return True
+    return False
+
+
+def _IterCopyFilesX(file_mapping):
+    '''
+    Expands a file mapping, lazily.
+
+    :param list(tuple(unicode,unicode)) file_mapping:
+        .. seealso:: CopyFilesX
+
+    :rtype: iterator(tuple(unicode,unicode))
+    :returns:
+        The copies to make: (source_filename, target_filename).
+    '''
+    # List files that match the mapping
+    for i_target_path, i_source_path_mask in file_mapping:
+        tree_recurse, flat_recurse, dirname, in_filters, out_filters = ExtendedPathMask.Split(i_source_path_mask)
+
+        _AssertIsLocal(dirname)
+
+        filenames = IterFindFiles(dirname, in_filters, out_filters, tree_recurse)
+        for i_source_filename in filenames:
+            if os.path.isdir(i_source_filename):
+                continue  # Do not copy dirs
+
+            i_target_filename = i_source_filename[len(dirname) + 1:]
+            if flat_recurse:
+                i_target_filename = os.path.basename(i_target_filename)
+            i_target_filename = os.path.join(i_target_path, i_target_filename)
+
+            yield StandardizePath(i_source_filename), StandardizePath(i_target_filename)
+
+
+
+#===================================================================================================
+# CopyPlan
+#===================================================================================================
+class CopyPlan(object):
+    '''
+    A list of file copies that can be inspected, stored (as JSON), split and executed later.
+
+    .. seealso:: PlanCopyFilesX
+
+    :ivar list(tuple(unicode,unicode)) operations:
+        The copies: (source_filename, target_filename).
+
+    :ivar list(int) sizes:
+        Size of each source file, in the same order of `operations`.
+
+    :ivar list(unicode) directories:
+        Target directories the copies need.
+    '''
+
+    def __init__(self, operations, sizes):
+        '''
+        :param list(tuple(unicode,unicode)) operations:
+
+        :param list(int) sizes:
+        '''
+        self.operations = list(operations)
+        self.sizes = list(sizes)
+        self.directories = sorted(set(os.path.dirname(i_target) for _, i_target in self.operations))
+
+
+    @property
+    def file_count(self):
+        '''
+        :rtype: int
+        :returns:
+            Number of files to copy.
+        '''
+        return len(self.operations)
+
+
+    @property
+    def total_bytes(self):
+        '''
+        :rtype: int
+        :returns:
+            Number of bytes to copy (sum of the source sizes when the plan was made).
+        '''
+        return sum(self.sizes)
+
+
+    def Execute(self, workers=None, progress=None, **kwargs):
+        '''
+        Copies the files.
+
+        :param int workers:
+            .. seealso:: CopyFiles
+
+        :param callable|ProgressReporter progress:
+            .. seealso:: ProgressReporter
+
+        :param kwargs:
+            Passed to CopyFile (stats, clone, link_mode, digests, digest_sidecars, verify,
+            throttle...)
+        '''
+        reporter = _GetProgressReporter(progress)
+        if reporter is not None:
+            reporter.Start(files_total=self.file_count, bytes_total=self.total_bytes)
+
+        if workers:
+            # Create all target dirs first, then copy in parallel
+            for i_target_dir in self.directories:
+                CreateDirectory(i_target_dir)
+
+            _CopyFilesInParallel(self.operations, workers, progress=reporter, **kwargs)
+        else:
+            # Copy files
+            for i_source_filename, i_target_filename in self.operations:
+                # Create target dir if necessary
+                target_dir = os.path.dirname(i_target_filename)
+                CreateDirectory(target_dir)
+
+                CopyFile(i_source_filename, i_target_filename, progress=reporter, **kwargs)
+
+        if reporter is not None:
+            reporter.Finish()
+
+
+    def Split(self, count):
+        '''
+        Splits this plan in smaller ones with about the same number of bytes to copy each.
+
+        :param int count:
+            Number of plans to create.
+
+        :rtype: list(CopyPlan)
+        '''
+        import heapq
+
+        parts = [(0, i, [], []) for i in range(count)]
+        order = sorted(range(len(self.operations)), key=lambda i: self.sizes[i], reverse=True)
+        for i_index in order:
+            part_bytes, part_index, operations, sizes = heapq.heappop(parts)
+            operations.append(self.operations[i_index])
+            sizes.append(self.sizes[i_index])
+            heapq.heappush(parts, (part_bytes + self.sizes[i_index], part_index, operations, sizes))
+
+        parts.sort(key=lambda x: x[1])
+        return [CopyPlan(operations, sizes) for _, _, operations, sizes in parts]
+
+
+    def ToJson(self):
+        '''
+        :rtype: unicode
+        :returns:
+            The plan serialized as JSON.
+
+        .. seealso:: FromJson
+        '''
+        import json
+        return six.text_type(json.dumps({
+            'operations': self.operations,
+            'sizes': self.sizes,
+        }))
+
+
+    @classmethod
+    def FromJson(cls, contents):
+        '''
+        :param unicode contents:
+            A plan serialized by ToJson.
+
+        :rtype: CopyPlan
+        '''
+        import json
+        data = json.loads(contents)
+        return cls([tuple(i) for i in data['operations']], data['sizes'])
+
+
+
+#===================================================================================================
+# IsFile
+#===================================================================================================
+def IsFile(path):
+    '''
+    :param unicode path:
+        Path to a file (local or ftp)
 
     :raises NotImplementedProtocol:
-        If file protocol is not local or FTP
+        If checking for a non-local, non-ftp file
+
+    :rtype: bool
+    :returns:
+        True if the file exists
 
     .. seealso:: FTP LIMITATIONS at this module's doc for performance issues information
     '''
     from six.moves.urllib.parse import urlparse
-    directory_url = urlparse(directory)
+    url = urlparse(path)
 
-    # Handle local
-    if _UrlIsLocal(directory_url):
-        if not os.path.isdir(directory):
-            return None
-        return os.listdir(directory)
+    if _UrlIsLocal(url):
+        if IsLink(path):
+            return IsFile(ReadLink(path))
+        return os.path.isfile(path)
 
-    # Handle FTP
-    elif directory_url.scheme == 'ftp':
+    elif url.scheme == 'ftp':
         from ._exceptions import NotImplementedProtocol
-        raise NotImplementedProtocol(directory_url.scheme)
+        raise NotImplementedProtocol(url.scheme)
     else:
         from ._exceptions import NotImplementedProtocol
-        raise NotImplementedProtocol(directory_url.scheme)
-
+        raise NotImplementedProtocol(url.scheme)
 
 
-#===================================================================================================
-# CheckIsFile
-#===================================================================================================
-def CheckIsFile(filename):
+def GetDriveType(path):
     '''
-    Check if the given file exists.
+    Determine the type of drive, which can be one of the following values:
+        DRIVE_UNKNOWN = 0
+            The drive type cannot be determined.
 
-    @filename: unicode
-        The filename to check for existence.
+        DRIVE_NO_ROOT_DIR = 1
+            The root path is invalid; for example, there is no volume mounted at the specified path.
 
-    @raise: FileNotFoundError
-        Raises if the file does not exist.
-    '''
+        DRIVE_REMOVABLE = 2
+            The drive has removable media; for example, a floppy drive, thumb drive, or flash card reader.
+
+        DRIVE_FIXED = 3
+            The drive has fixed media; for example, a hard disk drive or flash drive.
+
+        DRIVE_REMOTE = 4
+            The drive is a remote (network) drive.
+
+        DRIVE_CDROM = 5
+            The drive is a CD-ROM drive.
+
+        DRIVE_RAMDISK = 6
+            The drive is a RAM disk
+
+    :note:
+        The implementation is valid only for Windows OS
+        Linux will always return DRIVE_UNKNOWN
+
+    :param path:
+        Path to a file or directory
+    '''
+    if sys.platform == 'win32':
+        import ctypes
+        kdll = ctypes.windll.LoadLibrary("kernel32.dll")
+
+        return kdll.GetDriveType(path + '\\')
+
+        import win32file
+        if IsFile(path):
+            path = os.path.dirname(path)
+
+        # A trailing backslash is required.
+        return win32file.GetDriveType(path + '\\')
+
+    else:
+        return DRIVE_UNKNOWN
+
+
+
+
+#===================================================================================================
+# IsDir
+#===================================================================================================
+def IsDir(directory):
+    '''
+    :param unicode directory:
+        A path
+
+    :rtype: bool
+    :returns:
+        Returns whether the given path points to an existent directory.
+
+    :raises NotImplementedProtocol:
+        If the path protocol is not local or ftp
+
+    .. seealso:: FTP LIMITATIONS at this module's doc for performance issues information
+    '''
+    from six.moves.urllib.parse import urlparse
+    directory_url = urlparse(directory)
+
+    if _UrlIsLocal(directory_url):
+        return os.path.isdir(directory)
+    elif directory_url.scheme == 'ftp':
+        from ._exceptions import NotImplementedProtocol
+        raise NotImplementedProtocol(target_url.scheme)
+    else:
+        from ._exceptions import NotImplementedProtocol
+        raise NotImplementedProtocol(directory_url.scheme)
+
+
+
+#===================================================================================================
+# Exists
+#===================================================================================================
+def Exists(path):
+    '''
+    :rtype: bool
+    :returns:
+        True if the path already exists (either a file or a directory)
+
+    .. seealso:: FTP LIMITATIONS at this module's doc for performance issues information
+    '''
+    from six.moves.urllib.parse import urlparse
+    path_url = urlparse(path)
+
+    # Handle local
+    if _UrlIsLocal(path_url):
+        return IsFile(path) or IsDir(path) or IsLink(path)
+    return IsFile(path) or IsDir(path)
+
+
+
+#===================================================================================================
+# CopyDirectory
+#===================================================================================================
+def CopyDirectory(
+    source_dir,
+    target_dir,
+    override=False,
+    clone='never',
+    incremental=False,
+    compare='stat',
+    prune=False,
+    progress=None,
+    throttle=None):
+    '''
+    Recursively copy a directory tree.
+
+    :param unicode source_dir:
+        Where files will come from
+
+    :param unicode target_dir:
+        Where files will go to
+
+    :param bool override:
+        If True and target_dir already exists, it will be deleted before copying.
+
+        Ignored when `incremental` is True.
+
+    :param 'auto'|'always'|'never' clone:
+        .. seealso:: CopyFile
+
+    :param bool incremental:
+        If True, synchronizes target_dir with source_dir instead of copying everything: only files
+        missing in the target or changed (see `compare`) are copied. Copied files keep the source
+        modification time, so the next synchronization can skip them.
+
+    :param 'stat'|'quick'|'hash' compare:
+        How incremental mode decides that a file has changed:
+            'stat': The size or the modification time (in nanoseconds) differ.
+            'quick': The QuickFingerprint of the files differ. Ignores timestamps, but only
+                samples the contents.
+            'hash': The size or the md5 of the contents differ. Slower, but ignores timestamps.
+
+    :param bool prune:
+        If True, in incremental mode, files and directories in target_dir that are not in
+        source_dir are removed.
+
+    :param callable|ProgressReporter progress:
+        .. seealso:: ProgressReporter
+
+    :param Throttle throttle:
+        .. seealso:: CopyFile
+
+    :rtype: None | CopyStats
+    :returns:
+        In incremental mode, a summary of what was done (copied, skipped and removed entries).
+
+    :raises NotImplementedForRemotePathError:
+        If trying to copy to/from remote directories
+
+    :raises CloneNotSupportedError:
+        If clone is 'always' and a file can't be cloned
+    '''
+    _AssertIsLocal(source_dir)
+    _AssertIsLocal(target_dir)
+
+    reporter = _GetProgressReporter(progress)
+    if reporter is not None:
+        files_total, bytes_total = _CountTree(source_dir, followlinks=True)
+        reporter.Start(files_total=files_total, bytes_total=bytes_total)
+
+    if incremental:
+        result = _SyncDirectory(
+            source_dir,
+            target_dir,
+            compare=compare,
+            prune=prune,
+            clone=clone,
+            progress=reporter,
+            throttle=throttle,
+        )
+        if reporter is not None:
+            reporter.Finish()
+        return result
+
+    if override and IsDir(target_dir):
+        DeleteDirectory(target_dir, skip_on_error=False)
+
+    import shutil
+    if throttle is None:
+        throttle = GetIoScheduler()
+    if clone == 'never' and reporter is None and throttle is None:
+        shutil.copytree(source_dir, target_dir)
+        return
+
+    def CopyFunction(source_filename, target_filename):
+        file_progress = _FileProgress(reporter, source_filename, throttle=throttle)
+        file_progress.Begin()
+        _CopyFileData(source_filename, target_filename, clone=clone, on_copied=file_progress.OnCopied)
+        shutil.copystat(source_filename, target_filename)
+        file_progress.Done()
+
+    _CopyTree(source_dir, target_dir, CopyFunction)
+    if reporter is not None:
+        reporter.Finish()
+
+
+
+def _CopyTree(source_dir, target_dir, copy_function):
+    '''
+    Same as shutil.copytree (following links), but accepting a copy_function on Python 2 too.
+
+    :param unicode source_dir:
+
+    :param unicode target_dir:
+        Must not exist.
+
+    :param callable(unicode,unicode) copy_function:
+        Copies each file, given source and target filenames.
+    '''
+    import shutil
+
+    directories = []
+    for dir_root, _directories, filenames in os.walk(source_dir, followlinks=True):
+        relative_root = os.path.relpath(dir_root, source_dir)
+        if relative_root == os.curdir:
+            target_root = target_dir
+        else:
+            target_root = os.path.join(target_dir, relative_root)
+        os.makedirs(target_root)
+        directories.append((dir_root, target_root))
+
+        for i_filename in filenames:
+            copy_function(os.path.join(dir_root, i_filename), os.path.join(target_root, i_filename))
+
+    # Only after copying the files, that change the modification time of their directories
+    for i_source_dir, i_target_dir in reversed(directories):
+        shutil.copystat(i_source_dir, i_target_dir)
+
+
+def _SyncDirectory(source_dir, target_dir, compare, prune, clone, progress, throttle):
+    '''
+    Incremental mode of CopyDirectory.
+
+    .. seealso:: CopyDirectory for parameters.
+
+    :param ProgressReporter|None progress:
+        Started reporter.
+
+    :param Throttle|None throttle:
+
+    :rtype: CopyStats
+    '''
+    import shutil
+
+    if compare not in ('stat', 'quick', 'hash'):
+        raise ValueError('Unexpected compare mode: %r' % (compare,))
+
+    if not os.path.isdir(source_dir):
+        from ._exceptions import DirectoryNotFoundError
+        raise DirectoryNotFoundError(source_dir)
+
+    def IsUpToDate(source_filename, target_filename):
+        source_stat = os.stat(source_filename)
+        target_stat = os.stat(target_filename)
+        if source_stat.st_size != target_stat.st_size:
+            return False
+        if compare == 'stat':
+            return _GetMTimeNs(source_stat) == _GetMTimeNs(target_stat)
+        if compare == 'quick':
+            return QuickFingerprint(source_filename) == QuickFingerprint(target_filename)
+        return Md5Hex(source_filename) == Md5Hex(target_filename)
+
+    stats = CopyStats()
+    for dir_root, directories, filenames in os.walk(source_dir, followlinks=True):
+        relative_root = os.path.relpath(dir_root, source_dir)
+        if relative_root == os.curdir:
+            target_root = target_dir
+        else:
+            target_root = os.path.join(target_dir, relative_root)
+
+        if not os.path.isdir(target_root):
+            if os.path.lexists(target_root):
+                DeleteFile(target_root)
+                stats.AddDeletedFile()
+            os.makedirs(target_root)
+            stats.AddCreatedDirectory()
+
+        for i_filename in filenames:
+            source_filename = os.path.join(dir_root, i_filename)
+            target_filename = os.path.join(target_root, i_filename)
+
+            if IsLink(target_filename):
+                DeleteLink(target_filename)  # Never write through a link in the target
+            elif os.path.isdir(target_filename):
+                DeleteDirectory(target_filename)
+                stats.AddDeletedDirectory()
+            elif os.path.isfile(target_filename) and IsUpToDate(source_filename, target_filename):
+                stats.AddSkip()
+                if progress is not None:
+                    progress.Update(files=1, bytes_=os.path.getsize(source_filename))
+                continue
+
+            CopyFile(
+                source_filename,
+                target_filename,
+                copy_symlink=False,
+                stats=stats,
+                clone=clone,
+                progress=progress,
+                throttle=throttle,
+            )
+            shutil.copystat(source_filename, target_filename)
+
+        if prune:
+            expected = set(directories + filenames)
+            for i_name in os.listdir(target_root):
+                if i_name in expected:
+                    continue
+                path = os.path.join(target_root, i_name)
+                if os.path.isdir(path) and not IsLink(path):
+                    DeleteDirectory(path)
+                    stats.AddDeletedDirectory()
+                else:
+                    DeleteFile(path)
+                    stats.AddDeletedFile()
+
+    return stats
+
+
+def _GetStatKey(stat_result):
+    '''
+    :param os.stat_result stat_result:
+
+    :rtype: tuple(int,int,int,int)
+    :returns:
+        (st_dev, st_ino, st_size, mtime in nanoseconds): the fields that change when a file is
+        replaced or its contents are modified.
+    '''
+    return (stat_result.st_dev, stat_result.st_ino, stat_result.st_size, _GetMTimeNs(stat_result))
+
+
+def _GetMTimeNs(stat_result):
+    '''
+    :param os.stat_result stat_result:
+
+    :rtype: int
+    :returns:
+        The modification time in nanoseconds (with less resolution on Python 2).
+    '''
+    result = getattr(stat_result, 'st_mtime_ns', None)
+    if result is None:
+        result = int(stat_result.st_mtime * 1e9)
+    return result
+
+
+
+#===================================================================================================
+# DeleteFile
+#===================================================================================================
+def DeleteFile(target_filename):
+    '''
+    Deletes the given local filename.
+
+    .. note:: If file doesn't exist this method has no effect.
+
+    :param unicode target_filename:
+        A local filename
+
+    :raises NotImplementedForRemotePathError:
+        If trying to delete a non-local path
+
+    :raises FileOnlyActionError:
+        Raised when filename refers to a directory.
+    '''
+    _AssertIsLocal(target_filename)
+
+    try:
+        if IsLink(target_filename):
+            DeleteLink(target_filename)
+        elif IsFile(target_filename):
+            os.remove(target_filename)
+        elif IsDir(target_filename):
+            from ._exceptions import FileOnlyActionError
+            raise FileOnlyActionError(target_filename)
+    except Exception as e:
+        reraise(e, 'While executing filesystem.DeleteFile(%s)' % (target_filename))
+
+
+
+#===================================================================================================
+# AppendToFile
+#===================================================================================================
+def AppendToFile(filename, contents, eol_style=EOL_STYLE_NATIVE, encoding=None, binary=False):
+    '''
+    Appends content to a local file.
+
+    :param unicode filename:
+
+    :param unicode contents:
+
+    :type eol_style: EOL_STYLE_XXX constant
+    :param eol_style:
+        Replaces the EOL by the appropriate EOL depending on the eol_style value.
+        Considers that all content is using only "\n" as EOL.
+
+    :param unicode encoding:
+        Target file's content encoding.
+        Defaults to sys.getfilesystemencoding()
+
+    :param bool binary:
+        If True, content is appended in binary mode. In this case, `contents` must be `bytes` and not
+        `unicode`
+
+    :raises NotImplementedForRemotePathError:
+        If trying to modify a non-local path
+
+    :raises ValueError:
+        If trying to mix unicode `contents` without `encoding`, or `encoding` without
+        unicode `contents`
+    '''
+    _AssertIsLocal(filename)
+
+    assert isinstance(contents, six.text_type) ^ binary, 'Must always receive unicode contents, unless binary=True'
+
+    if not binary:
+        # Replaces eol on each line by the given eol_style.
+        contents = _HandleContentsEol(contents, eol_style)
+
+        # Handle encoding here, and always write in binary mode. We can't use io.open because it
+        # tries to do its own line ending handling.
+        contents = contents.encode(encoding or sys.getfilesystemencoding())
+
+    oss = open(filename, 'ab')
+    try:
+        oss.write(contents)
+    finally:
+        oss.close()
+
+
+
+#===================================================================================================
+# MoveFile
+#===================================================================================================
+def MoveFile(source_filename, target_filename):
+    '''
+    Moves a file.
+
+    :param unicode source_filename:
+
+    :param unicode target_filename:
+
+    :raises NotImplementedForRemotePathError:
+        If trying to operate with non-local files.
+    '''
+    _AssertIsLocal(source_filename)
+    _AssertIsLocal(target_filename)
+
+    import shutil
+    shutil.move(source_filename, target_filename)
+
+
+
+#===================================================================================================
+# MoveDirectory
+#===================================================================================================
+def MoveDirectory(source_dir, target_dir):
+    '''
+    Moves a directory.
+
+    :param unicode source_dir:
+
+    :param unicode target_dir:
+
+    :raises NotImplementedError:
+        If trying to move anything other than:
+            Local dir -> local dir
+            FTP dir -> FTP dir (same host)
+    '''
+    if not IsDir(source_dir):
+        from ._exceptions import DirectoryNotFoundError
+        raise DirectoryNotFoundError(source_dir)
+
+    if Exists(target_dir):
+        from ._exceptions import DirectoryAlreadyExistsError
+        raise DirectoryAlreadyExistsError(target_dir)
+
+    from six.moves.urllib.parse import urlparse
+    source_url = urlparse(source_dir)
+    target_url = urlparse(target_dir)
+
+    # Local to local
+    if _UrlIsLocal(source_url) and _UrlIsLocal(target_url):
+        import shutil
+        shutil.move(source_dir, target_dir)
+
+    # FTP to FTP
+    elif source_url.scheme == 'ftp' and target_url.scheme == 'ftp':
+        from ._exceptions import NotImplementedProtocol
+        raise NotImplementedProtocol(target_url.scheme)
+    else:
+        raise NotImplementedError('Can only move directories local->local or ftp->ftp')
+
+
+#===================================================================================================
+# GetFileContents
+#===================================================================================================
+def GetFileContents(filename, binary=False, encoding=None, newline=None):
+    '''
+    Reads a file and returns its contents. Works for both local and remote files.
+
+    :param unicode filename:
+
+    :param bool binary:
+        If True returns the file as is, ignore any EOL conversion.
+
+    :param unicode encoding:
+        File's encoding. If not None, contents obtained from file will be decoded using this
+        `encoding`.
+
+    :param None|''|'\n'|'\r'|'\r\n' newline:
+        Controls universal newlines.
+        See 'io.open' newline parameter documentation for more details.
+
+    :returns str|unicode:
+        The file's contents.
+        Returns unicode string when `encoding` is not None.
+
+    .. seealso:: FTP LIMITATIONS at this module's doc for performance issues information
+    '''
+    source_file = OpenFile(filename, binary=binary, encoding=encoding, newline=newline)
+    try:
+        contents = source_file.read()
+    finally:
+        source_file.close()
+
+    return contents
+
+
+#===================================================================================================
+# GetFileLines
+#===================================================================================================
+def GetFileLines(filename, newline=None, encoding=None):
+    '''
+    Reads a file and returns its contents as a list of lines. Works for both local and remote files.
+
+    :param unicode filename:
+
+    :param None|''|'\n'|'\r'|'\r\n' newline:
+        Controls universal newlines.
+        See 'io.open' newline parameter documentation for more details.
+
+    :param unicode encoding:
+        File's encoding. If not None, contents obtained from file will be decoded using this
+        `encoding`.
+
+    :returns list(unicode):
+        The file's lines
+
+    .. seealso:: FTP LIMITATIONS at this module's doc for performance issues information
+    '''
+    return GetFileContents(
+        filename,
+        binary=False,
+        encoding=encoding,
+        newline=newline,
+    ).split('\n')
+
+
+def OpenFile(filename, binary=False, newline=None, encoding=None, hash_algorithm=None):
+    '''
+    Open a file and returns it.
+    Consider the possibility of a remote file (HTTP, HTTPS, FTP)
+
+    :param unicode filename:
+        Local or remote filename.
+
+    :param bool binary:
+        If True returns the file as is, ignore any EOL conversion.
+        If set ignores univeral_newlines parameter.
+
+    :param None|''|'\n'|'\r'|'\r\n' newline:
+        Controls universal newlines.
+        See 'io.open' newline parameter documentation for more details.
+
+    :param unicode encoding:
+        File's encoding. If not None, contents obtained from file will be decoded using this
+        `encoding`.
+
+    :param unicode hash_algorithm:
+        If given, the contents are hashed with this algorithm (@see HashHex) as they are read: the
+        binary file is wrapped in a HashingReader. In text mode the HashingReader is the `buffer`
+        of the returned file, and since decoding reads ahead its digest is complete only after
+        reading to the end of the file.
+
+    :returns file:
+        The open file, it must be closed by the caller
+
+    @raise: FileNotFoundError
+        When the given filename cannot be found
+
+    .. seealso:: FTP LIMITATIONS at this module's doc for performance issues information
+    '''
+    from six.moves.urllib.parse import urlparse
+    filename_url = urlparse(filename)
+
+    # Check if file is local
+    if _UrlIsLocal(filename_url):
+        if not os.path.isfile(filename):
+            from ._exceptions import FileNotFoundError
+            raise FileNotFoundError(filename)
+
+        if hash_algorithm is not None:
+            stream = HashingReader(io.open(filename, 'rb'), hash_algorithm)
+            if binary:
+                return stream
+            return io.TextIOWrapper(stream, encoding=encoding, newline=newline)
+
+        mode = 'rb' if binary else 'r'
+        return io.open(filename, mode, encoding=encoding, newline=newline)
+
+    # Not local
+    from ._exceptions import NotImplementedProtocol
+    raise NotImplementedProtocol(filename_url.scheme)
+
+
+
+#===================================================================================================
+# ListFiles
+#===================================================================================================
+def ListFiles(directory):
+    '''
+    Lists the files in the given directory
+
+    :type directory: unicode | unicode
+    :param directory:
+        A directory or URL
+
+    :rtype: list(unicode) | list(unicode)
+    :returns:
+        List of filenames/directories found in the given directory.
+        Returns None if the given directory does not exists.
+
+        If `directory` is a unicode string, all files returned will also be unicode
+
+    :raises NotImplementedProtocol:
+        If file protocol is not local or FTP
+
+    .. seealso:: FTP LIMITATIONS at this module's doc for performance issues information
+    '''
+    from six.moves.urllib.parse import urlparse
+    directory_url = urlparse(directory)
+
+    # Handle local
+    if _UrlIsLocal(directory_url):
+        if not os.path.isdir(directory):
+            return None
+        return os.listdir(directory)
+
+    # Handle FTP
+    elif directory_url.scheme == 'ftp':
+        from ._exceptions import NotImplementedProtocol
+        raise NotImplementedProtocol(directory_url.scheme)
+    else:
+        from ._exceptions import NotImplementedProtocol
+        raise NotImplementedProtocol(directory_url.scheme)
+
+
+
+#===================================================================================================
+# CheckIsFile
+#===================================================================================================
+def CheckIsFile(filename):
+    '''
+    Check if the given file exists.
+
+    @filename: unicode
+        The filename to check for existence.
+
+    @raise: FileNotFoundError
+        Raises if the file does not exist.
+    '''
     if not IsFile(filename):
         from ._exceptions import FileNotFoundError
-        raise FileNotFoundError(filename)
+        raise FileNotFoundError(filename)
+
+
+
+#===================================================================================================
+# CheckIsDir
+#===================================================================================================
+def CheckIsDir(directory):
+    '''
+    Check if the given directory exists.
+
+    @filename: unicode
+        Path to a directory being checked for existence.
+
+    @raise: DirectoryNotFoundError
+        Raises if the directory does not exist.
+    '''
+    if not IsDir(directory):
+        from ._exceptions import DirectoryNotFoundError
+        raise DirectoryNotFoundError(directory)
+
+
+
+#===================================================================================================
+# CreateFile
+#===================================================================================================
+def CreateFile(filename, contents, eol_style=EOL_STYLE_NATIVE, create_dir=True, encoding=None, binary=False):
+    '''
+    Create a file with the given contents.
+
+    :param unicode filename:
+        Filename and path to be created.
+
+    :param unicode contents:
+        The file contents as a string.
+
+    :type eol_style: EOL_STYLE_XXX constant
+    :param eol_style:
+        Replaces the EOL by the appropriate EOL depending on the eol_style value.
+        Considers that all content is using only "\n" as EOL.
+
+    :param bool create_dir:
+        If True, also creates directories needed in filename's path
+
+    :param unicode encoding:
+        Target file's content encoding. Defaults to sys.getfilesystemencoding()
+        Ignored if `binary` = True
+
+    :param bool binary:
+        If True, file is created in binary mode. In this case, `contents` must be `bytes` and not
+        `unicode`
+
+    :return unicode:
+        Returns the name of the file created.
+
+    :raises NotImplementedProtocol:
+        If file protocol is not local or FTP
+
+    :raises ValueError:
+        If trying to mix unicode `contents` without `encoding`, or `encoding` without
+        unicode `contents`
+
+    .. seealso:: FTP LIMITATIONS at this module's doc for performance issues information
+    '''
+    # Lots of checks when writing binary files
+    if binary:
+        if isinstance(contents, six.text_type):
+            raise TypeError('contents must be str (bytes) when binary=True')
+    else:
+        if not isinstance(contents, six.text_type):
+            raise TypeError('contents must be unicode when binary=False')
+
+        # Replaces eol on each line by the given eol_style.
+        contents = _HandleContentsEol(contents, eol_style)
+
+        # Encode string and pretend we are using binary to prevent 'open' from automatically
+        # changing Eols
+        encoding = encoding or sys.getfilesystemencoding()
+        contents = contents.encode(encoding)
+        binary = True
+
+    # If asked, creates directory containing file
+    if create_dir:
+        dirname = os.path.dirname(filename)
+        if dirname:
+            CreateDirectory(dirname)
+
+    from six.moves.urllib.parse import urlparse
+    filename_url = urlparse(filename)
+
+    # Handle local
+    if _UrlIsLocal(filename_url):
+        # Always writing as binary (see handling above)
+        with open(filename, 'wb') as oss:
+            oss.write(contents)
+
+    # Handle FTP
+    elif filename_url.scheme == 'ftp':
+        # Always writing as binary (see handling above)
+        from ._exceptions import NotImplementedProtocol
+        raise NotImplementedProtocol(directory_url.scheme)
+    else:
+        from ._exceptions import NotImplementedProtocol
+        raise NotImplementedProtocol(filename_url.scheme)
+
+    return filename
+
+
+
+def ReplaceInFile(filename, old, new, encoding=None):
+    '''
+    Replaces all occurrences of "old" by "new" in the given file.
+
+    :param unicode filename:
+        The name of the file.
+
+    :param unicode old:
+        The string to search for.
+
+    :param unicode new:
+        Replacement string.
+
+    :return unicode:
+        The new contents of the file.
+    '''
+    contents = GetFileContents(filename, encoding=encoding)
+    contents = contents.replace(old, new)
+    CreateFile(filename, contents, encoding=encoding)
+    return contents
+
+
+
+#===================================================================================================
+# CreateDirectory
+#===================================================================================================
+def CreateDirectory(directory):
+    '''
+    Create directory including any missing intermediate directory.
+
+    :param unicode directory:
+
+    :return unicode|urlparse.ParseResult:
+        Returns the created directory or url (see urlparse).
+
+    :raises NotImplementedProtocol:
+        If protocol is not local or FTP.
+
+    .. seealso:: FTP LIMITATIONS at this module's doc for performance issues information
+    '''
+    from six.moves.urllib.parse import urlparse
+    directory_url = urlparse(directory)
+
+    # Handle local
+    if _UrlIsLocal(directory_url):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        return directory
+
+    # Handle FTP
+    elif directory_url.scheme == 'ftp':
+        from ._exceptions import NotImplementedProtocol
+        raise NotImplementedProtocol(directory_url.scheme)
+    else:
+        from ._exceptions import NotImplementedProtocol
+        raise NotImplementedProtocol(directory_url.scheme)
+
+
+
+#===================================================================================================
+# CreateTemporaryDirectory
+#===================================================================================================
+class CreateTemporaryDirectory(object):
+    '''
+    Context manager to create a temporary file and remove if at the context end.
+
+    :ivar unicode dirname:
+        Name of the created directory
+    '''
+    def __init__(self, suffix='', prefix='tmp', base_dir=None, maximum_attempts=100):
+        '''
+        :param unicode suffix:
+            A suffix to add in the name of the created directory
+
+        :param unicode prefix:
+            A prefix to add in the name of the created directory
+
+        :param unicode base_dir:
+            A path to use as base in the created directory (if any). The temp directory will be a
+            child of the given base dir
+
+        :param int maximum_attemps:
+            The maximum number of attempts to obtain the temp dir name.
+
+        '''
+        self.suffix = suffix
+        self.prefix = prefix
+        self.base_dir = base_dir
+        self.maximum_attempts = maximum_attempts
+
+        self.dirname = None
+
+
+    def __enter__(self):
+        '''
+        :return unicode:
+            The path to the created temp file.
+        '''
+        if self.base_dir is None:
+            # If no base directoy was given, let us create a dir in system temp area
+            import tempfile
+            self.dirname = tempfile.mkdtemp(self.suffix, self.prefix)
+            return self.dirname
+
+
+        # Listing the files found in the base dir
+        existing_files = set(ListFiles(self.base_dir))
+
+        # If a base dir was given, let us generate a unique directory name there and use it
+        for random_component in IterHashes(iterator_size=self.maximum_attempts):
+            candidate_name = '%stemp_dir_%s%s' % (self.prefix, random_component, self.suffix)
+            candidate_path = os.path.join(self.base_dir, candidate_name)
+            if candidate_path not in existing_files:
+                CreateDirectory(candidate_path)
+                self.dirname = candidate_path
+                return self.dirname
+
+        raise RuntimeError(
+            'It was not possible to obtain a temporary dirname from %s' % self.base_dir)
+
+
+    def __exit__(self, *args):
+        if self.dirname is not None:
+            DeleteDirectory(self.dirname, skip_on_error=True)
+
+
+
+#===================================================================================================
+# CreateTemporaryFile
+#===================================================================================================
+class CreateTemporaryFile(object):
+    '''
+    Context manager to create a temporary file and remove if at the context end.
+
+    :ivar unicode filename:
+        Name of the created file
+    '''
+    def __init__(
+        self,
+        contents,
+        eol_style=EOL_STYLE_NATIVE,
+        encoding=None,
+        suffix='',
+        prefix='tmp',
+        base_dir=None,
+        maximum_attempts=100):
+        '''
+        :param contents: .. seealso:: CreateFile
+        :param eol_style: .. seealso:: CreateFile
+        :param encoding: .. seealso:: CreateFile
+
+        :param unicode suffix:
+            A suffix to add in the name of the created file
+
+        :param unicode prefix:
+            A prefix to add in the name of the created file
+
+        :param unicode base_dir:
+            A path to use as base in the created file. Uses temp dir if not given.
+
+        :param int maximum_attemps:
+            The maximum number of attempts to obtain the temp file name.
+        '''
+
+        import tempfile
+
+        self.contents = contents
+        self.eol_style = eol_style
+        self.encoding = encoding
+        self.suffix = suffix
+        self.prefix = prefix
+        self.base_dir = base_dir or tempfile.gettempdir()
+        self.maximum_attempts = maximum_attempts
+
+        self.filename = None
+
+
+    def __enter__(self):
+        '''
+        :return unicode:
+            The path to the created temp file.
+        '''
+        from ._exceptions import FileAlreadyExistsError
+
+        for random_component in IterHashes(iterator_size=self.maximum_attempts):
+            filename = os.path.join(self.base_dir, self.prefix + random_component + self.suffix)
+
+            try:
+                CreateFile(
+                    filename=filename,
+                    contents=self.contents,
+                    eol_style=self.eol_style,
+                    encoding=self.encoding,
+                )
+                self.filename = filename
+                return filename
+
+            except FileAlreadyExistsError:
+                pass
+
+        raise RuntimeError('It was not possible to obtain a temporary filename in "%s"' % self.base_dir)
+
+
+    def __exit__(self, *args):
+        if self.filename is not None:
+            DeleteFile(self.filename)
+
+
+
+#===================================================================================================
+# DeleteDirectory
+#===================================================================================================
+def DeleteDirectory(directory, skip_on_error=False, progress=None):
+    '''
+    Deletes a directory.
+
+    :param unicode directory:
+
+    :param bool skip_on_error:
+        If True, ignore any errors when trying to delete directory (for example, directory not
+        found)
+
+    :param callable|ProgressReporter progress:
+        .. seealso:: ProgressReporter
+
+        Reports the files (and their bytes) removed.
+
+    :raises NotImplementedForRemotePathError:
+        If trying to delete a remote directory.
+    '''
+    _AssertIsLocal(directory)
+
+    import shutil
+    def OnError(fn, path, excinfo):
+        '''
+        Remove the read-only flag and try to remove again.
+        On Windows, rmtree fails when trying to remove a read-only file. This fix it!
+        Another case: Read-only directories return True in os.access test. It seems that read-only
+        directories has it own flag (looking at the property windows on Explorer).
+        '''
+        if IsLink(path):
+            return
+
+        if fn is os.remove and os.access(path, os.W_OK):
+            raise
+
+        # Make the file WRITEABLE and executes the original delete function (osfunc)
+        import stat
+        os.chmod(path, stat.S_IWRITE)
+        fn(path)
+
+    try:
+        if not os.path.isdir(directory):
+            if skip_on_error:
+                return
+            from ._exceptions import DirectoryNotFoundError
+            raise DirectoryNotFoundError(directory)
+
+        reporter = _GetProgressReporter(progress)
+        if reporter is None:
+            shutil.rmtree(directory, onerror=OnError)
+        else:
+            _DeleteTreeWithProgress(directory, reporter, OnError)
+    except:
+        if not skip_on_error:
+            raise  # Raise only if we are not skipping on error
+
+
+def _DeleteTreeWithProgress(directory, reporter, on_error):
+    '''
+    Same as shutil.rmtree, but removes one entry at a time, reporting each file removed.
+
+    :param unicode directory:
+
+    :param ProgressReporter reporter:
+
+    :param callable on_error:
+        .. seealso:: shutil.rmtree onerror
+    '''
+    def Remove(function, path):
+        try:
+            function(path)
+        except OSError:
+            on_error(function, path, sys.exc_info())
+
+    # Like rmtree, never delete the contents of a link target
+    if os.path.islink(directory):
+        try:
+            raise OSError('Cannot call rmtree on a symbolic link')
+        except OSError:
+            on_error(os.path.islink, directory, sys.exc_info())
+        return
+
+    entries = []
+    for i_dirpath, i_dirnames, i_filenames in os.walk(directory, topdown=False):
+        for i_filename in i_filenames:
+            path = os.path.join(i_dirpath, i_filename)
+            entries.append((path, os.lstat(path).st_size))
+        for i_dirname in i_dirnames:
+            path = os.path.join(i_dirpath, i_dirname)
+            if os.path.islink(path):
+                # Links to directories are listed as directories, but are removed as files
+                entries.append((path, 0))
+            else:
+                entries.append((path, None))
+
+    reporter.Start(
+        files_total=sum(1 for _, i_size in entries if i_size is not None),
+        bytes_total=sum(i_size for _, i_size in entries if i_size is not None),
+    )
+    for i_path, i_size in entries:
+        if i_size is None:
+            Remove(os.rmdir, i_path)
+        else:
+            Remove(os.remove, i_path)
+            reporter.Update(files=1, bytes_=i_size)
+    Remove(os.rmdir, directory)
+    reporter.Finish()
+
+
+
+#===================================================================================================
+# GetMTime
+#===================================================================================================
+def GetMTime(path):
+    '''
+    :param unicode path:
+        Path to file or directory
+
+    :rtype: float
+    :returns:
+        Modification time for path.
+
+        If this is a directory, the highest mtime from files inside it will be returned.
+
+    @note:
+        In some Linux distros (such as CentOs, or anything with ext3), mtime will not return a value
+        with resolutions higher than a second.
+
+        http://stackoverflow.com/questions/2428556/os-path-getmtime-doesnt-return-fraction-of-a-second
+    '''
+    _AssertIsLocal(path)
+
+    if os.path.isdir(path):
+        files = FindFiles(path)
+
+        if len(files) > 0:
+            return max(map(os.path.getmtime, files))
+
+    return os.path.getmtime(path)
+
+
+
+#===================================================================================================
+# ListMappedNetworkDrives
+#===================================================================================================
+def ListMappedNetworkDrives():
+    '''
+    On Windows, returns a list of mapped network drives
+
+    :return: tuple(string, string, bool)
+        For each mapped netword drive, return 3 values tuple:
+            - the local drive
+            - the remote path-
+            - True if the mapping is enabled (warning: not reliable)
+    '''
+    if sys.platform != 'win32':
+        raise NotImplementedError
+    drives_list = []
+    netuse = _CallWindowsNetCommand(['use'])
+    for line in netuse.split(EOL_STYLE_WINDOWS):
+        match = re.match("(\w*)\s+(\w:)\s+(.+)", line.rstrip())
+        if match:
+            drives_list.append((match.group(2), match.group(3), match.group(1) == 'OK'))
+    return drives_list
+
+
+
+#===================================================================================================
+# DeleteLink
+#===================================================================================================
+def DeleteLink(path):
+    if sys.platform != 'win32':
+        os.unlink(path)
+    else:
+        from ._easyfs_win32 import RemoveDirectory as _RemoveDirectory, DeleteFile as _DeleteFile
+        if IsDir(path):
+            _RemoveDirectory(path)
+        else:
+            _DeleteFile(path)
+
+
+
+#===================================================================================================
+# CreateLink
+#===================================================================================================
+def CreateLink(target_path, link_path, override=True):
+    '''
+    Create a symbolic link at `link_path` pointing to `target_path`.
+
+    :param unicode target_path:
+        Link target
+
+    :param unicode link_path:
+        Fullpath to link name
+
+    :param bool override:
+        If True and `link_path` already exists as a link, that link is overridden.
+    '''
+    _AssertIsLocal(target_path)
+    _AssertIsLocal(link_path)
+
+    if override and IsLink(link_path):
+        DeleteLink(link_path)
+
+    # Create directories leading up to link
+    dirname = os.path.dirname(link_path)
+    if dirname:
+        CreateDirectory(dirname)
+
+    if sys.platform != 'win32':
+        return os.symlink(target_path, link_path)  # @UndefinedVariable
+    else:
+        #import ntfsutils.junction
+        #return ntfsutils.junction.create(target_path, link_path)
+
+        import jaraco.windows.filesystem
+        return jaraco.windows.filesystem.symlink(target_path, link_path)
+
+        from ._easyfs_win32 import CreateSymbolicLink
+        try:
+            dw_flags = 0
+            if target_path and os.path.isdir(target_path):
+                dw_flags = 1
+            return CreateSymbolicLink(target_path, link_path, dw_flags)
+        except Exception as e:
+            reraise(e, 'Creating link "%(link_path)s" pointing to "%(target_path)s"' % locals())
+
+
+
+#===================================================================================================
+# IsLink
+#===================================================================================================
+def IsLink(path):
+    '''
+    :param unicode path:
+        Path being tested
+
+    :returns bool:
+        True if `path` is a link
+    '''
+    _AssertIsLocal(path)
+
+    if sys.platform != 'win32':
+        return os.path.islink(path)
+
+    import jaraco.windows.filesystem
+    return jaraco.windows.filesystem.islink(path)
+
+
+
+#===================================================================================================
+# ReadLink
+#===================================================================================================
+def ReadLink(path):
+    '''
+    Read the target of the symbolic link at `path`.
+
+    :param unicode path:
+        Path to a symbolic link
+
+    :returns unicode:
+        Target of a symbolic link
+    '''
+    _AssertIsLocal(path)
+
+    if sys.platform != 'win32':
+        return os.readlink(path)  # @UndefinedVariable
+
+    if not IsLink(path):
+        from ._exceptions import FileNotFoundError
+        raise FileNotFoundError(path)
+
+    import jaraco.windows.filesystem
+    result = jaraco.windows.filesystem.readlink(path)
+    if '\\??\\' in result:
+        result = result.split('\\??\\')[1]
+    return result
+
+
+#===================================================================================================
+# Internal functions
+#===================================================================================================
+def _UrlIsLocal(directory_url):
+    '''
+    :param ParseResult directory_url:
+        A parsed url as returned by urlparse.urlparse.
+
+    :rtype: bool
+    :returns:
+        Returns whether the given url refers to a local path.
+
+    .. note:: The "directory_url.scheme" is the drive letter for a local path on Windows and an empty string
+    for a local path on Linux. The other possible values are "http", "ftp", etc. So, checking if
+    the length is less than 2 characters long checks that the url is local.
+    '''
+    return len(directory_url.scheme) < 2
+
+
+def _AssertIsLocal(path):
+    '''
+    Checks if a given path is local, raise an exception if not.
+
+    This is used in filesystem functions that do not support remote operations yet.
+
+    :param unicode path:
+
+    :raises NotImplementedForRemotePathError:
+        If the given path is not local
+    '''
+    from six.moves.urllib.parse import urlparse
+    if not _UrlIsLocal(urlparse(path)):
+        from ._exceptions import NotImplementedForRemotePathError
+        raise NotImplementedForRemotePathError
+
+
+def _HandleContentsEol(contents, eol_style):
+    '''
+    Replaces eol on each line by the given eol_style.
+
+    :param unicode contents:
+    :type eol_style: EOL_STYLE_XXX constant
+    :param eol_style:
+    '''
+    if eol_style == EOL_STYLE_NONE:
+        return contents
+
+    if eol_style == EOL_STYLE_UNIX:
+        return contents.replace('\r\n', eol_style).replace('\r', eol_style)
+
+    if eol_style == EOL_STYLE_MAC:
+        return contents.replace('\r\n', eol_style).replace('\n', eol_style)
+
+    if eol_style == EOL_STYLE_WINDOWS:
+        return contents.replace('\r\n', '\n').replace('\r', '\n').replace('\n', EOL_STYLE_WINDOWS)
+
+    raise ValueError('Unexpected eol style: %r' % (eol_style,))
+
+
+def _CallWindowsNetCommand(parameters):
+    '''
+    Call Windows NET command, used to acquire/configure network services settings.
+
+    :param parameters: list of command line parameters
+
+    :return: command output
+    '''
+    import subprocess
+    popen = subprocess.Popen(["net"] + parameters, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    stdoutdata, stderrdata = popen.communicate()
+    if stderrdata:
+        raise OSError("Failed on call net.exe: %s" % stderrdata)
+    return stdoutdata
+
+
+
+#===================================================================================================
+# ExtendedPathMask
+#===================================================================================================
+class ExtendedPathMask(object):
+    '''
+    This class is a place-holder for functions that handle the extended path mask.
+
+    Extended Path Mask
+    ------------------
+
+    The extended path mask is a file search path description used to find files based on the filename.
+    This extended path mask includes the following features:
+        - Recursive search (prefix with a "+" sign)
+        - The possibility of adding more than one filter to match files (separated by ";")
+        - The possibility of negate an mask (prefix the mask with "!").
+
+    The extended path mask has the following syntax:
+
+        [+|-]<path>/<filter>(;<filter>)*
+
+    Where:
+        + : recursive and copy-tree flag
+        - : recursive and copy-flat flag (copy files to the target directory with no tree structure)
+        <path> : a usual path, using '/' as separator
+        <filter> : A filename filter, as used in dir command:
+            Ex:
+                *.zip;*.rar
+                units.txt;*.ini
+                *.txt;!*-002.txt
+    '''
+
+
+    @classmethod
+    def Split(cls, extended_path_mask):
+        '''
+        Splits the given path into their components: recursive, dirname, in_filters and out_filters
+
+        :param str: extended_path_mask:
+            The "extended path mask" to split
+
+        :rtype: tuple(bool,bool,str,list(str),list(str))
+        :returns:
+            Returns the extended path 5 components:
+            - The tree-recurse flag
+            - The flat-recurse flag
+            - The actual path
+            - A list of masks to include
+            - A list of masks to exclude
+        '''
+        import os.path
+        r_tree_recurse = extended_path_mask[0] in '+-'
+        r_flat_recurse = extended_path_mask[0] in '-'
+
+        r_dirname, r_filters = os.path.split(extended_path_mask)
+        if r_tree_recurse:
+            r_dirname = r_dirname[1:]
+
+        filters = r_filters.split(';')
+        r_in_filters = [i for i in filters if not i.startswith('!')]
+        r_out_filters = [i[1:] for i in filters if i.startswith('!')]
+
+        return r_tree_recurse, r_flat_recurse, r_dirname, r_in_filters, r_out_filters
+
+
+
+#===================================================================================================
+# CheckForUpdate
+#===================================================================================================
+def CheckForUpdate(source, target):
+    '''
+    Checks if the given target filename should be re-generated because the source has changed.
+    :param source: the source filename.
+    :param target: the target filename.
+    :return bool:
+        True if the target is out-dated, False otherwise.
+    '''
+    return \
+        not os.path.isfile(target) or \
+        os.path.getmtime(source) > os.path.getmtime(target)
+
+
+
+#===================================================================================================
+# MatchMasks
+#===================================================================================================
+def MatchMasks(filename, masks):
+    '''
+    Verifies if a filename match with given patterns.
+
+    :param str filename: The filename to match.
+    :param list(str) masks: The patterns to search in the filename.
+    :return bool:
+        True if the filename has matched with one pattern, False otherwise.
+    '''
+    import fnmatch
+
+    if not isinstance(masks, (list, tuple)):
+        masks = [masks]
+
+    for i_mask in masks:
+        if fnmatch.fnmatch(filename, i_mask):
+            return True
+    return False
+
+
+
+#===================================================================================================
+# FindFiles
+#===================================================================================================
+def FindFiles(dir_, in_filters=None, out_filters=None, recursive=True, include_root_dir=True, standard_paths=False):
+    '''
+    Searches for files in a given directory that match with the given patterns.
+
+    :param str dir_: the directory root, to search the files.
+    :param list(str) in_filters: a list with patterns to match (default = all). E.g.: ['*.py']
+    :param list(str) out_filters: a list with patterns to ignore (default = none). E.g.: ['*.py']
+    :param bool recursive: if True search in subdirectories, otherwise, just in the root.
+    :param bool include_root_dir: if True, includes the directory being searched in the returned paths
+    :param bool standard_paths: if True, always uses unix path separators "/"
+    :return list(str):
+        A list of strings with the files that matched (with the full path in the filesystem).
+
+    .. seealso:: IterFindFiles to process the files as they are found.
+    '''
+    return list(IterFindFiles(dir_, in_filters, out_filters, recursive, include_root_dir, standard_paths))
+
+
+def IterFindFiles(dir_, in_filters=None, out_filters=None, recursive=True, include_root_dir=True, standard_paths=False):
+    '''
+    Same as FindFiles, but yields the files as they are found, without keeping them in memory.
+
+    .. seealso:: FindFiles for parameters.
+
+    :return iterator(str):
+    '''
+    # all files
+    if in_filters is None:
+        in_filters = ['*']
+
+    if out_filters is None:
+        out_filters = []
+
+    dir_prefix = len(dir_) + 1
+
+    # maintain just files that don't have a pattern that match with out_filters
+    # walk through all directories based on dir
+    for dir_root, directories, filenames in os.walk(dir_):
+
+        for i_directory in directories[:]:
+            if MatchMasks(i_directory, out_filters):
+                directories.remove(i_directory)
+
+        for filename in directories + filenames:
+            if MatchMasks(filename, in_filters) and not MatchMasks(filename, out_filters):
+                result = os.path.join(dir_root, filename)
+                if not include_root_dir:
+                    # Remove root dir from the path
+                    result = result[dir_prefix:]
+                if standard_paths:
+                    result = StandardizePath(result)
+                yield result
+
+        if not recursive:
+            break
+
+
+
+#===================================================================================================
+# ExpandUser
+#===================================================================================================
+def ExpandUser(path):
+    '''
+    os.path.expanduser wrapper, necessary because it cannot handle unicode strings properly.
+
+    This is not necessary in Python 3.
+
+    :param path:
+        .. seealso:: os.path.expanduser
+    '''
+    if six.PY2:
+        encoding = sys.getfilesystemencoding()
+        path = path.encode(encoding)
+    result = os.path.expanduser(path)
+    if six.PY2:
+        result = result.decode(encoding)
+    return result
+
+
+
+#===================================================================================================
+# DumpDirHashToStringIO
+#===================================================================================================
+def DumpDirHashToStringIO(directory, stringio, base='', exclude=None, include=None, cache=None):
+    '''
+    Helper to iterate over the files in a directory putting those in the passed StringIO in ini
+    format.
+
+    :param unicode directory:
+        The directory for which the hash should be done.
+
+    :param StringIO stringio:
+        The string to which the dump should be put.
+
+    :param unicode base:
+        If provided should be added (along with a '/') before the name=hash of file.
+
+    :param unicode exclude:
+        Pattern to match files to exclude from the hashing. E.g.: *.gz
+
+    :param unicode include:
+        Pattern to match files to include in the hashing. E.g.: *.zip
+
+    :param DigestCache cache:
+        .. seealso:: Md5Hex
+    '''
+    import fnmatch
+    import os
+
+    files = [(os.path.join(directory, i), i) for i in os.listdir(directory)]
+    files = [i for i in files if os.path.isfile(i[0])]
+    for fullname, filename in files:
+        if include is not None:
+            if not fnmatch.fnmatch(fullname, include):
+                continue
+
+        if exclude is not None:
+            if fnmatch.fnmatch(fullname, exclude):
+                continue
+
+        md5 = Md5Hex(fullname, cache=cache)
+        if base:
+            stringio.write('%s/%s=%s\n' % (base, filename, md5))
+        else:
+            stringio.write('%s=%s\n' % (filename, md5))
+
+
+
+# Non-cryptographic algorithms (much faster) provided by the optional xxhash module
+_XXHASH_ALGORITHMS = {
+    'xxh3': 'xxh3_64',
+    'xxh3_64': 'xxh3_64',
+    'xxh3_128': 'xxh3_128',
+    'xxh64': 'xxh64',
+    'xxh32': 'xxh32',
+}
+
+
+def _NewHasher(algorithm):
+    '''
+    :param unicode algorithm:
+        Name of a hash algorithm, as accepted by hashlib.new (e.g.: 'md5', 'sha256', 'blake2b'), or
+        one of the xxHash algorithms ('xxh3', 'xxh3_128', 'xxh64', 'xxh32') if the xxhash module is
+        installed.
+
+    :rtype: hashlib.hash
+    :returns:
+        A new hash object.
+
+    :raises ValueError:
+        If the algorithm is not available.
+    '''
+    if algorithm in _XXHASH_ALGORITHMS:
+        try:
+            import xxhash
+        except ImportError:
+            raise ValueError('Hash algorithm %r requires the xxhash module.' % (algorithm,))
+        return getattr(xxhash, _XXHASH_ALGORITHMS[algorithm])()
+
+    import hashlib
+    return hashlib.new(algorithm)
+
+
+
+#===================================================================================================
+# Manifest
+#===================================================================================================
+class Manifest(object):
+    '''
+    A "name=hash" manifest (as written by DumpDirHashToStringIO), indexed for lookups and diffs.
+
+    Entries are kept as two parallel lists sorted by name, so lookups are binary searches and diffs
+    are a single merge pass.
+
+    :ivar list(unicode) names:
+        Entry names, sorted.
+
+    :ivar list(unicode) digests:
+        Hex digest of each entry, in the order of `names`.
+
+    :ivar float|None timestamp:
+        When the manifest was written (the manifest file modification time), if known.
+    '''
+
+    def __init__(self, entries=(), timestamp=None):
+        '''
+        :param iterable(tuple(unicode,unicode)) entries:
+            Pairs of (name, digest). Later entries replace earlier ones with the same name.
+
+        :param float|None timestamp:
+        '''
+        index = dict(entries)
+        self.names = sorted(index)
+        self.digests = [index[i] for i in self.names]
+        self.timestamp = timestamp
+
+
+    @classmethod
+    def Parse(cls, contents, timestamp=None):
+        '''
+        :param unicode contents:
+            Manifest lines, "name=hash". Blank lines are ignored.
+
+        :param float|None timestamp:
+
+        :rtype: Manifest
+
+        :raises ValueError:
+            If a line has no "=".
+        '''
+        entries = []
+        for i_line in contents.splitlines():
+            i_line = i_line.strip()
+            if not i_line:
+                continue
+            name, separator, digest = i_line.rpartition('=')
+            if not separator:
+                raise ValueError('Invalid manifest line: %r' % (i_line,))
+            entries.append((name, digest.lower()))
+        return cls(entries, timestamp)
+
+
+    @classmethod
+    def Load(cls, filename):
+        '''
+        :param unicode filename:
+            A manifest file. Its modification time is used as the manifest timestamp.
+
+        :rtype: Manifest
+        '''
+        return cls.Parse(GetFileContents(filename), timestamp=os.path.getmtime(filename))
+
+
+    def __len__(self):
+        return len(self.names)
+
+
+    def __iter__(self):
+        return iter(zip(self.names, self.digests))
+
+
+    def __contains__(self, name):
+        return self.Get(name) is not None
+
+
+    def Get(self, name):
+        '''
+        :param unicode name:
+
+        :rtype: unicode|None
+        :returns:
+            The digest of the entry, or None if not in the manifest.
+        '''
+        import bisect
+        index = bisect.bisect_left(self.names, name)
+        if index < len(self.names) and self.names[index] == name:
+            return self.digests[index]
+        return None
+
+
+class ManifestDiff(object):
+    '''
+    Differences between two manifests (or a manifest and a directory).
+
+    :ivar list(unicode) added:
+        Names only in the new side.
+
+    :ivar list(unicode) removed:
+        Names only in the old side.
+
+    :ivar list(unicode) changed:
+        Names in both, with different digests.
+    '''
+
+    def __init__(self, added, removed, changed):
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+
+
+    def __bool__(self):
+        '''
+        :returns: True if there are differences.
+        '''
+        return bool(self.added or self.removed or self.changed)
+
+    __nonzero__ = __bool__  # Python 2
+
+
+    def __repr__(self):
+        return '<ManifestDiff added=%r removed=%r changed=%r>' % (self.added, self.removed, self.changed)
+
+
+def DiffManifests(old, new):
+    '''
+    :param Manifest old:
+
+    :param Manifest new:
+
+    :rtype: ManifestDiff
+    '''
+    added = []
+    removed = []
+    changed = []
+    old_index = new_index = 0
+    while old_index < len(old.names) and new_index < len(new.names):
+        old_name = old.names[old_index]
+        new_name = new.names[new_index]
+        if old_name == new_name:
+            if old.digests[old_index] != new.digests[new_index]:
+                changed.append(old_name)
+            old_index += 1
+            new_index += 1
+        elif old_name < new_name:
+            removed.append(old_name)
+            old_index += 1
+        else:
+            added.append(new_name)
+            new_index += 1
+    removed.extend(old.names[old_index:])
+    added.extend(new.names[new_index:])
+    return ManifestDiff(added, removed, changed)
+
+
+def DiffManifestWithDirectory(
+    manifest,
+    directory,
+    base='',
+    exclude=None,
+    include=None,
+    trust_before=None,
+    cache=None):
+    '''
+    Compares a manifest with the files in a directory (the manifest being the old side).
+
+    Files are listed and stat'ed first: entries missing on either side are found without reading
+    any file. Files in both are hashed only when their modification time is suspicious, that is,
+    not older than `trust_before`.
+
+    The directory is scanned the way the manifest was made with DumpDirHashToStringIO: its files,
+    plus the files of the sub-directories that have entries in the manifest.
+
+    :param Manifest manifest:
+
+    :param unicode directory:
+
+    :param unicode base:
+        .. seealso:: DumpDirHashToStringIO
 
+        Manifest entries outside `base` are ignored.
 
+    :param unicode exclude:
+        .. seealso:: DumpDirHashToStringIO
 
-#===================================================================================================
-# CheckIsDir
-#===================================================================================================
-def CheckIsDir(directory):
-    '''
-    Check if the given directory exists.
+    :param unicode include:
+        .. seealso:: DumpDirHashToStringIO
 
-    @filename: unicode
-        Path to a directory being checked for existence.
+    :param float|None trust_before:
+        Files modified before this time (in seconds since the epoch, e.g.: manifest.timestamp) are
+        assumed unchanged. If None, all files are hashed (or obtained from `cache`).
 
-    @raise: DirectoryNotFoundError
-        Raises if the directory does not exist.
+    :param DigestCache cache:
+        .. seealso:: Md5Hex
+
+    :rtype: ManifestDiff
     '''
-    if not IsDir(directory):
-        from ._exceptions import DirectoryNotFoundError
-        raise DirectoryNotFoundError(directory)
+    import fnmatch
+
+    prefix = base + '/' if base else ''
+
+    # Directories to scan, relative to `directory`
+    directories = set([''])
+    for i_name in manifest.names:
+        if not i_name.startswith(prefix):
+            continue
+        parts = i_name[len(prefix):].split('/')[:-1]
+        for i in range(1, len(parts) + 1):
+            directories.add('/'.join(parts[:i]))
+
+    entries = []
+    for i_directory in sorted(directories):
+        path = os.path.join(directory, i_directory) if i_directory else directory
+        if not os.path.isdir(path):
+            continue
+        for i_filename in os.listdir(path):
+            filename = os.path.join(path, i_filename)
+            if not os.path.isfile(filename):
+                continue
+            if include is not None and not fnmatch.fnmatch(filename, include):
+                continue
+            if exclude is not None and fnmatch.fnmatch(filename, exclude):
+                continue
+            name = prefix + (i_directory + '/' if i_directory else '') + i_filename
+            entries.append((name, filename))
+    entries.sort()
+
+    added = []
+    changed = []
+    seen = set()
+    for i_name, i_filename in entries:
+        seen.add(i_name)
+        digest = manifest.Get(i_name)
+        if digest is None:
+            added.append(i_name)
+            continue
+        if trust_before is not None and os.path.getmtime(i_filename) < trust_before:
+            continue
+        if Md5Hex(i_filename, cache=cache) != digest:
+            changed.append(i_name)
+
+    removed = [
+        i for i in manifest.names
+        if i.startswith(prefix) and i not in seen
+    ]
+    return ManifestDiff(added, removed, changed)
 
 
 
 #===================================================================================================
-# CreateFile
+# DeduplicateTree
 #===================================================================================================
-def CreateFile(filename, contents, eol_style=EOL_STYLE_NATIVE, create_dir=True, encoding=None, binary=False):
+class DeduplicationReport(object):
     '''
-    Create a file with the given contents.
-
-    :param unicode filename:
-        Filename and path to be created.
-
-    :param unicode contents:
-        The file contents as a string.
-
-    :type eol_style: EOL_STYLE_XXX constant
-    :param eol_style:
-        Replaces the EOL by the appropriate EOL depending on the eol_style value.
-        Considers that all content is using only "\n" as EOL.
-
-    :param bool create_dir:
-        If True, also creates directories needed in filename's path
+    The result of DeduplicateTree.
 
-    :param unicode encoding:
-        Target file's content encoding. Defaults to sys.getfilesystemencoding()
-        Ignored if `binary` = True
+    :ivar list(list(unicode)) groups:
+        Groups of files with identical contents. The first file of each group is the one kept, the
+        others are (or would be, in a dry run) replaced by links to it.
 
-    :param bool binary:
-        If True, file is created in binary mode. In this case, `contents` must be `bytes` and not
-        `unicode`
+    :ivar int files_linked:
+        Number of files replaced by links (counting every name of a replaced file).
 
-    :return unicode:
-        Returns the name of the file created.
+    :ivar int bytes_reclaimed:
+        Bytes no longer taking space (the sizes of the files replaced). Files with hard links outside
+        of the tree still take their space, so they aren't counted.
+    '''
 
-    :raises NotImplementedProtocol:
-        If file protocol is not local or FTP
+    def __init__(self):
+        self.groups = []
+        self.files_linked = 0
+        self.bytes_reclaimed = 0
 
-    :raises ValueError:
-        If trying to mix unicode `contents` without `encoding`, or `encoding` without
-        unicode `contents`
 
-    .. seealso:: FTP LIMITATIONS at this module's doc for performance issues information
+def DeduplicateTree(directory, mode='hard', algorithm='md5', dry_run=False):
     '''
-    # Lots of checks when writing binary files
-    if binary:
-        if isinstance(contents, six.text_type):
-            raise TypeError('contents must be str (bytes) when binary=True')
-    else:
-        if not isinstance(contents, six.text_type):
-            raise TypeError('contents must be unicode when binary=False')
-
-        # Replaces eol on each line by the given eol_style.
-        contents = _HandleContentsEol(contents, eol_style)
-
-        # Encode string and pretend we are using binary to prevent 'open' from automatically
-        # changing Eols
-        encoding = encoding or sys.getfilesystemencoding()
-        contents = contents.encode(encoding)
-        binary = True
+    Replaces files with identical contents under a directory by links to a single copy.
 
-    # If asked, creates directory containing file
-    if create_dir:
-        dirname = os.path.dirname(filename)
-        if dirname:
-            CreateDirectory(dirname)
+    Candidates are narrowed down in stages, reading as little as possible: files are grouped by
+    size (only files in the same device), then by the hash of their first DEDUPLICATE_PARTIAL_SIZE
+    bytes, and only then by the hash of their whole contents. Files that are already hard links to
+    each other count as a single file: all of its names in the tree are replaced.
 
-    from six.moves.urllib.parse import urlparse
-    filename_url = urlparse(filename)
+    Each duplicate is replaced atomically: the link is created with a temporary name and renamed
+    over the duplicate.
 
-    # Handle local
-    if _UrlIsLocal(filename_url):
-        # Always writing as binary (see handling above)
-        with open(filename, 'wb') as oss:
-            oss.write(contents)
+    :param unicode directory:
 
-    # Handle FTP
-    elif filename_url.scheme == 'ftp':
-        # Always writing as binary (see handling above)
-        from ._exceptions import NotImplementedProtocol
-        raise NotImplementedProtocol(directory_url.scheme)
-    else:
-        from ._exceptions import NotImplementedProtocol
-        raise NotImplementedProtocol(filename_url.scheme)
+    :param 'hard'|'reflink' mode:
+        'hard': Duplicates become hard links to the kept file (sharing its metadata too, and any
+            future change).
+        'reflink': Duplicates become copy-on-write clones of the kept file (btrfs, XFS), keeping
+            their own metadata. They stay independent files.
 
-    return filename
+    :param unicode algorithm:
+        .. seealso:: HashHex
 
+    :param bool dry_run:
+        If True, only finds the duplicates: nothing is changed.
 
+    :rtype: DeduplicationReport
 
-def ReplaceInFile(filename, old, new, encoding=None):
+    :raises CloneNotSupportedError:
+        If mode is 'reflink' and the filesystem can't clone files.
     '''
-    Replaces all occurrences of "old" by "new" in the given file.
+    import collections
+    import stat
+
+    if mode not in ('hard', 'reflink'):
+        raise ValueError('Unexpected deduplication mode: %r' % (mode,))
+
+    # Group by size, ignoring links and empty files. Other names of the same inode are kept aside.
+    by_size = collections.defaultdict(list)
+    inode_names = {}
+    link_counts = {}
+    for i_filename in sorted(IterFindFiles(directory)):
+        stat_result = os.lstat(i_filename)
+        if not stat.S_ISREG(stat_result.st_mode) or stat_result.st_size == 0:
+            continue
+        inode = (stat_result.st_dev, stat_result.st_ino) if stat_result.st_ino else i_filename
+        if inode in inode_names:
+            inode_names[inode].append(i_filename)
+            continue
+        inode_names[inode] = [i_filename]
+        link_counts[i_filename] = stat_result.st_nlink
+        by_size[(stat_result.st_dev, stat_result.st_size)].append(i_filename)
+    names = dict((i[0], i) for i in inode_names.values())  # By the name representing the inode
+
+    report = DeduplicationReport()
+    for (_dev, i_size), i_filenames in sorted(by_size.items(), key=lambda x: x[1][0]):
+        if len(i_filenames) < 2:
+            continue
+
+        for i_partial_group in _GroupBy(i_filenames, lambda x: _HashFileStart(x, algorithm)):
+            if i_size <= DEDUPLICATE_PARTIAL_SIZE:
+                groups = [i_partial_group]  # The partial hash covered the whole file
+            else:
+                groups = _GroupBy(i_partial_group, lambda x: HashHex(x, algorithm=algorithm))
+
+            for i_group in groups:
+                report.groups.append(i_group)
+                original = i_group[0]
+                for i_duplicate in i_group[1:]:
+                    duplicate_names = names[i_duplicate]
+                    if not dry_run:
+                        for i_name in duplicate_names:
+                            if mode == 'hard':
+                                _HardLinkFile(original, i_name, 'hard')
+                            else:
+                                _ReflinkFile(original, i_name)
+                    report.files_linked += len(duplicate_names)
+                    if link_counts[i_duplicate] <= len(duplicate_names):
+                        report.bytes_reclaimed += i_size
+
+    return report
+
+
+def _GroupBy(filenames, get_key):
+    '''
+    :param list(unicode) filenames:
 
-    :param unicode filename:
-        The name of the file.
+    :param callable(unicode) get_key:
 
-    :param unicode old:
-        The string to search for.
+    :rtype: list(list(unicode))
+    :returns:
+        The groups with more than one file with the same key, keeping the order of filenames.
+    '''
+    import collections
+    groups = collections.OrderedDict()
+    for i_filename in filenames:
+        groups.setdefault(get_key(i_filename), []).append(i_filename)
+    return [i for i in groups.values() if len(i) > 1]
 
-    :param unicode new:
-        Replacement string.
 
-    :return unicode:
-        The new contents of the file.
+def _HashFileStart(filename, algorithm):
     '''
-    contents = GetFileContents(filename, encoding=encoding)
-    contents = contents.replace(old, new)
-    CreateFile(filename, contents, encoding=encoding)
-    return contents
+    :rtype: unicode
+    :returns:
+        The hex digest of the first DEDUPLICATE_PARTIAL_SIZE bytes of a file.
+    '''
+    hasher = _NewHasher(algorithm)
+    with io.open(filename, 'rb') as stream:
+        _HashStream(stream, [hasher], size=DEDUPLICATE_PARTIAL_SIZE)
+    return six.text_type(hasher.hexdigest())
 
 
 
 #===================================================================================================
-# CreateDirectory
+# Md5ManifestCheck
 #===================================================================================================
-def CreateDirectory(directory):
+class Md5ManifestCheck(object):
     '''
-    Create directory including any missing intermediate directory.
+    md5 checks for CopyFile using one manifest per tree (MD5_MANIFEST_FILENAME, in Manifest format,
+    with paths relative to the tree root), instead of a .md5 file per file.
 
-    :param unicode directory:
+    Both manifests are read once, when this object is created. Copies update the target manifest in
+    memory, and Save writes it. Can be shared by many threads.
 
-    :return unicode|urlparse.ParseResult:
-        Returns the created directory or url (see urlparse).
+    Usage::
 
-    :raises NotImplementedProtocol:
-        If protocol is not local or FTP.
+        check = Md5ManifestCheck(source_dir, target_dir)
+        try:
+            CopyFile(source_dir + '/a', target_dir + '/a', md5_check=check)
+        finally:
+            check.Save()
 
-    .. seealso:: FTP LIMITATIONS at this module's doc for performance issues information
+    .. seealso:: CopyFiles(md5_check='manifest'), CreateMD5Manifest
     '''
-    from six.moves.urllib.parse import urlparse
-    directory_url = urlparse(directory)
 
-    # Handle local
-    if _UrlIsLocal(directory_url):
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-        return directory
+    def __init__(self, source_dir, target_dir):
+        '''
+        :param unicode source_dir:
+            Root of the source tree.
 
-    # Handle FTP
-    elif directory_url.scheme == 'ftp':
-        from ._exceptions import NotImplementedProtocol
-        raise NotImplementedProtocol(directory_url.scheme)
-    else:
-        from ._exceptions import NotImplementedProtocol
-        raise NotImplementedProtocol(directory_url.scheme)
+        :param unicode target_dir:
+            Root of the target tree.
+        '''
+        import threading
 
+        self.source_dir = source_dir
+        self.target_dir = target_dir
+        self.target_manifest_filename = os.path.join(target_dir, MD5_MANIFEST_FILENAME)
+        self._lock = threading.Lock()
+        self._modified = False
 
+        self._source_entries = dict(self._Load(os.path.join(source_dir, MD5_MANIFEST_FILENAME)))
+        self._target_entries = dict(self._Load(self.target_manifest_filename))
 
-#===================================================================================================
-# CreateTemporaryDirectory
-#===================================================================================================
-class CreateTemporaryDirectory(object):
-    '''
-    Context manager to create a temporary file and remove if at the context end.
 
-    :ivar unicode dirname:
-        Name of the created directory
-    '''
-    def __init__(self, suffix='', prefix='tmp', base_dir=None, maximum_attempts=100):
+    def IsUpToDate(self, source_filename, target_filename):
         '''
-        :param unicode suffix:
-            A suffix to add in the name of the created directory
+        :param unicode source_filename:
 
-        :param unicode prefix:
-            A prefix to add in the name of the created directory
+        :param unicode target_filename:
 
-        :param unicode base_dir:
-            A path to use as base in the created directory (if any). The temp directory will be a
-            child of the given base dir
+        :rtype: bool
+        :returns:
+            True if the target exists and both manifests have the same md5 for the file.
+        '''
+        source_md5 = self._source_entries.get(self._GetName(source_filename, self.source_dir))
+        with self._lock:
+            target_md5 = self._target_entries.get(self._GetName(target_filename, self.target_dir))
+        return source_md5 is not None and source_md5 == target_md5 and Exists(target_filename)
 
-        :param int maximum_attemps:
-            The maximum number of attempts to obtain the temp dir name.
 
+    def Update(self, source_filename, target_filename):
         '''
-        self.suffix = suffix
-        self.prefix = prefix
-        self.base_dir = base_dir
-        self.maximum_attempts = maximum_attempts
+        Registers a copy: the target gets the md5 the source has in its manifest (if any).
 
-        self.dirname = None
+        :param unicode source_filename:
+
+        :param unicode target_filename:
+        '''
+        source_md5 = self._source_entries.get(self._GetName(source_filename, self.source_dir))
+        target_name = self._GetName(target_filename, self.target_dir)
+        with self._lock:
+            if self._target_entries.get(target_name) == source_md5:
+                return
+            if source_md5 is None:
+                del self._target_entries[target_name]
+            else:
+                self._target_entries[target_name] = source_md5
+            self._modified = True
 
 
-    def __enter__(self):
+    def Save(self):
         '''
-        :return unicode:
-            The path to the created temp file.
+        Writes the target manifest, if it changed, replacing the old one atomically.
         '''
-        if self.base_dir is None:
-            # If no base directoy was given, let us create a dir in system temp area
-            import tempfile
-            self.dirname = tempfile.mkdtemp(self.suffix, self.prefix)
-            return self.dirname
+        with self._lock:
+            if not self._modified:
+                return
+            contents = ''.join(
+                '%s=%s\n' % i for i in sorted(self._target_entries.items())
+            )
+            self._modified = False
 
+        temp_filename = self.target_manifest_filename + '.tmp'
+        CreateFile(temp_filename, contents)
+        _ReplaceFile(temp_filename, self.target_manifest_filename)
 
-        # Listing the files found in the base dir
-        existing_files = set(ListFiles(self.base_dir))
 
-        # If a base dir was given, let us generate a unique directory name there and use it
-        for random_component in IterHashes(iterator_size=self.maximum_attempts):
-            candidate_name = '%stemp_dir_%s%s' % (self.prefix, random_component, self.suffix)
-            candidate_path = os.path.join(self.base_dir, candidate_name)
-            if candidate_path not in existing_files:
-                CreateDirectory(candidate_path)
-                self.dirname = candidate_path
-                return self.dirname
+    def _Load(self, filename):
+        if not os.path.isfile(filename):
+            return Manifest()
+        return Manifest.Load(filename)
 
-        raise RuntimeError(
-            'It was not possible to obtain a temporary dirname from %s' % self.base_dir)
 
+    def _GetName(self, filename, root):
+        return os.path.relpath(filename, root).replace(os.sep, '/')
 
-    def __exit__(self, *args):
-        if self.dirname is not None:
-            DeleteDirectory(self.dirname, skip_on_error=True)
+
+def CreateMD5Manifest(directory, cache=None, workers=None):
+    '''
+    Creates the md5 manifest of a tree (MD5_MANIFEST_FILENAME, at its root), with all the files
+    under it.
+
+    .. seealso:: CopyFiles(md5_check='manifest')
+
+    :param unicode directory:
+
+    :param DigestCache cache:
+        .. seealso:: Md5Hex
+
+    :param int workers:
+        .. seealso:: HashFiles
+
+    :rtype: unicode
+    :returns:
+        The manifest filename.
+    '''
+    manifest_filename = os.path.join(directory, MD5_MANIFEST_FILENAME)
+    filenames = (
+        i for i in IterFindFiles(directory)
+        if os.path.isfile(i) and os.path.basename(i) != MD5_MANIFEST_FILENAME
+    )
+    entries = [
+        (os.path.relpath(i_filename, directory).replace(os.sep, '/'), i_digest)
+        for i_filename, i_digest in HashFiles(filenames, 'md5', workers=workers, cache=cache)
+    ]
+    contents = ''.join('%s=%s\n' % i for i in sorted(entries))
+
+    temp_filename = manifest_filename + '.tmp'
+    CreateFile(temp_filename, contents)
+    _ReplaceFile(temp_filename, manifest_filename)
+    return manifest_filename
 
 
 
 #===================================================================================================
-# CreateTemporaryFile
+# HashDirectory
 #===================================================================================================
-class CreateTemporaryFile(object):
+class DirectoryHash(object):
     '''
-    Context manager to create a temporary file and remove if at the context end.
+    A node of the Merkle tree built by HashDirectory.
 
-    :ivar unicode filename:
-        Name of the created file
+    The digest of a file is the digest of its contents, the digest of a link is the digest of the
+    path it points to, and the digest of a directory is derived from the kinds, names and digests of
+    its children. So two trees have the same root digest if (and only if, barring collisions) they
+    have the same contents.
+
+    Other entries (FIFOs, sockets and devices) are never read, since that could block or consume
+    their data: their digest is the digest of their type (and device number, for devices).
+
+    :ivar unicode name:
+        Entry name (the root has the name of the directory hashed).
+
+    :ivar unicode kind:
+        'file', 'directory', 'link' or 'special' (FIFOs, sockets and devices).
+
+    :ivar unicode digest:
+        Hex digest.
+
+    :ivar list(int)|None signature:
+        (st_size, st_mtime_ns, st_ino) of files, used to decide if they must be hashed again.
+
+    :ivar dict(unicode,DirectoryHash) children:
+        Entries of a directory, by name.
     '''
-    def __init__(
-        self,
-        contents,
-        eol_style=EOL_STYLE_NATIVE,
-        encoding=None,
-        suffix='',
-        prefix='tmp',
-        base_dir=None,
-        maximum_attempts=100):
-        '''
-        :param contents: .. seealso:: CreateFile
-        :param eol_style: .. seealso:: CreateFile
-        :param encoding: .. seealso:: CreateFile
 
-        :param unicode suffix:
-            A suffix to add in the name of the created file
+    def __init__(self, name, kind, digest, signature=None, children=None):
+        self.name = name
+        self.kind = kind
+        self.digest = digest
+        self.signature = signature
+        self.children = children if children is not None else {}
 
-        :param unicode prefix:
-            A prefix to add in the name of the created file
 
-        :param unicode base_dir:
-            A path to use as base in the created file. Uses temp dir if not given.
+    def Get(self, path):
+        '''
+        :param unicode path:
+            Relative path of a descendant, using "/" as separator.
 
-        :param int maximum_attemps:
-            The maximum number of attempts to obtain the temp file name.
+        :rtype: DirectoryHash|None
+        :returns:
+            The node, or None if it doesn't exist.
         '''
+        node = self
+        for i_name in path.split('/'):
+            if i_name:
+                node = node.children.get(i_name)
+                if node is None:
+                    return None
+        return node
 
-        import tempfile
 
-        self.contents = contents
-        self.eol_style = eol_style
-        self.encoding = encoding
-        self.suffix = suffix
-        self.prefix = prefix
-        self.base_dir = base_dir or tempfile.gettempdir()
-        self.maximum_attempts = maximum_attempts
+    def ToDict(self):
+        '''
+        :rtype: dict
+        :returns:
+            The tree, as JSON compatible objects.
+        '''
+        result = {'name': self.name, 'kind': self.kind, 'digest': self.digest}
+        if self.signature is not None:
+            result['signature'] = self.signature
+        if self.children:
+            result['children'] = [i.ToDict() for i in self.children.values()]
+        return result
+
+
+    @classmethod
+    def FromDict(cls, data):
+        '''
+        :param dict data:
+            .. seealso:: ToDict
 
-        self.filename = None
+        :rtype: DirectoryHash
+        '''
+        children = dict(
+            (i['name'], cls.FromDict(i)) for i in data.get('children', ())
+        )
+        return cls(data['name'], data['kind'], data['digest'], data.get('signature'), children)
 
 
-    def __enter__(self):
+    def ToJson(self):
         '''
-        :return unicode:
-            The path to the created temp file.
+        :rtype: unicode
+        :returns:
+            The tree serialized as JSON, to be given as `previous` to a later HashDirectory.
         '''
-        from ._exceptions import FileAlreadyExistsError
+        import json
+        return six.text_type(json.dumps(self.ToDict()))
 
-        for random_component in IterHashes(iterator_size=self.maximum_attempts):
-            filename = os.path.join(self.base_dir, self.prefix + random_component + self.suffix)
 
-            try:
-                CreateFile(
-                    filename=filename,
-                    contents=self.contents,
-                    eol_style=self.eol_style,
-                    encoding=self.encoding,
-                )
-                self.filename = filename
-                return filename
+    @classmethod
+    def FromJson(cls, contents):
+        '''
+        :param unicode contents:
+            A tree serialized by ToJson.
 
-            except FileAlreadyExistsError:
-                pass
+        :rtype: DirectoryHash
+        '''
+        import json
+        return cls.FromDict(json.loads(contents))
 
-        raise RuntimeError('It was not possible to obtain a temporary filename in "%s"' % self.base_dir)
 
+def HashDirectory(directory, algorithm='md5', previous=None, cache=None):
+    '''
+    Hashes a directory recursively, as a Merkle tree: the digest of each directory is derived from
+    the digests of its children.
 
-    def __exit__(self, *args):
-        if self.filename is not None:
-            DeleteFile(self.filename)
+    Given the tree of a previous run, only files whose stat signature (size, modification time and
+    inode) changed are hashed again, so finding out if anything changed under a big tree costs about
+    the same as walking it with stat.
 
+    :param unicode directory:
+        A local directory.
 
+    :param unicode algorithm:
+        .. seealso:: HashHex
 
-#===================================================================================================
-# DeleteDirectory
-#===================================================================================================
-def DeleteDirectory(directory, skip_on_error=False):
-    '''
-    Deletes a directory.
+    :param DirectoryHash|None previous:
+        The result of a previous call for the same directory (and algorithm).
 
-    :param unicode directory:
+    :param DigestCache cache:
+        If given, files not found in `previous` (or changed) are looked up in this cache before
+        hashing them.
 
-    :param bool skip_on_error:
-        If True, ignore any errors when trying to delete directory (for example, directory not
-        found)
+    :rtype: DirectoryHash
+    :returns:
+        The root of the tree.
 
-    :raises NotImplementedForRemotePathError:
-        If trying to delete a remote directory.
+    :raises DirectoryNotFoundError:
+        If the directory doesn't exist.
     '''
-    _AssertIsLocal(directory)
+    if not os.path.isdir(directory):
+        from ._exceptions import DirectoryNotFoundError
+        raise DirectoryNotFoundError(directory)
 
-    import shutil
-    def OnError(fn, path, excinfo):
-        '''
-        Remove the read-only flag and try to remove again.
-        On Windows, rmtree fails when trying to remove a read-only file. This fix it!
-        Another case: Read-only directories return True in os.access test. It seems that read-only
-        directories has it own flag (looking at the property windows on Explorer).
-        '''
-        if IsLink(path):
-            return
+    _NewHasher(algorithm)  # Fail early for unknown algorithms
+    name = os.path.basename(os.path.normpath(directory))
+    return _HashDirectoryNode(directory, name, algorithm, previous, cache)
 
-        if fn is os.remove and os.access(path, os.W_OK):
-            raise
 
-        # Make the file WRITEABLE and executes the original delete function (osfunc)
-        import stat
-        os.chmod(path, stat.S_IWRITE)
-        fn(path)
+def _HashDirectoryNode(directory, name, algorithm, previous, cache):
+    '''
+    .. seealso:: HashDirectory
 
-    try:
-        if not os.path.isdir(directory):
-            if skip_on_error:
-                return
-            from ._exceptions import DirectoryNotFoundError
-            raise DirectoryNotFoundError(directory)
-        shutil.rmtree(directory, onerror=OnError)
-    except:
-        if not skip_on_error:
-            raise  # Raise only if we are not skipping on error
+    :param unicode directory:
 
+    :param unicode name:
+        Name of the node.
 
+    :param DirectoryHash|None previous:
+        The previous node for this directory, if any.
 
-#===================================================================================================
-# GetMTime
-#===================================================================================================
-def GetMTime(path):
+    :rtype: DirectoryHash
     '''
-    :param unicode path:
-        Path to file or directory
-
-    :rtype: float
-    :returns:
-        Modification time for path.
+    import stat
 
-        If this is a directory, the highest mtime from files inside it will be returned.
+    if previous is not None and previous.kind != 'directory':
+        previous = None
 
-    @note:
-        In some Linux distros (such as CentOs, or anything with ext3), mtime will not return a value
-        with resolutions higher than a second.
+    children = {}
+    for i_name in os.listdir(directory):
+        path = os.path.join(directory, i_name)
+        stat_result = os.lstat(path)
+        previous_child = previous.children.get(i_name) if previous is not None else None
 
-        http://stackoverflow.com/questions/2428556/os-path-getmtime-doesnt-return-fraction-of-a-second
-    '''
-    _AssertIsLocal(path)
+        if stat.S_ISLNK(stat_result.st_mode):
+            digest = HashHex(contents=_EncodeName(os.readlink(path)), algorithm=algorithm)
+            children[i_name] = DirectoryHash(i_name, 'link', digest)
 
-    if os.path.isdir(path):
-        files = FindFiles(path)
+        elif stat.S_ISDIR(stat_result.st_mode):
+            children[i_name] = _HashDirectoryNode(path, i_name, algorithm, previous_child, cache)
 
-        if len(files) > 0:
-            return max(map(os.path.getmtime, files))
+        elif not stat.S_ISREG(stat_result.st_mode):
+            digest = HashHex(contents=_EncodeName(_DescribeSpecialFile(stat_result)), algorithm=algorithm)
+            children[i_name] = DirectoryHash(i_name, 'special', digest)
 
-    return os.path.getmtime(path)
+        else:
+            signature = [stat_result.st_size, _GetMTimeNs(stat_result), stat_result.st_ino]
+            if previous_child is not None and previous_child.kind == 'file' and \
+               previous_child.signature == signature:
+                digest = previous_child.digest
+            else:
+                digest = HashHex(path, algorithm=algorithm, cache=cache)
+            children[i_name] = DirectoryHash(i_name, 'file', digest, signature)
 
+    hasher = _NewHasher(algorithm)
+    for i_name in sorted(children):
+        child = children[i_name]
+        hasher.update(_EncodeName('%s\0%s\0%s\0' % (child.kind, i_name, child.digest)))
+    return DirectoryHash(name, 'directory', six.text_type(hasher.hexdigest()), children=children)
 
 
-#===================================================================================================
-# ListMappedNetworkDrives
-#===================================================================================================
-def ListMappedNetworkDrives():
+def _DescribeSpecialFile(stat_result):
     '''
-    On Windows, returns a list of mapped network drives
+    :param os.stat_result stat_result:
+        Of an entry that is neither a regular file, a directory nor a link.
 
-    :return: tuple(string, string, bool)
-        For each mapped netword drive, return 3 values tuple:
-            - the local drive
-            - the remote path-
-            - True if the mapping is enabled (warning: not reliable)
+    :rtype: unicode
+    :returns:
+        Its type, followed by the device number for devices (e.g.: 'char:1:3' for /dev/null).
     '''
-    if sys.platform != 'win32':
-        raise NotImplementedError
-    drives_list = []
-    netuse = _CallWindowsNetCommand(['use'])
-    for line in netuse.split(EOL_STYLE_WINDOWS):
-        match = re.match("(\w*)\s+(\w:)\s+(.+)", line.rstrip())
-        if match:
-            drives_list.append((match.group(2), match.group(3), match.group(1) == 'OK'))
-    return drives_list
+    import stat
 
+    mode = stat_result.st_mode
+    if stat.S_ISCHR(mode) or stat.S_ISBLK(mode):
+        kind = 'char' if stat.S_ISCHR(mode) else 'block'
+        return '%s:%d:%d' % (kind, os.major(stat_result.st_rdev), os.minor(stat_result.st_rdev))
+    if stat.S_ISFIFO(mode):
+        return 'fifo'
+    if stat.S_ISSOCK(mode):
+        return 'socket'
+    return 'unknown:%o' % (stat.S_IFMT(mode),)
 
 
-#===================================================================================================
-# DeleteLink
-#===================================================================================================
-def DeleteLink(path):
-    if sys.platform != 'win32':
-        os.unlink(path)
-    else:
-        from ._easyfs_win32 import RemoveDirectory as _RemoveDirectory, DeleteFile as _DeleteFile
-        if IsDir(path):
-            _RemoveDirectory(path)
-        else:
-            _DeleteFile(path)
+def _EncodeName(name):
+    '''
+    :param unicode|bytes name:
+        A filename (or text containing filenames).
+
+    :rtype: bytes
+    :returns:
+        The name encoded as utf-8 (undecodable names round-trip through surrogateescape).
+    '''
+    if isinstance(name, bytes):
+        return name
+    return name.encode('utf-8', 'surrogateescape' if six.PY3 else 'strict')
 
 
 
 #===================================================================================================
-# CreateLink
+# DigestCache
 #===================================================================================================
-def CreateLink(target_path, link_path, override=True):
+class DigestCache(object):
     '''
-    Create a symbolic link at `link_path` pointing to `target_path`.
+    Persistent cache of file digests, stored in a SQLite database.
 
-    :param unicode target_path:
-        Link target
+    Entries are keyed by (st_dev, st_ino, st_size, st_mtime_ns) and algorithm, so an unchanged file
+    costs a single stat, while any change to its size or modification time (or replacing it by
+    another file) makes it hashed again.
 
-    :param unicode link_path:
-        Fullpath to link name
+    Pass an instance as the `cache` parameter of Md5Hex, CreateMD5 and DumpDirHashToStringIO.
+    Instances can be shared between threads.
 
-    :param bool override:
-        If True and `link_path` already exists as a link, that link is overridden.
+    Changes are committed in batches, by Flush (called by HashFiles at the end of each run) and
+    Close: committing each new digest would cost a disk sync per file. A cache that isn't flushed
+    or closed loses the digests obtained since the last commit.
+
+    .. note:: Filesystems without stable inode numbers are never cached.
     '''
-    _AssertIsLocal(target_path)
-    _AssertIsLocal(link_path)
 
-    if override and IsLink(link_path):
-        DeleteLink(link_path)
+    def __init__(self, filename=':memory:', max_entries=100000):
+        '''
+        :param unicode filename:
+            The database file (created if missing). Defaults to an in-memory database, only useful
+            for the lifetime of this object.
 
-    # Create directories leading up to link
-    dirname = os.path.dirname(link_path)
-    if dirname:
-        CreateDirectory(dirname)
+        :param int max_entries:
+            Maximum number of digests kept. When exceeded, the least recently used are evicted.
+        '''
+        import sqlite3
+        import threading
+
+        self.filename = filename
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS digests ('
+            '    dev INTEGER, ino INTEGER, algorithm TEXT, size INTEGER, mtime_ns INTEGER,'
+            '    path TEXT, digest TEXT, last_used INTEGER,'
+            '    PRIMARY KEY (dev, ino, algorithm)'
+            ')'
+        )
+        self._connection.execute('CREATE INDEX IF NOT EXISTS digests_path ON digests (path)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS digests_last_used ON digests (last_used)')
+        self._connection.commit()
+        self._count, last_used = self._connection.execute(
+            'SELECT COUNT(*), MAX(last_used) FROM digests'
+        ).fetchone()
+        self._last_used = last_used or 0
+        self._hits = {}
 
-    if sys.platform != 'win32':
-        return os.symlink(target_path, link_path)  # @UndefinedVariable
-    else:
-        #import ntfsutils.junction
-        #return ntfsutils.junction.create(target_path, link_path)
 
-        import jaraco.windows.filesystem
-        return jaraco.windows.filesystem.symlink(target_path, link_path)
+    def __enter__(self):
+        return self
 
-        from ._easyfs_win32 import CreateSymbolicLink
-        try:
-            dw_flags = 0
-            if target_path and os.path.isdir(target_path):
-                dw_flags = 1
-            return CreateSymbolicLink(target_path, link_path, dw_flags)
-        except Exception as e:
-            reraise(e, 'Creating link "%(link_path)s" pointing to "%(target_path)s"' % locals())
 
+    def __exit__(self, *args):
+        self.Close()
 
 
-#===================================================================================================
-# IsLink
-#===================================================================================================
-def IsLink(path):
-    '''
-    :param unicode path:
-        Path being tested
+    def Close(self):
+        '''
+        Commits the pending changes and closes the database.
+        '''
+        with self._lock:
+            self._FlushHits()
+            self._connection.commit()
+            self._connection.close()
 
-    :returns bool:
-        True if `path` is a link
-    '''
-    _AssertIsLocal(path)
 
-    if sys.platform != 'win32':
-        return os.path.islink(path)
+    def Flush(self):
+        '''
+        Commits the new digests (and the recency of the cache hits) to the database.
+        '''
+        with self._lock:
+            self._FlushHits()
+            self._connection.commit()
 
-    import jaraco.windows.filesystem
-    return jaraco.windows.filesystem.islink(path)
 
+    def __len__(self):
+        return self._count
 
 
-#===================================================================================================
-# ReadLink
-#===================================================================================================
-def ReadLink(path):
-    '''
-    Read the target of the symbolic link at `path`.
+    def GetDigest(self, filename, algorithm='md5'):
+        '''
+        :param unicode filename:
+            A local file.
 
-    :param unicode path:
-        Path to a symbolic link
+        :param unicode algorithm:
+            .. seealso:: _NewHasher
 
-    :returns unicode:
-        Target of a symbolic link
-    '''
-    _AssertIsLocal(path)
+        :rtype: unicode
+        :returns:
+            The hex digest of the file contents, from the cache if the file hasn't changed since it
+            was last hashed.
+        '''
+        stat_result = os.stat(filename)
+        if not stat_result.st_ino:
+            return _HashFileHex(filename, algorithm)
+
+        key = (stat_result.st_dev, stat_result.st_ino, algorithm)
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT digest FROM digests WHERE dev=? AND ino=? AND algorithm=? AND size=? AND mtime_ns=?',
+                key + (stat_result.st_size, _GetMTimeNs(stat_result)),
+            ).fetchone()
+            if row is not None:
+                self._last_used += 1
+                self._hits[key] = self._last_used
+                return six.text_type(row[0])
+
+        digest = _HashFileHex(filename, algorithm)
+
+        # Don't store digests of files that changed while being hashed (comparing only the fields
+        # of the key: reading the file may have updated its access time)
+        if _GetStatKey(os.stat(filename)) != _GetStatKey(stat_result):
+            return digest
+
+        with self._lock:
+            self._last_used += 1
+            self._hits.pop(key, None)
+            replaced = self._connection.execute(
+                'DELETE FROM digests WHERE dev=? AND ino=? AND algorithm=?', key
+            ).rowcount
+            self._connection.execute(
+                'INSERT INTO digests VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                key + (
+                    stat_result.st_size,
+                    _GetMTimeNs(stat_result),
+                    os.path.abspath(filename),
+                    digest,
+                    self._last_used,
+                ),
+            )
+            self._count += 1 - replaced
+            self._FlushHits()
+            self._Evict()
+        return digest
+
+
+    def Invalidate(self, filename=None):
+        '''
+        Removes cached digests.
 
-    if sys.platform != 'win32':
-        return os.readlink(path)  # @UndefinedVariable
+        :param unicode|None filename:
+            The file whose digests are removed (even if it doesn't exist anymore). If None, removes
+            all digests.
+        '''
+        with self._lock:
+            if filename is None:
+                removed = self._connection.execute('DELETE FROM digests').rowcount
+            else:
+                removed = self._connection.execute(
+                    'DELETE FROM digests WHERE path=?', (os.path.abspath(filename),)
+                ).rowcount
+                try:
+                    stat_result = os.stat(filename)
+                except OSError:
+                    pass
+                else:
+                    removed += self._connection.execute(
+                        'DELETE FROM digests WHERE dev=? AND ino=?',
+                        (stat_result.st_dev, stat_result.st_ino),
+                    ).rowcount
+            self._count -= removed
+            self._connection.commit()
+
+
+    def _FlushHits(self):
+        '''
+        Writes the recency of the cache hits since the last flush (not committed). Must be called
+        with the lock.
+        '''
+        if self._hits:
+            self._connection.executemany(
+                'UPDATE digests SET last_used=? WHERE dev=? AND ino=? AND algorithm=?',
+                [(i_last_used,) + i_key for i_key, i_last_used in self._hits.items()],
+            )
+            self._hits.clear()
 
-    if not IsLink(path):
-        from ._exceptions import FileNotFoundError
-        raise FileNotFoundError(path)
 
-    import jaraco.windows.filesystem
-    result = jaraco.windows.filesystem.readlink(path)
-    if '\\??\\' in result:
-        result = result.split('\\??\\')[1]
-    return result
+    def _Evict(self):
+        '''
+        Removes the least recently used entries above max_entries. Must be called with the lock,
+        after _FlushHits.
+        '''
+        excess = self._count - self.max_entries
+        if excess > 0:
+            self._connection.execute(
+                'DELETE FROM digests WHERE rowid IN '
+                '(SELECT rowid FROM digests ORDER BY last_used LIMIT ?)',
+                (excess,),
+            )
+            self._count -= excess
+
 
 
 #===================================================================================================
-# Internal functions
+# Md5Hex
 #===================================================================================================
-def _UrlIsLocal(directory_url):
-    '''
-    :param ParseResult directory_url:
-        A parsed url as returned by urlparse.urlparse.
-
-    :rtype: bool
-    :returns:
-        Returns whether the given url refers to a local path.
-
-    .. note:: The "directory_url.scheme" is the drive letter for a local path on Windows and an empty string
-    for a local path on Linux. The other possible values are "http", "ftp", etc. So, checking if
-    the length is less than 2 characters long checks that the url is local.
+def Md5Hex(filename=None, contents=None, cache=None, chunk_size=None, stream=None):
     '''
-    return len(directory_url.scheme) < 2
-
+    :param unicode filename:
+        The file from which the md5 should be calculated. If the filename is given, the contents
+        should NOT be given.
 
-def _AssertIsLocal(path):
-    '''
-    Checks if a given path is local, raise an exception if not.
+    :param unicode contents:
+        The contents for which the md5 should be calculated. If the contents are given, the filename
+        should NOT be given.
 
-    This is used in filesystem functions that do not support remote operations yet.
+    :param file|iterable(bytes) stream:
+        An open binary file, a readable stream or an iterable of chunks for which the md5 should be
+        calculated. Consumed a chunk at a time, so memory usage doesn't depend on its size.
 
-    :param unicode path:
+    :param DigestCache cache:
+        If given, the md5 of an unchanged file is obtained from this cache.
 
-    :raises NotImplementedForRemotePathError:
-        If the given path is not local
-    '''
-    from six.moves.urllib.parse import urlparse
-    if not _UrlIsLocal(urlparse(path)):
-        from ._exceptions import NotImplementedForRemotePathError
-        raise NotImplementedForRemotePathError
+    :param int chunk_size:
+        Bytes hashed at a time (defaults to COPY_BUFFER_SIZE), read into a reused buffer of this
+        size. If HASH_MMAP_THRESHOLD is set, bigger files are hashed through a memory map instead.
 
+    :rtype: unicode
+    :returns:
+        Returns a string with the hex digest of the stream.
 
-def _HandleContentsEol(contents, eol_style):
+    .. seealso:: HashHex for other algorithms.
     '''
-    Replaces eol on each line by the given eol_style.
+    return HashHex(
+        filename=filename,
+        contents=contents,
+        algorithm='md5',
+        cache=cache,
+        chunk_size=chunk_size,
+        stream=stream,
+    )
 
-    :param unicode contents:
-    :type eol_style: EOL_STYLE_XXX constant
-    :param eol_style:
+
+
+#===================================================================================================
+# HashHex
+#===================================================================================================
+def HashHex(filename=None, contents=None, algorithm='md5', cache=None, chunk_size=None, stream=None):
     '''
-    if eol_style == EOL_STYLE_NONE:
-        return contents
+    Same as Md5Hex, with a selectable algorithm.
 
-    if eol_style == EOL_STYLE_UNIX:
-        return contents.replace('\r\n', eol_style).replace('\r', eol_style)
+    :param unicode filename:
+        .. seealso:: Md5Hex
 
-    if eol_style == EOL_STYLE_MAC:
-        return contents.replace('\r\n', eol_style).replace('\n', eol_style)
+    :param unicode contents:
+        .. seealso:: Md5Hex
 
-    if eol_style == EOL_STYLE_WINDOWS:
-        return contents.replace('\r\n', '\n').replace('\r', '\n').replace('\n', EOL_STYLE_WINDOWS)
+    :param file|iterable(bytes) stream:
+        .. seealso:: Md5Hex
 
-    raise ValueError('Unexpected eol style: %r' % (eol_style,))
+    :param unicode algorithm:
+        .. seealso:: _NewHasher
 
+    :param DigestCache cache:
+        .. seealso:: Md5Hex
 
-def _CallWindowsNetCommand(parameters):
-    '''
-    Call Windows NET command, used to acquire/configure network services settings.
+    :param int chunk_size:
+        .. seealso:: Md5Hex
 
-    :param parameters: list of command line parameters
+    :rtype: unicode
+    :returns:
+        Returns a string with the hex digest of the stream.
 
-    :return: command output
+    :raises ValueError:
+        If the algorithm is not available.
     '''
-    import subprocess
-    popen = subprocess.Popen(["net"] + parameters, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    stdoutdata, stderrdata = popen.communicate()
-    if stderrdata:
-        raise OSError("Failed on call net.exe: %s" % stderrdata)
-    return stdoutdata
+    if filename:
+        if cache is not None:
+            return cache.GetDigest(filename, algorithm)
+        return _HashFileHex(filename, algorithm, chunk_size=chunk_size)
+
+    hasher = _NewHasher(algorithm)
+    if stream is not None:
+        _HashChunks(stream, [hasher], chunk_size=chunk_size)
+    else:
+        hasher.update(contents)
+    return six.text_type(hasher.hexdigest())
 
 
 
 #===================================================================================================
-# ExtendedPathMask
+# HashingReader
 #===================================================================================================
-class ExtendedPathMask(object):
+class HashingReader(io.BufferedIOBase):
     '''
-    This class is a place-holder for functions that handle the extended path mask.
-
-    Extended Path Mask
-    ------------------
-
-    The extended path mask is a file search path description used to find files based on the filename.
-    This extended path mask includes the following features:
-        - Recursive search (prefix with a "+" sign)
-        - The possibility of adding more than one filter to match files (separated by ";")
-        - The possibility of negate an mask (prefix the mask with "!").
+    A binary stream wrapper that hashes the data as it is read, so contents can be consumed and
+    hashed in a single pass (e.g.: parsing a file while checking its md5).
 
-    The extended path mask has the following syntax:
+    Only the bytes returned to the reader are hashed: after reading the stream to its end the digest
+    is the one of the whole contents.
 
-        [+|-]<path>/<filter>(;<filter>)*
+    Usage:
+        with HashingReader(io.open(filename, 'rb'), 'sha256') as stream:
+            for line in stream:
+                ...
+            digest = stream.HexDigest()
 
-    Where:
-        + : recursive and copy-tree flag
-        - : recursive and copy-flat flag (copy files to the target directory with no tree structure)
-        <path> : a usual path, using '/' as separator
-        <filter> : A filename filter, as used in dir command:
-            Ex:
-                *.zip;*.rar
-                units.txt;*.ini
-                *.txt;!*-002.txt
+    .. seealso:: OpenFile(hash_algorithm=...)
     '''
 
+    def __init__(self, stream, algorithm='md5'):
+        '''
+        :param file stream:
+            A readable binary stream. Closed along with this reader.
 
-    @classmethod
-    def Split(cls, extended_path_mask):
+        :param unicode algorithm:
+            .. seealso:: HashHex
         '''
-        Splits the given path into their components: recursive, dirname, in_filters and out_filters
+        io.BufferedIOBase.__init__(self)
+        self._stream = stream
+        self.algorithm = algorithm
+        self._hasher = _NewHasher(algorithm)
 
-        :param str: extended_path_mask:
-            The "extended path mask" to split
 
-        :rtype: tuple(bool,bool,str,list(str),list(str))
+    def HexDigest(self):
+        '''
+        :rtype: unicode
         :returns:
-            Returns the extended path 5 components:
-            - The tree-recurse flag
-            - The flat-recurse flag
-            - The actual path
-            - A list of masks to include
-            - A list of masks to exclude
+            The hex digest of the bytes read so far.
         '''
-        import os.path
-        r_tree_recurse = extended_path_mask[0] in '+-'
-        r_flat_recurse = extended_path_mask[0] in '-'
+        return six.text_type(self._hasher.hexdigest())
 
-        r_dirname, r_filters = os.path.split(extended_path_mask)
-        if r_tree_recurse:
-            r_dirname = r_dirname[1:]
 
-        filters = r_filters.split(';')
-        r_in_filters = [i for i in filters if not i.startswith('!')]
-        r_out_filters = [i[1:] for i in filters if i.startswith('!')]
+    def _Hashed(self, data):
+        if data:
+            self._hasher.update(data)
+        return data
 
-        return r_tree_recurse, r_flat_recurse, r_dirname, r_in_filters, r_out_filters
 
+    def readable(self):
+        return True
 
 
-#===================================================================================================
-# CheckForUpdate
-#===================================================================================================
-def CheckForUpdate(source, target):
+    def read(self, size=-1):
+        return self._Hashed(self._stream.read(size))
+
+
+    def read1(self, size=-1):
+        read1 = getattr(self._stream, 'read1', self._stream.read)
+        return self._Hashed(read1(size))
+
+
+    def readinto(self, buffer_):
+        read = self._stream.readinto(buffer_)
+        if read:
+            self._hasher.update(memoryview(buffer_)[:read])
+        return read
+
+
+    def readline(self, size=-1):
+        return self._Hashed(self._stream.readline(size))
+
+
+    def fileno(self):
+        return self._stream.fileno()
+
+
+    def close(self):
+        if not self.closed:
+            try:
+                self._stream.close()
+            finally:
+                io.BufferedIOBase.close(self)
+
+
+
+def _HashChunks(source, hashers, chunk_size=None):
     '''
-    Checks if the given target filename should be re-generated because the source has changed.
-    :param source: the source filename.
-    :param target: the target filename.
-    :return bool:
-        True if the target is out-dated, False otherwise.
+    Updates hash objects with the contents of a stream or chunk iterable, without loading it all.
+
+    :param file|iterable(bytes) source:
+        A binary stream supporting readinto (e.g.: a file open in binary mode), any object with a
+        read method (e.g.: a socket file or a urllib response) or an iterable of bytes chunks.
+
+    :param iterable(hashlib.hash) hashers:
+
+    :param int|None chunk_size:
+        Bytes read per update from streams. Defaults to COPY_BUFFER_SIZE.
     '''
-    return \
-        not os.path.isfile(target) or \
-        os.path.getmtime(source) > os.path.getmtime(target)
+    hashers = list(hashers)
+    if hasattr(source, 'readinto'):
+        _HashStream(source, hashers, chunk_size=chunk_size)
+    elif hasattr(source, 'read'):
+        chunk_size = chunk_size or COPY_BUFFER_SIZE
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            for i_hasher in hashers:
+                i_hasher.update(chunk)
+    else:
+        for i_chunk in source:
+            for i_hasher in hashers:
+                i_hasher.update(i_chunk)
 
 
 
 #===================================================================================================
-# MatchMasks
+# QuickFingerprint
 #===================================================================================================
-def MatchMasks(filename, masks):
+def QuickFingerprint(filename, algorithm='md5', sample_size=None):
     '''
-    Verifies if a filename match with given patterns.
+    A cheap fingerprint of a file: its size plus the hash of its first, middle and last bytes.
 
-    :param str filename: The filename to match.
-    :param list(str) masks: The patterns to search in the filename.
-    :return bool:
-        True if the filename has matched with one pattern, False otherwise.
-    '''
-    import fnmatch
+    Reads at most 3 samples, whatever the file size, so it's near-instant even for huge files. Files
+    with different fingerprints are certainly different, but files with the same fingerprint may
+    differ outside the samples: use a full hash (e.g.: Md5Hex) when certainty is required.
 
-    if not isinstance(masks, (list, tuple)):
-        masks = [masks]
+    :param unicode filename:
+        A local file.
 
-    for i_mask in masks:
-        if fnmatch.fnmatch(filename, i_mask):
-            return True
-    return False
+    :param unicode algorithm:
+        .. seealso:: HashHex
 
+    :param int|None sample_size:
+        Bytes in each sample. Defaults to QUICK_FINGERPRINT_SAMPLE_SIZE.
 
+    :rtype: unicode
+    :returns:
+        "size:hexdigest"
 
-#===================================================================================================
-# FindFiles
-#===================================================================================================
-def FindFiles(dir_, in_filters=None, out_filters=None, recursive=True, include_root_dir=True, standard_paths=False):
+    .. seealso:: IsQuickFingerprintComplete
     '''
-    Searches for files in a given directory that match with the given patterns.
+    sample_size = sample_size or QUICK_FINGERPRINT_SAMPLE_SIZE
+    hasher = _NewHasher(algorithm)
+    with io.open(filename, 'rb') as stream:
+        size = os.fstat(stream.fileno()).st_size
+        if size <= 3 * sample_size:
+            _HashStream(stream, [hasher])
+        else:
+            for i_offset in (0, (size - sample_size) // 2, size - sample_size):
+                stream.seek(i_offset)
+                _HashStream(stream, [hasher], size=sample_size)
+    return six.text_type('%d:%s' % (size, hasher.hexdigest()))
 
-    :param str dir_: the directory root, to search the files.
-    :param list(str) in_filters: a list with patterns to match (default = all). E.g.: ['*.py']
-    :param list(str) out_filters: a list with patterns to ignore (default = none). E.g.: ['*.py']
-    :param bool recursive: if True search in subdirectories, otherwise, just in the root.
-    :param bool include_root_dir: if True, includes the directory being searched in the returned paths
-    :param bool standard_paths: if True, always uses unix path separators "/"
-    :return list(str):
-        A list of strings with the files that matched (with the full path in the filesystem).
+
+def IsQuickFingerprintComplete(filename, sample_size=None):
     '''
-    # all files
-    if in_filters is None:
-        in_filters = ['*']
+    :param unicode filename:
 
-    if out_filters is None:
-        out_filters = []
+    :param int|None sample_size:
+        .. seealso:: QuickFingerprint
 
-    result = []
+    :rtype: bool
+    :returns:
+        True if the QuickFingerprint of the file covers all its contents (small files), being as
+        certain as a full hash.
+    '''
+    return os.path.getsize(filename) <= 3 * (sample_size or QUICK_FINGERPRINT_SAMPLE_SIZE)
 
-    # maintain just files that don't have a pattern that match with out_filters
-    # walk through all directories based on dir
-    for dir_root, directories, filenames in os.walk(dir_):
 
-        for i_directory in directories[:]:
-            if MatchMasks(i_directory, out_filters):
-                directories.remove(i_directory)
+def _HaveSameContents(filename1, filename2, full=False):
+    '''
+    Compares two files, by QuickFingerprint first.
 
-        for filename in directories + filenames:
-            if MatchMasks(filename, in_filters) and not MatchMasks(filename, out_filters):
-                result.append(os.path.join(dir_root, filename))
+    :param unicode filename1:
 
-        if not recursive:
-            break
+    :param unicode filename2:
 
-    if not include_root_dir:
-        # Remove root dir from all paths
-        dir_prefix = len(dir_) + 1
-        result = [file[dir_prefix:] for file in result]
+    :param bool full:
+        If True, files with the same fingerprint are compared by their md5 as well (unless the
+        fingerprints already covered the whole files).
 
-    if standard_paths:
-        result = map(StandardizePath, result)
+    :rtype: bool
+    :returns:
+        True if both are local files with the same contents. False for remote files.
+    '''
+    from six.moves.urllib.parse import urlparse
+    if not (_UrlIsLocal(urlparse(filename1)) and _UrlIsLocal(urlparse(filename2))):
+        return False
+    if not (os.path.isfile(filename1) and os.path.isfile(filename2)):
+        return False
 
-    return result
+    if QuickFingerprint(filename1) != QuickFingerprint(filename2):
+        return False
+    if full and not IsQuickFingerprintComplete(filename1):
+        return Md5Hex(filename1) == Md5Hex(filename2)
+    return True
 
 
 
 #===================================================================================================
-# ExpandUser
+# HashFiles
 #===================================================================================================
-def ExpandUser(path):
+def HashFiles(paths, algorithm='md5', workers=None, ordered=True, use_processes=False, cache=None):
     '''
-    os.path.expanduser wrapper, necessary because it cannot handle unicode strings properly.
+    Hashes many files in parallel.
 
-    This is not necessary in Python 3.
+    hashlib releases the GIL while hashing large chunks, so threads hash several files at once. Use
+    processes for many small files, where the per-file overhead in Python dominates.
 
-    :param path:
-        .. seealso:: os.path.expanduser
-    '''
-    if six.PY2:
-        encoding = sys.getfilesystemencoding()
-        path = path.encode(encoding)
-    result = os.path.expanduser(path)
-    if six.PY2:
-        result = result.decode(encoding)
-    return result
+    `paths` is consumed as the files are hashed (a bounded number is queued at a time), so it can
+    be a generator (e.g.: IterFindFiles).
 
+    :param iterable(unicode) paths:
+        Local files to hash.
 
+    :param unicode algorithm:
+        .. seealso:: _NewHasher
 
-#===================================================================================================
-# DumpDirHashToStringIO
-#===================================================================================================
-def DumpDirHashToStringIO(directory, stringio, base='', exclude=None, include=None):
+    :param int workers:
+        Number of threads (or processes). Defaults to the number of CPUs.
+
+    :param bool ordered:
+        If True, the results are produced in the order of `paths`. Otherwise, in the order the
+        files finish hashing (faster to get the first results).
+
+    :param bool use_processes:
+        If True, uses a process pool instead of a thread pool.
+
+    :param DigestCache cache:
+        If given, unchanged files are obtained from this cache. Not supported with processes.
+
+        The new digests are committed at the end, all at once (@see DigestCache.Flush).
+
+    :rtype: iterator(tuple(unicode,unicode))
+    :returns:
+        Pairs of (path, hex digest).
+
+    :raises ValueError:
+        If the algorithm is not available, or cache is given with use_processes.
     '''
-    Helper to iterate over the files in a directory putting those in the passed StringIO in ini
-    format.
+    import collections
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-    :param unicode directory:
-        The directory for which the hash should be done.
+    _NewHasher(algorithm)  # Fail early for unknown algorithms
 
-    :param StringIO stringio:
-        The string to which the dump should be put.
+    if workers is None:
+        import multiprocessing
+        workers = multiprocessing.cpu_count()
 
-    :param unicode base:
-        If provided should be added (along with a '/') before the name=hash of file.
+    if use_processes:
+        if cache is not None:
+            raise ValueError('A DigestCache cannot be shared with processes.')
+        executor = ProcessPoolExecutor(max_workers=workers)
+        function = _HashFileHex
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+        function = _HashFileHex if cache is None else cache.GetDigest
 
-    :param unicode exclude:
-        Pattern to match files to exclude from the hashing. E.g.: *.gz
+    queue_size = workers * COPY_QUEUE_SIZE
+    try:
+        with executor:
+            pending = collections.OrderedDict()  # future: path, in the order submitted
+            try:
+                for i_path in paths:
+                    pending[executor.submit(function, i_path, algorithm)] = i_path
+                    while len(pending) >= queue_size:
+                        for i_result in _PopHashResults(pending, ordered):
+                            yield i_result
+
+                while pending:
+                    for i_result in _PopHashResults(pending, ordered):
+                        yield i_result
+            finally:
+                # Also reached when the caller stops iterating
+                for i_future in pending:
+                    i_future.cancel()
+    finally:
+        if cache is not None:
+            cache.Flush()  # A single commit for the whole run
 
-    :param unicode include:
-        Pattern to match files to include in the hashing. E.g.: *.zip
+
+def _PopHashResults(pending, ordered):
     '''
-    import fnmatch
-    import os
+    Waits for HashFiles results, removing them from `pending`.
 
-    files = [(os.path.join(directory, i), i) for i in os.listdir(directory)]
-    files = [i for i in files if os.path.isfile(i[0])]
-    for fullname, filename in files:
-        if include is not None:
-            if not fnmatch.fnmatch(fullname, include):
-                continue
+    :param OrderedDict(Future,unicode) pending:
 
-        if exclude is not None:
-            if fnmatch.fnmatch(fullname, exclude):
-                continue
+    :param bool ordered:
 
-        md5 = Md5Hex(fullname)
-        if base:
-            stringio.write('%s/%s=%s\n' % (base, filename, md5))
-        else:
-            stringio.write('%s=%s\n' % (filename, md5))
+    :rtype: list(tuple(unicode,unicode))
+    '''
+    from concurrent.futures import FIRST_COMPLETED, wait
 
+    if ordered:
+        future, path = next(iter(pending.items()))
+        del pending[future]
+        return [(path, future.result())]
 
+    done, _not_done = wait(list(pending), return_when=FIRST_COMPLETED)
+    return [(pending.pop(i_future), i_future.result()) for i_future in done]
 
-#===================================================================================================
-# Md5Hex
-#===================================================================================================
-def Md5Hex(filename=None, contents=None):
+
+def _HashFileHex(filename, algorithm, chunk_size=None):
     '''
     :param unicode filename:
-        The file from which the md5 should be calculated. If the filename is given, the contents
-        should NOT be given.
 
-    :param unicode contents:
-        The contents for which the md5 should be calculated. If the contents are given, the filename
-        should NOT be given.
+    :param unicode algorithm:
+
+    :param int|None chunk_size:
+        @see _HashFile
 
     :rtype: unicode
     :returns:
-        Returns a string with the hex digest of the stream.
-    '''
-    import io
-    import hashlib
-    md5 = hashlib.md5()
-
-    if filename:
-        stream = io.open(filename, 'rb')
-        try:
-            while True:
-                data = stream.read(md5.block_size * 128)
-                if not data:
-                    break
-                md5.update(data)
-        finally:
-            stream.close()
-
-    else:
-        md5.update(contents)
+        The hex digest of the file contents.
 
-    return six.text_type(md5.hexdigest())
+    .. note:: Module level, so it can be used by process pools.
+    '''
+    hasher = _NewHasher(algorithm)
+    _HashFile(filename, [hasher], chunk_size=chunk_size)
+    return six.text_type(hasher.hexdigest())
 
 
 
@@ -96,6 +96,24 @@ class FileAlreadyExistsError(FileError):
 
 
 
+#===================================================================================================
+# CloneNotSupportedError
+#===================================================================================================
+class CloneNotSupportedError(FileError):
+    def GetMessage(self, filename):
+        return 'Can\'t clone file "%s": reflinks not supported by the filesystem.' % filename
+
+
+
+#===================================================================================================
+# FileVerificationError
+#===================================================================================================
+class FileVerificationError(FileError):
+    def GetMessage(self, filename):
+        return 'File "%s" contents differ from its source after copying.' % filename
+
+
+
 #===================================================================================================
 # FileOnlyActionError
 #===================================================================================================